@@ -1,5 +1,9 @@
+from datetime import datetime
+
 import streamlit as st
-from database import init_db, get_all_domains, get_subdomains, get_new_subdomains
+from database import init_db
+from database.cache import get_domain_stats, get_recent_subdomains
+from database.snapshot import export_snapshot, load_manifest, snapshots_available, SNAPSHOT_DIR
 
 # Initiate database
 if "db_initialized" not in st.session_state:
@@ -10,25 +14,16 @@ if "db_initialized" not in st.session_state:
 st.set_page_config(page_title="Dashboard", layout="wide")
 st.title("Dashboard")
 
-# Get all domains
-domains = get_all_domains()
+# Get all domains with their statistics
+domains = get_domain_stats()
 
 if domains:
     # Calculate statistics
     total_domains = len(domains)
-    total_subdomains = 0
-    total_new = 0
-    total_dns_verified = 0
-    total_http_checked = 0
-    
-    for domain in domains:
-        subs = get_subdomains(domain['id'])
-        new_subs = get_new_subdomains(domain['id'])
-        
-        total_subdomains += len(subs)
-        total_new += len(new_subs)
-        total_dns_verified += len([s for s in subs if s['dns_checked'] == 1])
-        total_http_checked += len([s for s in subs if s['status_code'] is not None])
+    total_subdomains = sum(d['total'] for d in domains)
+    total_new = sum(d['new'] for d in domains)
+    total_dns_verified = sum(d['dns_verified'] for d in domains)
+    total_http_checked = sum(d['http_checked'] for d in domains)
     
     # Top metrics row
     col1, col2, col3, col4 = st.columns(4)
@@ -71,21 +66,16 @@ if domains:
     st.subheader("Domain Overview")
     
     for domain in domains:
-        subs = get_subdomains(domain['id'])
-        new_subs = get_new_subdomains(domain['id'])
-        dns_verified = len([s for s in subs if s['dns_checked'] == 1])
-        http_checked = len([s for s in subs if s['status_code'] is not None])
-        
-        with st.expander(f"{domain['name']} - {len(subs)} subdomains"):
+        with st.expander(f"{domain['name']} - {domain['total']} subdomains"):
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.write(f"**Total:** {len(subs)}")
-                st.write(f"**New:** {len(new_subs)}")
+                st.write(f"**Total:** {domain['total']}")
+                st.write(f"**New:** {domain['new']}")
             
             with col2:
-                st.write(f"**DNS Verified:** {dns_verified}")
-                st.write(f"**HTTP Checked:** {http_checked}")
+                st.write(f"**DNS Verified:** {domain['dns_verified']}")
+                st.write(f"**HTTP Checked:** {domain['http_checked']}")
             
             with col3:
                 interval_min = domain['scan_interval'] // 60
@@ -102,26 +92,49 @@ if domains:
     # Recent activity
     st.subheader("Recent Activity")
     
-    all_recent = []
-    for domain in domains:
-        subs = get_subdomains(domain['id'])
-        for sub in subs[:5]:  # Last 5 per domain
-            all_recent.append({
-                'domain': domain['name'],
-                'subdomain': sub['subdomain'],
-                'discovered': sub['discovered_at'],
-                'is_new': sub['is_new']
-            })
-    
-    # Sort by discovery date
-    all_recent.sort(key=lambda x: x['discovered'], reverse=True)
-    
-    if all_recent[:10]:
-        for item in all_recent[:10]:
+    recent = get_recent_subdomains(10)
+    
+    if recent:
+        for item in recent:
             status = "🆕" if item['is_new'] else "✅"
-            st.write(f"{status} `{item['subdomain']}` - {item['discovered'][:16]}")
+            st.write(f"{status} `{item['subdomain']}` - {item['discovered_at'][:16]}")
     else:
         st.info("No recent activity")
+    
+    st.divider()
+    
+    # Parquet snapshot for offline analytics
+    st.subheader("Analytics Snapshot")
+    
+    available = snapshots_available()
+    if not available:
+        st.warning("Parquet snapshots need pyarrow: `pip install -r requirements.txt`")
+    
+    snapshot_col1, snapshot_col2, snapshot_col3 = st.columns([4, 2, 2])
+    
+    with snapshot_col1:
+        snapshot_dir = st.text_input("Snapshot directory", value=SNAPSHOT_DIR, disabled=not available)
+    with snapshot_col2:
+        full_snapshot = st.checkbox("Full export", disabled=not available,
+                                    help="Rewrite everything instead of exporting the changes since the last snapshot")
+    with snapshot_col3:
+        export_clicked = st.button("Export Parquet", disabled=not available)
+    
+    if export_clicked:
+        try:
+            with st.spinner("Exporting snapshot..."):
+                summary = export_snapshot(snapshot_dir, full_snapshot)
+        except ImportError as e:
+            st.error(str(e))
+        except Exception as e:
+            st.error(f"Snapshot failed: {e}")
+        else:
+            st.success(f"Snapshot {summary['snapshot']}: {summary['domains']} domains exported, "
+                       f"{sum(summary['rows'].values())} rows in {summary['files']} files")
+    else:
+        manifest = load_manifest(snapshot_dir)
+        if manifest:
+            st.caption(f"Last snapshot {manifest['snapshot']} at {datetime.fromtimestamp(manifest['exported_at']):%Y-%m-%d %H:%M}")
 
 else:
     st.warning("No domains configured. Add a domain to get started!")
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Stand-in for subfinder that emits BENCH_COUNT JSON lines at BENCH_RATE lines/sec
+
+Accepts the same arguments the scanner passes (-d DOMAIN -json -silent).
+Hosts are named h<n>.<domain>, which the stub DNS server knows how to answer.
+"""
+import json
+import os
+import sys
+import time
+
+def main():
+    args = sys.argv[1:]
+    domain = args[args.index('-d') + 1] if '-d' in args else 'bench.test'
+    count = int(os.environ.get('BENCH_COUNT', 1000))
+    rate = float(os.environ.get('BENCH_RATE', 0))  # 0 = as fast as possible
+
+    started = time.monotonic()
+    out = sys.stdout
+
+    for i in range(count):
+        out.write(json.dumps({'host': f"h{i}.{domain}", 'input': domain, 'source': 'bench'}) + '\n')
+
+        if rate:
+            out.flush()
+            delay = started + (i + 1) / rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Local HTTP and HTTPS servers answering every bench host"""
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Status mix by stable hash of the Host header, as (share, status)
+STATUS_MIX = [(0.70, 200), (0.10, 301), (0.15, 404), (0.05, 500)]
+
+class HttpFarm:
+    """One threaded HTTP server and, if openssl is available, one HTTPS server
+
+    Every response has body_size bytes after latency seconds, with a status
+    taken from STATUS_MIX by the requested host.
+    """
+
+    def __init__(self, body_size=2048, latency=0.0, https=True):
+        self.body_size = body_size
+        self.latency = latency
+        self.https = https and shutil.which('openssl') is not None
+        self.ports = {}
+        self.requests = 0
+        self.ca_bundle = None  # Set to the self-signed cert once HTTPS is up
+
+        self._servers = []
+        self._tmpdir = None
+
+    def status(self, host):
+        """Stable status code for a host, drawn from STATUS_MIX"""
+        bucket = (zlib.crc32(host.encode()) % 1000) / 1000
+        for share, status in STATUS_MIX:
+            if bucket < share:
+                return status
+            bucket -= share
+        return STATUS_MIX[-1][1]
+
+    def _handler(self):
+        farm = self
+        head = b'<html><head><title>WhiteRabbit bench</title></head><body>'
+        body = head + b'x' * max(0, self.body_size - len(head))
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive
+
+            def _respond(self, with_body):
+                farm.requests += 1
+                if farm.latency:
+                    time.sleep(farm.latency)
+
+                host = self.headers.get('Host', '').split(':')[0]
+                # Redirect targets always answer 200
+                status = farm.status(host) if self.path == '/' else 200
+
+                self.send_response(status)
+                if status == 301:
+                    self.send_header('Location', '/home')
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if with_body:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def _server(self):
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                pass  # Clients hanging up mid-response are expected under load
+
+        return Server
+
+    def _certificate(self):
+        """Create a throwaway self-signed certificate"""
+        self._tmpdir = tempfile.mkdtemp(prefix='wr-bench-tls-')
+        cert = os.path.join(self._tmpdir, 'cert.pem')
+        key = os.path.join(self._tmpdir, 'key.pem')
+
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=bench.test', '-addext', 'subjectAltName=DNS:bench.test,DNS:*.bench.test',
+             '-keyout', key, '-out', cert],
+            check=True, capture_output=True
+        )
+        self.ca_bundle = cert
+        return cert, key
+
+    def _serve(self, protocol, server):
+        self._servers.append(server)
+        self.ports[protocol] = server.server_address[1]
+        threading.Thread(target=server.serve_forever, name=f"farm-{protocol}", daemon=True).start()
+
+    def start(self):
+        """Start the servers on ephemeral ports"""
+        self._serve('http', self._server()(('127.0.0.1', 0), self._handler()))
+
+        if self.https:
+            cert, key = self._certificate()
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+
+            server = self._server()(('127.0.0.1', 0), self._handler())
+            # Handshake in the handler thread, not in the accept loop
+            server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+            self._serve('https', server)
+
+        return self
+
+    def stop(self):
+        """Stop the servers and remove the certificate"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
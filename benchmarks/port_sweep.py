@@ -0,0 +1,100 @@
+"""Offline benchmark of the port scanner against local listeners
+
+Opens listeners on a few of the scanned ports and sweeps them on many
+loopback addresses (all of 127.0.0.0/8 reaches the same host on Linux):
+
+    python -m benchmarks.port_sweep --hosts 2000 --ports top1000 --open 5
+
+Prints one JSON report with attempts/sec and whether every open port was
+found. Closed loopback ports refuse at once, so this measures the scanner
+itself; against real hosts filtered ports cost PORT_TIMEOUT each.
+"""
+import argparse
+import json
+import logging
+import resource
+import socket
+import threading
+import time
+
+def open_listeners(ports, count):
+    """Listen on all interfaces on the first count ports that are free, returns (ports, sockets)"""
+    listening, sockets = [], []
+
+    for port in ports:
+        if len(listening) >= count:
+            break
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            server.bind(('0.0.0.0', port))
+        except OSError:
+            server.close()
+            continue
+
+        server.listen(4096)
+        listening.append(port)
+        sockets.append(server)
+        threading.Thread(target=accept_forever, args=(server,), daemon=True).start()
+
+    return listening, sockets
+
+def accept_forever(server):
+    """Accept and drop connections so the backlog never fills up"""
+    while True:
+        try:
+            connection, _ = server.accept()
+        except OSError:
+            return
+        connection.close()
+
+def loopback_hosts(count):
+    """Get count distinct loopback addresses, 127.0.0.1 first"""
+    return [f"127.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}" for i in range(1, count + 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WhiteRabbit port scanner offline")
+    parser.add_argument('--hosts', type=int, default=2000, help="Loopback addresses to sweep")
+    parser.add_argument('--ports', default='top1000', help="Port list, like a domain's port list")
+    parser.add_argument('--open', type=int, default=5, help="Listeners opened on scanned ports")
+    parser.add_argument('--concurrency', type=int, help="Attempts in flight, PORT_CONCURRENCY by default")
+    parser.add_argument('--timeout', type=float, help="Seconds per attempt, PORT_TIMEOUT by default")
+    parser.add_argument('--output', help="Write the JSON report to this file as well")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    from scanners.port_scanner import parse_ports, scan_batch
+
+    ports = parse_ports(args.ports)
+    hosts = loopback_hosts(args.hosts)
+    listening, sockets = open_listeners(ports, args.open)
+
+    started = time.perf_counter()
+    found = list(scan_batch(hosts, ports, concurrency=args.concurrency, timeout=args.timeout))
+    elapsed = time.perf_counter() - started
+
+    attempts = len(hosts) * len(ports)
+    report = {
+        'hosts': len(hosts),
+        'ports': len(ports),
+        'attempts': attempts,
+        'wall_time': round(elapsed, 3),
+        'attempts_per_sec': round(attempts / elapsed),
+        'listening': listening,
+        'open_found': len(found),
+        'open_expected': len(hosts) * len(listening),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+    for server in sockets:
+        server.close()
+
+    print(json.dumps(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Offline benchmark of the scan pipeline: subfinder -> check() -> db_manager
+
+Runs the real pipeline against a fake subfinder, a stub DNS server and a
+local HTTP(S) farm, and prints one machine-readable JSON report per size:
+
+    python -m benchmarks.run_pipeline --sizes 1000,10000,100000 --output bench.json
+
+Each size runs in its own process so peak RSS and in-memory caches don't
+leak between runs. Stage latencies are per call (a DNS or HTTP batch, a DB
+transaction), the *_item entries are per host completion times within a batch.
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+BENCH_DOMAIN = 'bench.test'
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values, None if empty"""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(durations):
+    """Reduce a list of durations (seconds) to calls/total/p50/p99"""
+    return {
+        'calls': len(durations),
+        'total': round(sum(durations), 4),
+        'p50': round(percentile(durations, 50), 6),
+        'p99': round(percentile(durations, 99), 6)
+    }
+
+def timed(stats, name, func):
+    """Wrap a function to record how long each call takes"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stats.setdefault(name, []).append(time.perf_counter() - started)
+    return wrapper
+
+def timed_stream(stats, name, func):
+    """Wrap a generator function to record call duration and per-item completion times"""
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        items = stats.setdefault(f"{name}_item", [])
+        try:
+            for item in func(*args, **kwargs):
+                items.append(time.perf_counter() - started)
+                yield item
+        finally:
+            stats.setdefault(name, []).append(time.perf_counter() - started)
+    return wrapper
+
+def install_fake_subfinder(workdir):
+    """Put a subfinder executable backed by fake_subfinder.py first on PATH"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_subfinder.py')
+    wrapper = os.path.join(workdir, 'subfinder')
+
+    with open(wrapper, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+    os.chmod(wrapper, 0o755)
+
+    os.environ['PATH'] = workdir + os.pathsep + os.environ.get('PATH', '')
+
+def resolve_bench_hosts_locally():
+    """Send connections to *.bench.test to the local farm, the OS resolver doesn't know them"""
+    original = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if isinstance(host, str) and host.endswith('.' + BENCH_DOMAIN):
+            host = '127.0.0.1'
+        return original(host, *args, **kwargs)
+
+    socket.getaddrinfo = getaddrinfo
+
+def run_single(args):
+    """Run the pipeline once for args.size hosts and return the report"""
+    from benchmarks.stub_dns import StubDnsServer
+    from benchmarks.http_farm import HttpFarm
+
+    workdir = tempfile.mkdtemp(prefix='wr-bench-')
+    os.environ['BENCH_COUNT'] = str(args.size)
+    os.environ['BENCH_RATE'] = str(args.rate)
+    install_fake_subfinder(workdir)
+    resolve_bench_hosts_locally()
+
+    dns_server = StubDnsServer(
+        latency=args.dns_latency,
+        nxdomain_ratio=args.nxdomain_ratio,
+        timeout_ratio=args.timeout_ratio,
+        cname_ratio=args.cname_ratio
+    ).start()
+    farm = HttpFarm(body_size=args.body_size, latency=args.http_latency, https=not args.no_https).start()
+    if farm.ca_bundle:
+        # An inherited REQUESTS_CA_BUNDLE overrides the prober's verify=False, make it trust the farm
+        os.environ['REQUESTS_CA_BUNDLE'] = farm.ca_bundle
+
+    import database.db_manager as db_manager
+    import telemetry
+    import scanners.checks as checks
+    import scanners.dns_engine as dns_engine
+    import scanners.http_prober as http_prober
+    import scanners.subfinder_integration as subfinder_integration
+
+    # Point the real pipeline at the local stubs
+    db_manager.DB_PATH = os.path.join(workdir, 'subdomains.db')
+    dns_engine.DNS_SERVERS = ['127.0.0.1']
+    dns_engine.DNS_PORT = dns_server.port
+    dns_engine.DNS_TIMEOUT = args.dns_timeout
+    http_prober.PROBE_PORTS = dict(farm.ports)
+    http_prober.PROTOCOLS = [p for p in http_prober.PROTOCOLS if p in farm.ports]
+    if args.probe_mode:
+        http_prober.HTTP_PROBE_MODE = args.probe_mode
+
+    # Instrument the stages without changing them
+    stats = {}
+    checks.resolve_batch = timed_stream(stats, 'dns', checks.resolve_batch)
+    checks.probe_batch = timed_stream(stats, 'http', checks.probe_batch)
+    checks.classify_wildcards = timed(stats, 'wildcard', checks.classify_wildcards)
+    checks.classify_takeovers = timed(stats, 'takeover', checks.classify_takeovers)
+    checks.check = timed(stats, 'check_batch', checks.check)
+
+    original_transaction = db_manager.transaction
+
+    @contextmanager
+    def timed_transaction(*targs, **tkwargs):
+        started = time.perf_counter()
+        try:
+            with original_transaction(*targs, **tkwargs) as conn:
+                yield conn
+        finally:
+            stats.setdefault('db_transaction', []).append(time.perf_counter() - started)
+
+    db_manager.transaction = timed_transaction
+
+    enumeration = {}
+
+    def stream(domain):
+        started = time.perf_counter()
+        for host in subfinder_integration.stream_subdomains_osint(domain):
+            enumeration.setdefault('first_host', time.perf_counter() - started)
+            yield host
+        enumeration['total'] = time.perf_counter() - started
+
+    db_manager.init_db()
+    db_manager.add_domain(BENCH_DOMAIN, ['subfinder'])
+    domain = db_manager.get_all_domains()[0]
+
+    started = time.perf_counter()
+    found = checks.check_stream(domain, stream(domain))
+    wall_time = time.perf_counter() - started
+
+    report = {
+        'size': args.size,
+        'found': found,
+        'wall_time': round(wall_time, 3),
+        'hosts_per_sec': round(found / wall_time, 1) if wall_time else None,
+        'enumeration': {k: round(v, 4) for k, v in enumeration.items()},
+        'stages': {name: summarize(durations) for name, durations in sorted(stats.items())},
+        'db_write_time': round(sum(stats.get('db_transaction', [])), 4),
+        'dns_queries': dns_server.queries,
+        'http_requests': farm.requests,
+        'http_bytes': int(sum(row['value'] for row in telemetry.snapshot(reset=False)[2] if row['name'] == 'http_bytes')),
+        'stats': {k: v for k, v in db_manager.get_domain_stats()[0].items()
+                  if k in ('total', 'dns_verified', 'http_checked')},
+        'takeovers': db_manager.count_subdomains(domain['id'], takeover=True)
+    }
+
+    if args.rescan:
+        # Steady state: every host is known, nothing new to insert
+        started = time.perf_counter()
+        checks.check_stream(domain, stream(domain))
+        report['rescan_wall_time'] = round(time.perf_counter() - started, 3)
+
+    # Known-subdomain index footprint, plain and with the Bloom filter in front
+    report['known_index'] = {}
+    for variant, bloom in (('sorted', False), ('bloom', True)):
+        known = checks.KnownIndex.load(domain['id'], bloom=bloom)
+        per_million = known.bytes_per_million()
+        report['known_index'][variant] = {
+            'bytes': known.memory_bytes(),
+            'mb_per_million': round(per_million / 1048576, 2) if per_million else None
+        }
+
+    # ru_maxrss is KB on Linux
+    report['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    farm.stop()
+    dns_server.stop()
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the WhiteRabbit scan pipeline offline")
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma separated host counts")
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)  # Single run in a child process
+    parser.add_argument('--rate', type=float, default=0, help="subfinder lines per second, 0 = unlimited")
+    parser.add_argument('--dns-latency', type=float, default=0.0, help="Seconds added to every DNS answer")
+    parser.add_argument('--dns-timeout', type=float, default=1.0, help="Resolver timeout per attempt")
+    parser.add_argument('--nxdomain-ratio', type=float, default=0.3, help="Share of hosts that don't resolve")
+    parser.add_argument('--timeout-ratio', type=float, default=0.0, help="Share of DNS queries dropped")
+    parser.add_argument('--cname-ratio', type=float, default=0.1, help="Share of hosts answered through a CNAME")
+    parser.add_argument('--http-latency', type=float, default=0.0, help="Seconds added to every HTTP response")
+    parser.add_argument('--body-size', type=int, default=2048, help="Bytes per HTTP response body")
+    parser.add_argument('--probe-mode', help="HTTP probe mode (head, content-length, capped, full)")
+    parser.add_argument('--no-https', action='store_true', help="Only run the plain HTTP server")
+    parser.add_argument('--rescan', action='store_true', help="Also time a second scan where every host is known")
+    parser.add_argument('--output', help="Write the JSON report to this file as well")
+    parser.add_argument('--verbose', action='store_true', help="Keep the scanner's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    if args.size:
+        print(json.dumps(run_single(args)))
+        return
+
+    # One child process per size, passing the other options through
+    passthrough = [
+        '--rate', str(args.rate),
+        '--dns-latency', str(args.dns_latency),
+        '--dns-timeout', str(args.dns_timeout),
+        '--nxdomain-ratio', str(args.nxdomain_ratio),
+        '--timeout-ratio', str(args.timeout_ratio),
+        '--cname-ratio', str(args.cname_ratio),
+        '--http-latency', str(args.http_latency),
+        '--body-size', str(args.body_size)
+    ]
+    if args.probe_mode:
+        passthrough += ['--probe-mode', args.probe_mode]
+    passthrough += [flag for flag, enabled in (('--no-https', args.no_https), ('--rescan', args.rescan),
+                                               ('--verbose', args.verbose)) if enabled]
+
+    results = []
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        child = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.run_pipeline', '--size', str(size)] + passthrough,
+            capture_output=True, text=True
+        )
+        if child.returncode != 0:
+            sys.stderr.write(child.stderr)
+            sys.exit(child.returncode)
+
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(json.dumps(result), flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'runs': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Local UDP DNS server with configurable latency, NXDOMAIN ratio, CNAME ratio, dropped queries and SERVFAIL"""
+import asyncio
+import random
+import socket
+import threading
+import zlib
+
+import dns.message
+import dns.rcode
+import dns.rrset
+
+# Target zone of CNAME answers, a provider whose dangling names can be claimed
+CNAME_ZONE = 'bench.cloudapp.net.'
+
+class StubDnsServer:
+    """Answers h<n>.<zone> with an A record, everything else with NXDOMAIN
+
+    nxdomain_ratio turns a stable share of h<n> names into NXDOMAIN,
+    cname_ratio answers a stable share of them through a CNAME to
+    h<n>.CNAME_ZONE (a dangling one for names that are also NXDOMAIN),
+    timeout_ratio drops that share of queries at random (the client retries),
+    servfail_ratio answers that share with SERVFAIL at random,
+    negative_ttl adds an SOA with that minimum TTL to NXDOMAIN answers,
+    latency delays every answer by that many seconds.
+
+    host and port pick where to listen, an ephemeral port on 127.0.0.1 by
+    default. Several servers on one port and different loopback addresses
+    act as several resolvers to one client.
+    """
+
+    def __init__(self, latency=0.0, nxdomain_ratio=0.0, timeout_ratio=0.0,
+                 address='127.0.0.1', ttl=300, cname_ratio=0.0, servfail_ratio=0.0,
+                 negative_ttl=None, host='127.0.0.1', port=None):
+        self.latency = latency
+        self.nxdomain_ratio = nxdomain_ratio
+        self.cname_ratio = cname_ratio
+        self.timeout_ratio = timeout_ratio
+        self.servfail_ratio = servfail_ratio
+        self.negative_ttl = negative_ttl
+        self.address = address
+        self.ttl = ttl
+        self.host = host
+        self.port = port
+        self.queries = 0
+
+        self._loop = None
+        self._thread = None
+
+    def _answer(self, wire):
+        """Build the response for one query, None to drop it"""
+        self.queries += 1
+
+        if self.timeout_ratio and random.random() < self.timeout_ratio:
+            return None
+
+        query = dns.message.from_wire(wire)
+        response = dns.message.make_response(query)
+        question = query.question[0]
+        name = question.name.to_text()
+
+        if self.servfail_ratio and random.random() < self.servfail_ratio:
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response.to_wire()
+
+        known = name.startswith('h') and name.split('.', 1)[0][1:].isdigit()
+        # Stable per name, so re-checks see the same answer
+        missing = (zlib.crc32(name.encode()) % 10000) < self.nxdomain_ratio * 10000
+        aliased = (zlib.crc32(name[::-1].encode()) % 10000) < self.cname_ratio * 10000
+
+        owner = question.name
+        if known and aliased:
+            target = name.split('.', 1)[0] + '.' + CNAME_ZONE
+            response.answer.append(dns.rrset.from_text(owner, self.ttl, 'IN', 'CNAME', target))
+            owner = target
+
+        if known and not missing:
+            response.answer.append(dns.rrset.from_text(owner, self.ttl, 'IN', 'A', self.address))
+        else:
+            response.set_rcode(dns.rcode.NXDOMAIN)
+            if self.negative_ttl is not None:
+                zone = question.name.parent()
+                soa = f"ns.{zone} hostmaster.{zone} 1 3600 600 86400 {self.negative_ttl}"
+                response.authority.append(dns.rrset.from_text(zone, self.ttl, 'IN', 'SOA', soa))
+
+        return response.to_wire()
+
+    def start(self):
+        """Start serving in a background thread, on an ephemeral port unless one was given"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        sock.bind((self.host, self.port or 0))
+        self.port = sock.getsockname()[1]
+
+        server = self
+        ready = threading.Event()
+
+        class Protocol(asyncio.DatagramProtocol):
+            def connection_made(self, transport):
+                self.transport = transport
+
+            def datagram_received(self, data, addr):
+                wire = server._answer(data)
+                if wire is None:
+                    return
+
+                if server.latency:
+                    server._loop.call_later(server.latency, self.transport.sendto, wire, addr)
+                else:
+                    self.transport.sendto(wire, addr)
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            transport, _ = self._loop.run_until_complete(self._loop.create_datagram_endpoint(Protocol, sock=sock))
+            ready.set()
+            self._loop.run_forever()
+
+            # Free the port for the next server
+            transport.close()
+            self._loop.run_until_complete(asyncio.sleep(0))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="stub-dns", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        """Stop serving and release the port"""
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
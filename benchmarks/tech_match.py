@@ -0,0 +1,233 @@
+"""Offline benchmark of technology fingerprinting over saved responses
+
+Matches a corpus of raw HTTP responses (status line, headers, blank line,
+body) against the signature set, once with the combined matchers and once
+running every pattern on its own:
+
+    python -m benchmarks.tech_match --responses 2000 --save corpus/
+    python -m benchmarks.tech_match --corpus corpus/
+
+Without --corpus a synthetic one is generated (filler HTML with a few
+technology markers per page). Bodies are cut to HTTP_SNIPPET_BYTES like
+the prober does. Prints one JSON report with responses and matches per
+second of both ways and whether they agree.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+SERVERS = [
+    'nginx/1.24.0', 'nginx', 'Apache/2.4.57 (Debian) OpenSSL/3.0.11', 'Apache/2.4.41 (Ubuntu)', 'cloudflare',
+    'Microsoft-IIS/10.0', 'gunicorn/21.2.0', 'AmazonS3', 'envoy', 'openresty/1.21.4.2', 'LiteSpeed', None
+]
+POWERED_BY = ['PHP/8.2.12', 'Express', 'ASP.NET', 'Next.js 14.0.3', None, None, None]
+COOKIES = ['PHPSESSID', 'JSESSIONID', 'laravel_session', '__cf_bm', 'AWSALB', 'csrftoken', 'session', 'lang']
+MARKERS = [
+    '<meta name="generator" content="WordPress 6.4.2" />',
+    '<link rel="stylesheet" href="/wp-content/themes/astra/style.css?ver=4.5.2">',
+    '<script src="https://code.jquery.com/jquery-3.7.1.min.js"></script>',
+    '<script src="/_next/static/chunks/main-3f2a.js" defer></script>',
+    '<div id="___gatsby"></div>',
+    '<script async src="https://www.googletagmanager.com/gtm.js?id=GTM-ABC123"></script>',
+    '<app-root ng-version="17.0.1"></app-root>',
+    '<link href="https://fonts.googleapis.com/css?family=Roboto" rel="stylesheet">',
+    '<script src="https://js.stripe.com/v3/"></script>',
+    '<script src="https://static.hotjar.com/c/hotjar-123.js"></script>',
+    '<link rel="stylesheet" href="/css/bootstrap.min.css">',
+    '<div data-v-1a2b3c4d class="app">',
+    '<input type="hidden" name="csrfmiddlewaretoken" value="x">',
+    '<script>window.__NUXT__={}</script>'
+]
+FILLER = [
+    '<div class="row">', '</div>', '<p>', '</p>', '<a href="/about">About us</a>', '<li class="nav-item">',
+    '<meta name="description" content="Welcome to our site">', '<img src="/images/logo.png" alt="logo">',
+    '<script src="/static/js/app.js"></script>', '<span>', '</span>', 'lorem', 'ipsum', 'dolor', 'sit', 'amet',
+    'consectetur', 'adipiscing', 'content', 'server', 'version', 'react', 'static', 'search', 'login'
+]
+
+def synthetic_corpus(count, body_size, seed):
+    """Generate count raw HTTP responses with filler bodies of about body_size bytes"""
+    rng = random.Random(seed)
+
+    for _ in range(count):
+        headers = ['HTTP/1.1 200 OK', 'Content-Type: text/html; charset=utf-8']
+        server = rng.choice(SERVERS)
+        if server:
+            headers.append(f"Server: {server}")
+        powered_by = rng.choice(POWERED_BY)
+        if powered_by:
+            headers.append(f"X-Powered-By: {powered_by}")
+        for cookie in rng.sample(COOKIES, rng.randint(0, 2)):
+            headers.append(f"Set-Cookie: {cookie}={rng.getrandbits(64):x}; Path=/; HttpOnly")
+
+        words = []
+        size = 0
+        while size < body_size:
+            word = rng.choice(FILLER)
+            words.append(word)
+            size += len(word) + 1
+        for marker in rng.sample(MARKERS, rng.randint(0, 4)):
+            words.insert(rng.randrange(len(words) + 1), marker)
+
+        body = "<html><head><title>Example</title></head><body>\n" + " ".join(words) + "\n</body></html>"
+        yield ("\r\n".join(headers) + "\r\n\r\n" + body).encode('utf-8')
+
+def parse_response(raw, body_limit):
+    """Split a raw HTTP response into (headers, cookies, body start)"""
+    head, _, body = raw.partition(b'\r\n\r\n')
+    if not _:
+        head, _, body = raw.partition(b'\n\n')
+
+    headers = {}
+    cookies = []
+    for line in head.decode('latin-1').splitlines()[1:]:
+        name, _, value = line.partition(':')
+        name, value = name.strip(), value.strip()
+
+        if name.lower() == 'set-cookie':
+            cookie_name, _, cookie_value = value.split(';', 1)[0].partition('=')
+            cookies.append((cookie_name.strip(), cookie_value.strip()))
+        else:
+            headers[name] = f"{headers[name]}, {value}" if name in headers else value
+
+    return headers, cookies, body[:body_limit]
+
+def load_corpus(path):
+    """Read every file of a directory as one raw response"""
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), 'rb') as f:
+            yield f.read()
+
+class SeparateMatcher:
+    """Baseline that runs every signature pattern on its own, same results as TechMatcher"""
+
+    def __init__(self, signatures):
+        self.signatures = []
+        for technology, signature in signatures.items():
+            self.signatures.append((
+                technology,
+                [(header.lower(), re.compile(pattern, re.IGNORECASE) if pattern else None)
+                 for header, pattern in signature.get('headers', {}).items()],
+                [re.compile(f"^(?:{cookie})=" + (f"(?:{pattern})" if pattern else ""), re.IGNORECASE)
+                 for cookie, pattern in signature.get('cookies', {}).items()],
+                [re.compile(pattern.encode('utf-8'), re.IGNORECASE) for pattern in signature.get('html', [])],
+                signature.get('implies', [])
+            ))
+
+    def match(self, headers, cookies, body):
+        headers = {name.lower(): value for name, value in headers.items()}
+        cookie_lines = [f"{name}={value}" for name, value in cookies]
+        found = {}
+
+        for technology, header_patterns, cookie_patterns, html_patterns, _ in self.signatures:
+            for header, regex in header_patterns:
+                if header in headers:
+                    match = regex.search(headers[header]) if regex else True
+                    if match:
+                        found[technology] = found.get(technology) or (match.group(1) if regex and regex.groups else None)
+
+            for regex in cookie_patterns:
+                if any(regex.search(line) for line in cookie_lines):
+                    found.setdefault(technology, None)
+
+            for regex in html_patterns:
+                match = regex.search(body)
+                if match:
+                    version = match.group(1) if regex.groups else None
+                    found[technology] = found.get(technology) or (version.decode('ascii', 'replace') if version else None)
+
+        implies = {technology: implied for technology, _, _, _, implied in self.signatures if implied}
+        pending = [technology for technology in found if technology in implies]
+        while pending:
+            for implied in implies[pending.pop()]:
+                if implied not in found:
+                    found[implied] = None
+                    if implied in implies:
+                        pending.append(implied)
+
+        return found
+
+def run(matcher, responses):
+    """Match all responses, returns (seconds, matches, results)"""
+    results = []
+    started = time.perf_counter()
+
+    for headers, cookies, body in responses:
+        results.append(matcher.match(headers, cookies, body))
+
+    elapsed = time.perf_counter() - started
+    return elapsed, sum(map(len, results)), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark WhiteRabbit technology fingerprinting offline")
+    parser.add_argument('--corpus', help="Directory of saved raw HTTP responses, one per file")
+    parser.add_argument('--responses', type=int, default=2000, help="Synthetic responses to generate")
+    parser.add_argument('--body-size', type=int, default=32768, help="Bytes of synthetic filler HTML per response")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--signatures', help="Signature file, the shipped one by default")
+    parser.add_argument('--save', help="Write the synthetic corpus to this directory")
+    parser.add_argument('--no-baseline', action='store_true', help="Skip the pattern-by-pattern baseline")
+    parser.add_argument('--output', help="Write the JSON report to this file as well")
+    args = parser.parse_args()
+
+    from scanners.http_prober import HTTP_SNIPPET_BYTES
+    from scanners.technologies import TECH_SIGNATURES_PATH, TechMatcher
+
+    if args.corpus:
+        raw = list(load_corpus(args.corpus))
+    else:
+        raw = list(synthetic_corpus(args.responses, args.body_size, args.seed))
+
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for i, response in enumerate(raw):
+            with open(os.path.join(args.save, f"{i:06d}.http"), 'wb') as f:
+                f.write(response)
+
+    with open(args.signatures or TECH_SIGNATURES_PATH, encoding='utf-8') as f:
+        signatures = json.load(f)
+
+    started = time.perf_counter()
+    matcher = TechMatcher(signatures)
+    compile_time = time.perf_counter() - started
+
+    responses = [parse_response(response, HTTP_SNIPPET_BYTES) for response in raw]
+    body_bytes = sum(len(body) for _, _, body in responses)
+    elapsed, matches, results = run(matcher, responses)
+
+    report = {
+        'responses': len(responses),
+        'signatures': len(signatures),
+        'body_mb': round(body_bytes / 1048576, 2),
+        'compile_seconds': round(compile_time, 4),
+        'combined': {
+            'seconds': round(elapsed, 3),
+            'responses_per_sec': round(len(responses) / elapsed),
+            'matches': matches,
+            'matches_per_sec': round(matches / elapsed),
+            'mb_per_sec': round(body_bytes / 1048576 / elapsed, 1)
+        }
+    }
+
+    if not args.no_baseline:
+        elapsed, matches, baseline = run(SeparateMatcher(signatures), responses)
+        report['separate'] = {
+            'seconds': round(elapsed, 3),
+            'responses_per_sec': round(len(responses) / elapsed),
+            'matches': matches,
+            'matches_per_sec': round(matches / elapsed),
+            'mb_per_sec': round(body_bytes / 1048576 / elapsed, 1)
+        }
+        report['speedup'] = round(report['separate']['seconds'] / report['combined']['seconds'], 1)
+        report['agree'] = sum(1 for a, b in zip(results, baseline) if set(a) == set(b))
+
+    print(json.dumps(report))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,71 @@
 from .db_manager import (
     init_db,
+    get_connection,
+    close_connection,
+    transaction,
     add_domain,
+    add_domains,
+    set_max_http_concurrency,
+    set_http_probe_mode,
+    set_port_list,
     get_all_domains,
+    get_domain,
+    get_domain_stats,
+    get_revisions,
+    get_recent_subdomains,
     delete_domain,
     add_subdomain,
+    add_subdomains,
     get_subdomains,
+    count_subdomains,
+    get_subdomains_page,
+    iter_subdomain_names,
+    iter_subdomain_rows,
+    read_snapshot,
+    get_table_columns,
+    get_snapshot_marks,
+    iter_subdomain_snapshot,
+    iter_change_snapshot,
+    iter_observation_snapshot,
     update_last_scan,
     get_new_subdomains,
     get_subdomain_id,
+    get_existing_subdomains,
+    save_open_ports,
+    get_open_ports,
+    get_technologies,
+    get_domain_technologies,
     mark_subdomain_as_dns_checked,
+    mark_subdomains_as_dns_checked,
+    mark_subdomains_as_wildcard,
+    save_cname_chains,
+    mark_subdomains_as_takeover,
     update_subdomain_http,
-    mark_subdomain_as_seen
+    update_subdomains_http,
+    mark_subdomain_as_seen,
+    mark_subdomains_as_seen,
+    get_max_subdomain_id,
+    mark_subdomains_as_seen_by_filter,
+    mark_all_subdomains_as_seen,
+    get_due_subdomains,
+    claim_due_subdomains,
+    record_subdomain_checks,
+    get_subdomain_changes,
+    get_subdomain_timeline,
+    compact_observations,
+    load_dns_cache,
+    save_dns_cache,
+    save_metrics,
+    get_metrics,
+    get_latest_metrics_period,
+    enqueue_scan_jobs,
+    enqueue_reverify_jobs,
+    claim_scan_jobs,
+    renew_job_leases,
+    finish_scan_job,
+    release_scan_job,
+    fail_scan_job,
+    get_next_job_due,
+    get_overdue_scans,
+    prune_scan_jobs
 )
\ No newline at end of file
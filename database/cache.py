@@ -0,0 +1,80 @@
+"""Cached reads for the dashboard pages, invalidated by data changes
+
+Streamlit reruns a page on every widget interaction. The reads here are
+kept in st.cache_data, keyed on the revision of the domains they cover
+(see get_revisions()), which triggers bump on every change a page can
+show, whether the worker or the page itself made it. A rerun with
+nothing changed costs one small query. Only the pages import this
+module, the worker keeps using db_manager directly.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import streamlit as st
+
+from . import db_manager
+
+# Cache Settings
+CACHE_MAX_ENTRIES = 512    # Cached results across all reads and sessions
+METRICS_GRANULARITY = 60   # Seconds a metrics range start is rounded down to, the worker flushes once a minute
+
+@st.cache_data(max_entries=CACHE_MAX_ENTRIES, show_spinner=False)
+def _read(name: str, revision, args: tuple, kwargs: tuple):
+    """Run a db_manager read, revision is only part of the cache key"""
+    return getattr(db_manager, name)(*args, **dict(kwargs))
+
+def _cached(name: str, revision, *args, **kwargs):
+    """Get a read from the cache, running it if revision changed since"""
+    return _read(name, revision, args, tuple(sorted(kwargs.items())))
+
+def _all_revisions() -> Tuple[Tuple[int, int], ...]:
+    """Revisions of every domain, also changes when a domain is added or deleted"""
+    return tuple(sorted(db_manager.get_revisions().items()))
+
+def _revision(domain_id: int) -> Optional[int]:
+    """Revision of one domain, None once it was deleted"""
+    return db_manager.get_revisions().get(domain_id)
+
+def clear():
+    """Drop every cached read"""
+    _read.clear()
+
+# Reads over all domains
+def get_all_domains() -> List[Dict]:
+    """Get all domains"""
+    return _cached('get_all_domains', _all_revisions())
+
+def get_domain_stats() -> List[Dict]:
+    """Get all domains with their subdomain statistics"""
+    return _cached('get_domain_stats', _all_revisions())
+
+def get_recent_subdomains(limit: int = 10) -> List[Dict]:
+    """Get the most recently discovered subdomains across all domains"""
+    return _cached('get_recent_subdomains', _all_revisions(), limit)
+
+# Reads of one domain
+def count_subdomains(domain_id: int, **filters) -> int:
+    """Count subdomains of a domain matching the filters"""
+    return _cached('count_subdomains', _revision(domain_id), domain_id, **filters)
+
+def get_subdomains_page(domain_id: int, **options) -> Tuple[List[Dict], Optional[Tuple]]:
+    """Get one page of filtered subdomains, see db_manager.get_subdomains_page()"""
+    return _cached('get_subdomains_page', _revision(domain_id), domain_id, **options)
+
+def get_domain_technologies(domain_id: int) -> List[Tuple[str, int]]:
+    """Get the technologies detected on a domain with their host counts"""
+    return _cached('get_domain_technologies', _revision(domain_id), domain_id)
+
+def get_open_ports(domain_id: int, subdomain_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """Get the open ports of subdomains of a domain"""
+    return _cached('get_open_ports', _revision(domain_id), tuple(subdomain_ids))
+
+def get_technologies(domain_id: int, subdomain_ids: Iterable[int]) -> Dict[int, Dict[str, Optional[str]]]:
+    """Get the technologies of subdomains of a domain"""
+    return _cached('get_technologies', _revision(domain_id), tuple(subdomain_ids))
+
+# Metrics only change when the worker flushes a period
+def get_metrics(since: float, names: Optional[List[str]] = None) -> List[Dict]:
+    """Get metric rows of periods starting after since, rounded down to METRICS_GRANULARITY"""
+    since -= since % METRICS_GRANULARITY
+    return _cached('get_metrics', db_manager.get_latest_metrics_period(), since,
+                   names=tuple(names) if names else None)
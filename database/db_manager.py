@@ -1,218 +1,1181 @@
+import json
+import os
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Optional
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import List, Dict, Optional, Iterable, Iterator, Set, Tuple
+from .migrations import migrate
+import telemetry
 
 DB_PATH = "data/subdomains.db"
+BATCH_SIZE = 500  # Rows per transaction in bulk writes
+INITIAL_CHECK_INTERVAL = 86400  # Seconds until a new subdomain is re-verified
+METRICS_RETENTION = 7 * 86400   # Seconds of performance metrics to keep
+
+# Job Leasing Settings
+JOB_LEASE = 300                 # Seconds a claimed job stays with its worker without a heartbeat
+MAX_JOB_ATTEMPTS = 3            # Claims of a job whose workers keep dying before it is given up
+JOB_RETENTION = 86400           # Seconds failed jobs are kept for inspection
+SUBDOMAIN_CLAIM_LEASE = 3600    # Seconds claimed re-verification hosts are hidden from other workers
+
+# Observation History Settings
+OBSERVATION_COMPACT_AFTER = int(os.environ.get("WHITERABBIT_OBSERVATION_COMPACT_DAYS", 30)) * 86400  # Seconds of full detail
+OBSERVATION_RETENTION = int(os.environ.get("WHITERABBIT_OBSERVATION_RETENTION_DAYS", 365)) * 86400   # Seconds of history kept
+OBSERVATION_SUMMARY_PERIOD = 86400  # Seconds compacted history is rolled up into, one row per host and period
+OBSERVATION_COMPACT_BATCH = 5000    # Subdomain ids compacted per transaction
+
+# WAL needs shared memory between processes, use DELETE when the file lives on a network filesystem
+JOURNAL_MODE = os.environ.get("WHITERABBIT_JOURNAL_MODE", "WAL")
+
+# Sort keys for paginated subdomain queries, NULLs mapped so keyset comparisons work
+SORT_COLUMNS = {
+    'discovered_at': "discovered_at",
+    'subdomain': "subdomain",
+    'status_code': "COALESCE(status_code, -1)",
+    'page_size': "COALESCE(page_size, -1)",
+    'last_checked': "COALESCE(last_checked, '')"
+}
+
+# Status code classes for filtering, None means no HTTP response
+STATUS_CLASSES = {
+    '1xx': (100, 199),
+    '2xx': (200, 299),
+    '3xx': (300, 399),
+    '4xx': (400, 499),
+    '5xx': (500, 599),
+    'none': None
+}
+
+# New subdomains for bulk triage. Rows under the review watermark keep is_new = 1,
+# marking them again would throw off domain_stats.new
+UNREVIEWED = "is_new = 1 AND id > (SELECT reviewed_up_to FROM domains WHERE domains.id = subdomains.domain_id)"
+
+# Per-connection performance settings, WAL itself is persistent and set by init_db
+PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",     # Safe with WAL, no fsync per commit
+    "PRAGMA cache_size = -65536",      # 64 MB page cache
+    "PRAGMA mmap_size = 268435456",    # 256 MB memory-mapped reads
+    "PRAGMA temp_store = MEMORY"
+]
+
+_local = threading.local()
+
+def get_connection() -> sqlite3.Connection:
+    """Get the persistent connection of the current thread"""
+    conn = getattr(_local, 'conn', None)
+
+    if conn is None or _local.path != DB_PATH:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        _local.conn = conn
+        _local.path = DB_PATH
+
+    return conn
+
+def close_connection():
+    """Close the persistent connection of the current thread"""
+    conn = getattr(_local, 'conn', None)
+
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+@contextmanager
+def transaction(immediate: bool = False):
+    """Commit on success, roll back on error. immediate takes the write lock up front"""
+    conn = get_connection()
+
+    with telemetry.timer('db_transaction_seconds', 'immediate' if immediate else 'deferred'), conn:
+        if immediate:
+            conn.execute("BEGIN IMMEDIATE")
+        yield conn
+
+def _chunks(items: Iterable, size: int = BATCH_SIZE):
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(items)
+
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 def init_db():
-    """Create database and tables"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    # Domains Table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS domains (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            scan_interval INTEGER DEFAULT 3600,
-            active_scanners TEXT,
-            enable_dns_check INTEGER DEFAULT 1,
-            enable_http_check INTEGER DEFAULT 1,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            last_scan TEXT
-        )
-    """)
-    
-    # Subdomains Table
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS subdomains (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            domain_id INTEGER NOT NULL,
-            subdomain TEXT NOT NULL,
-            discovered_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            last_checked TEXT,
-            status_code INTEGER,
-            dns_checked INTEGER DEFAULT 0,
-            page_size INTEGER,
-            screenshot_path TEXT,
-            is_new INTEGER DEFAULT 1,
-            FOREIGN KEY (domain_id) REFERENCES domains (id),
-            UNIQUE(domain_id, subdomain)
-        )
-    """)
-    
-    conn.commit()
-    conn.close()
-
-def add_domain(name: str, scanners: List[str], interval: int = 3600, 
-               enable_dns: bool = True, enable_http: bool = True) -> int:
-    """Add new domain"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    """Create database and tables, upgrade existing ones to the latest schema"""
+    conn = get_connection()
+
+    # Readers and the worker don't block each other in WAL mode
+    conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+    migrate(conn)
+
+def add_domain(name: str, scanners: List[str], interval: int = 3600,
+               enable_dns: bool = True, enable_http: bool = True,
+               max_http_concurrency: Optional[int] = None,
+               http_probe_mode: Optional[str] = None, port_list: Optional[str] = None) -> int:
+    """Add new domain, max_http_concurrency and http_probe_mode None use the prober defaults, port_list None skips port scans"""
     scanners_str = ",".join(scanners)
-    cursor.execute("""
-        INSERT INTO domains (name, scan_interval, active_scanners, enable_dns_check, enable_http_check)
-        VALUES (?, ?, ?, ?, ?)
-    """, (name, interval, scanners_str, 1 if enable_dns else 0, 1 if enable_http else 0))
-    
-    domain_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return domain_id
+
+    with transaction() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO domains (name, scan_interval, active_scanners, enable_dns_check, enable_http_check,
+                                 max_http_concurrency, http_probe_mode, port_list)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (name, interval, scanners_str, 1 if enable_dns else 0, 1 if enable_http else 0,
+              max_http_concurrency, http_probe_mode, port_list))
+
+    return cursor.lastrowid
+
+def add_domains(domains: Iterable[Dict]) -> int:
+    """Bulk add domains in one transaction, names that already exist are skipped
+
+    Each dict has name, scan_interval, enable_dns_check, enable_http_check
+    and max_http_concurrency. Returns how many domains were added.
+    """
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.executemany("""
+            INSERT OR IGNORE INTO domains (name, scan_interval, active_scanners, enable_dns_check, enable_http_check, max_http_concurrency)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(d['name'], d['scan_interval'], "subfinder", 1 if d['enable_dns_check'] else 0,
+               1 if d['enable_http_check'] else 0, d['max_http_concurrency']) for d in domains])
+
+    return cursor.rowcount
+
+def set_max_http_concurrency(domain_id: int, max_http_concurrency: Optional[int]):
+    """Set the HTTP concurrency ceiling of a domain, None for the prober default"""
+    with transaction() as conn:
+        conn.execute("UPDATE domains SET max_http_concurrency = ? WHERE id = ?", (max_http_concurrency, domain_id))
+
+def set_http_probe_mode(domain_id: int, http_probe_mode: Optional[str]):
+    """Set how much of each response the prober downloads for a domain, None for the prober default"""
+    with transaction() as conn:
+        conn.execute("UPDATE domains SET http_probe_mode = ? WHERE id = ?", (http_probe_mode, domain_id))
+
+def set_port_list(domain_id: int, port_list: Optional[str]):
+    """Set the ports scanned on a domain's hosts, None disables port scanning"""
+    with transaction() as conn:
+        conn.execute("UPDATE domains SET port_list = ? WHERE id = ?", (port_list, domain_id))
 
 def get_all_domains() -> List[Dict]:
     """Get all domains"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
     cursor.execute("SELECT * FROM domains")
-    domains = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    return domains
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_domain(domain_id: int) -> Optional[Dict]:
+    """Get one domain, None if it was deleted"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("SELECT * FROM domains WHERE id = ?", (domain_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+def get_domain_stats() -> List[Dict]:
+    """Get all domains with their subdomain statistics in one query"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("""
+        SELECT d.*,
+               COALESCE(ds.total, 0) AS total,
+               COALESCE(ds.new, 0) AS new,
+               COALESCE(ds.dns_verified, 0) AS dns_verified,
+               COALESCE(ds.http_checked, 0) AS http_checked,
+               ds.last_discovered
+        FROM domains d
+        LEFT JOIN domain_stats ds ON ds.domain_id = d.id
+        ORDER BY d.id
+    """)
+
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_revisions() -> Dict[int, int]:
+    """Get the revision of every domain as {domain_id: revision}, bumped by triggers on every visible change"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT domain_id, revision FROM domain_stats")
+    return dict(cursor.fetchall())
+
+def get_recent_subdomains(limit: int = 10) -> List[Dict]:
+    """Get the most recently discovered subdomains across all domains"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("""
+        SELECT s.*, d.name AS domain, d.reviewed_up_to
+        FROM subdomains s
+        JOIN domains d ON d.id = s.domain_id
+        ORDER BY s.discovered_at DESC
+        LIMIT ?
+    """, (limit,))
+
+    rows = [dict(row) for row in cursor.fetchall()]
+    for row in rows:
+        _derive_is_new([row], row.pop('reviewed_up_to'))
+
+    return rows
 
 def delete_domain(domain_id: int):
     """Delete domain and all subdomains"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM subdomains WHERE domain_id = ?", (domain_id,))
-    cursor.execute("DELETE FROM domains WHERE id = ?", (domain_id,))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        # Drop the stats row first so the per-row delete triggers have nothing to update
+        conn.execute("DELETE FROM domain_stats WHERE domain_id = ?", (domain_id,))
+        conn.execute("""
+            DELETE FROM subdomain_changes
+            WHERE subdomain_id IN (SELECT id FROM subdomains WHERE domain_id = ?)
+        """, (domain_id,))
+        conn.execute("""
+            DELETE FROM ports
+            WHERE subdomain_id IN (SELECT id FROM subdomains WHERE domain_id = ?)
+        """, (domain_id,))
+        conn.execute("""
+            DELETE FROM observations
+            WHERE subdomain_id IN (SELECT id FROM subdomains WHERE domain_id = ?)
+        """, (domain_id,))
+        conn.execute("""
+            DELETE FROM technologies
+            WHERE subdomain_id IN (SELECT id FROM subdomains WHERE domain_id = ?)
+        """, (domain_id,))
+        conn.execute("DELETE FROM subdomains WHERE domain_id = ?", (domain_id,))
+        conn.execute("DELETE FROM scan_jobs WHERE domain_id = ?", (domain_id,))
+        conn.execute("DELETE FROM domains WHERE id = ?", (domain_id,))
+
+def _first_check_at() -> str:
+    """Get the re-verification time for a subdomain discovered now"""
+    return (datetime.now() + timedelta(seconds=INITIAL_CHECK_INTERVAL)).isoformat()
 
 def add_subdomain(domain_id: int, subdomain: str) -> int:
     """Add subdomain"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     try:
-        cursor.execute("""
-            INSERT INTO subdomains (domain_id, subdomain)
-            VALUES (?, ?)
-        """, (domain_id, subdomain))
+        with transaction() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO subdomains (domain_id, subdomain, next_check_at, check_interval)
+                VALUES (?, ?, ?, ?)
+            """, (domain_id, subdomain, _first_check_at(), INITIAL_CHECK_INTERVAL))
         sub_id = cursor.lastrowid
-        conn.commit()
     except sqlite3.IntegrityError:
         sub_id = None
-    
-    conn.close()
+
     return sub_id
 
+def add_subdomains(domain_id: int, subdomains: Iterable[str]) -> Dict[str, int]:
+    """Bulk insert subdomains, returns {subdomain: id} of the ones that were new"""
+    new_ids = {}
+
+    for chunk in _chunks(subdomains):
+        next_check_at = _first_check_at()
+
+        with transaction(immediate=True) as conn:
+            cursor = conn.cursor()
+
+            # AUTOINCREMENT ids only grow, so rows above the old maximum are ours
+            cursor.execute("SELECT COALESCE(MAX(id), 0) FROM subdomains")
+            last_id = cursor.fetchone()[0]
+
+            cursor.executemany("""
+                INSERT OR IGNORE INTO subdomains (domain_id, subdomain, next_check_at, check_interval)
+                VALUES (?, ?, ?, ?)
+            """, [(domain_id, subdomain, next_check_at, INITIAL_CHECK_INTERVAL) for subdomain in chunk])
+
+            cursor.execute("""
+                SELECT id, subdomain FROM subdomains
+                WHERE id > ? AND domain_id = ?
+            """, (last_id, domain_id))
+            new_ids.update({subdomain: sub_id for sub_id, subdomain in cursor.fetchall()})
+
+    return new_ids
+
+def _reviewed_up_to(domain_id: int) -> int:
+    """Get the review watermark of a domain, 0 if nothing was bulk reviewed"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT reviewed_up_to FROM domains WHERE id = ?", (domain_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def _derive_is_new(rows: List[Dict], reviewed_up_to: int) -> List[Dict]:
+    """Set is_new of subdomain rows from their flag and the domain's review watermark"""
+    for row in rows:
+        row['is_new'] = 1 if row['is_new'] == 1 and row['id'] > reviewed_up_to else 0
+
+    return rows
+
 def get_subdomains(domain_id: int) -> List[Dict]:
     """Get all subdomains of a domain"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
     cursor.execute("""
-        SELECT * FROM subdomains 
-        WHERE domain_id = ? 
+        SELECT * FROM subdomains
+        WHERE domain_id = ?
         ORDER BY discovered_at DESC
     """, (domain_id,))
-    
-    subdomains = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return subdomains
+
+    return _derive_is_new([dict(row) for row in cursor.fetchall()], _reviewed_up_to(domain_id))
+
+def _subdomain_filters(domain_id: int, is_new: Optional[bool] = None,
+                       dns_checked: Optional[bool] = None, status_class: Optional[str] = None,
+                       search: Optional[str] = None, is_wildcard: Optional[bool] = None,
+                       technology: Optional[str] = None, takeover: Optional[bool] = None) -> Tuple[str, list]:
+    """Build the WHERE clause and parameters for filtered subdomain queries"""
+    clauses = ["domain_id = ?"]
+    params = [domain_id]
+
+    if is_new is not None:
+        # New means flagged and above the domain's review watermark
+        clauses.append(("" if is_new else "NOT ") +
+                       "(is_new = 1 AND id > (SELECT reviewed_up_to FROM domains WHERE id = ?))")
+        params.append(domain_id)
+
+    if dns_checked is not None:
+        clauses.append("dns_checked = ?")
+        params.append(1 if dns_checked else 0)
+
+    if is_wildcard is not None:
+        clauses.append("is_wildcard = ?")
+        params.append(1 if is_wildcard else 0)
+
+    if takeover is not None:
+        clauses.append("takeover IS NOT NULL" if takeover else "takeover IS NULL")
+
+    if status_class:
+        if status_class not in STATUS_CLASSES:
+            raise ValueError(f"Unknown status class: {status_class}")
+
+        status_range = STATUS_CLASSES[status_class]
+        if status_range:
+            clauses.append("status_code BETWEEN ? AND ?")
+            params.extend(status_range)
+        else:
+            clauses.append("status_code IS NULL")
+
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("subdomain LIKE ? ESCAPE '\\'")
+        params.append(f"%{escaped}%")
+
+    if technology:
+        clauses.append("id IN (SELECT subdomain_id FROM technologies WHERE name = ?)")
+        params.append(technology)
+
+    return " AND ".join(clauses), params
+
+def count_subdomains(domain_id: int, **filters) -> int:
+    """Count subdomains of a domain matching the filters"""
+    where, params = _subdomain_filters(domain_id, **filters)
+    cursor = get_connection().cursor()
+
+    cursor.execute(f"SELECT COUNT(*) FROM subdomains WHERE {where}", params)
+    return cursor.fetchone()[0]
+
+def get_subdomains_page(domain_id: int, sort: str = 'discovered_at', descending: bool = True,
+                        after: Optional[Tuple] = None, limit: int = 100,
+                        **filters) -> Tuple[List[Dict], Optional[Tuple]]:
+    """Get one page of filtered subdomains using keyset pagination
+
+    Returns the rows and the cursor for the next page (None on the last page).
+    Pass that cursor as after to continue, cost stays the same on every page.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Unknown sort column: {sort}")
+
+    sort_key = SORT_COLUMNS[sort]
+    direction = "DESC" if descending else "ASC"
+    where, params = _subdomain_filters(domain_id, **filters)
+
+    if after is not None:
+        where += f" AND ({sort_key}, id) {'<' if descending else '>'} (?, ?)"
+        params.extend(after)
+
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute(f"""
+        SELECT *, {sort_key} AS sort_key FROM subdomains
+        WHERE {where}
+        ORDER BY {sort_key} {direction}, id {direction}
+        LIMIT ?
+    """, params + [limit + 1])
+
+    rows = [dict(row) for row in cursor.fetchall()]
+    next_cursor = None
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1]['sort_key'], rows[-1]['id'])
+
+    for row in rows:
+        del row['sort_key']
+
+    return _derive_is_new(rows, _reviewed_up_to(domain_id)), next_cursor
+
+def iter_subdomain_names(domain_id: int, chunk_size: int = BATCH_SIZE, **filters):
+    """Yield names of filtered subdomains without loading them all at once"""
+    where, params = _subdomain_filters(domain_id, **filters)
+    cursor = get_connection().cursor()
+
+    cursor.execute(f"SELECT subdomain FROM subdomains WHERE {where} ORDER BY subdomain", params)
+
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        for row in rows:
+            yield row[0]
+
+def iter_subdomain_rows(domain_id: int, chunk_size: int = BATCH_SIZE,
+                        **filters) -> Tuple[List[str], Iterator[List[tuple]]]:
+    """Stream all columns of filtered subdomains, returns (column names, chunks of row tuples)"""
+    where, params = _subdomain_filters(domain_id, **filters)
+    cursor = get_connection().cursor()
+
+    reviewed_up_to = _reviewed_up_to(domain_id)
+    cursor.execute(f"SELECT * FROM subdomains WHERE {where} ORDER BY id", params)
+    columns = [column[0] for column in cursor.description]
+    id_index, new_index = columns.index('id'), columns.index('is_new')
+
+    def chunks():
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            if reviewed_up_to:
+                # Rows under the review watermark are seen whatever their flag says
+                rows = [row[:new_index] + (0,) + row[new_index + 1:] if row[id_index] <= reviewed_up_to else row
+                        for row in rows]
+            yield rows
+
+    return columns, chunks()
+
+def _fetch_chunks(cursor: sqlite3.Cursor, chunk_size: int) -> Iterator[List[tuple]]:
+    """Yield the remaining rows of a cursor in lists of at most chunk_size"""
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+@contextmanager
+def read_snapshot():
+    """Hold one read transaction, every read inside sees the same state of the database
+
+    In WAL mode the worker keeps writing meanwhile, it only can't
+    checkpoint past the snapshot until it ends.
+    """
+    conn = get_connection()
+    conn.execute("BEGIN")
+
+    try:
+        yield conn
+    finally:
+        conn.rollback()
+
+def get_table_columns(table: str) -> List[Tuple[str, str]]:
+    """Get the (name, declared type) of every column of a table"""
+    cursor = get_connection().cursor()
+
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [(row[1], row[2]) for row in cursor.fetchall()]
+
+def get_snapshot_marks() -> Dict[str, int]:
+    """Get the highest subdomain and change ids, rows above them were added after a snapshot"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("""
+        SELECT (SELECT MAX(id) FROM subdomains), (SELECT MAX(id) FROM subdomain_changes)
+    """)
+    max_subdomain_id, max_change_id = cursor.fetchone()
+    return {'max_subdomain_id': max_subdomain_id or 0, 'max_change_id': max_change_id or 0}
+
+def iter_subdomain_snapshot(domain_id: int, after_id: int = 0, updated_since: Optional[int] = None,
+                            reviewed: Tuple[int, int] = (0, 0),
+                            chunk_size: int = BATCH_SIZE) -> Tuple[List[str], Iterator[List[tuple]]]:
+    """Stream the subdomains of a domain changed since a snapshot, ordered by discovered_at
+
+    Without updated_since every row is included, else rows added after
+    after_id, changed since updated_since or moved under the review
+    watermark between the two ids of reviewed. Returns (column names,
+    chunks of row tuples) like iter_subdomain_rows().
+    """
+    where, params = "domain_id = ?", [domain_id]
+    if updated_since is not None:
+        where += " AND (id > ? OR updated_at >= ? OR (id > ? AND id <= ?))"
+        params += [after_id, updated_since, min(reviewed), max(reviewed)]
+
+    reviewed_up_to = _reviewed_up_to(domain_id)
+    cursor = get_connection().cursor()
+    cursor.execute(f"SELECT * FROM subdomains WHERE {where} ORDER BY discovered_at, id", params)
+    columns = [column[0] for column in cursor.description]
+    id_index, new_index = columns.index('id'), columns.index('is_new')
+
+    def chunks():
+        for rows in _fetch_chunks(cursor, chunk_size):
+            if reviewed_up_to:
+                rows = [row[:new_index] + (0,) + row[new_index + 1:] if row[id_index] <= reviewed_up_to else row
+                        for row in rows]
+            yield rows
+
+    return columns, chunks()
+
+def iter_change_snapshot(domain_id: int, after_id: int = 0,
+                         chunk_size: int = BATCH_SIZE) -> Tuple[List[str], Iterator[List[tuple]]]:
+    """Stream the recorded transitions of a domain's subdomains above after_id, ordered by changed_at"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("""
+        SELECT c.*, s.domain_id FROM subdomain_changes c
+        JOIN subdomains s ON s.id = c.subdomain_id
+        WHERE s.domain_id = ? AND c.id > ?
+        ORDER BY c.changed_at, c.id
+    """, (domain_id, after_id))
+
+    return [column[0] for column in cursor.description], _fetch_chunks(cursor, chunk_size)
+
+def iter_observation_snapshot(domain_id: int, since: int = 0,
+                              chunk_size: int = BATCH_SIZE) -> Tuple[List[str], Iterator[List[tuple]]]:
+    """Stream the observation history of a domain's subdomains from since on, ordered by observed_at"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("""
+        SELECT o.*, s.domain_id FROM subdomains s
+        JOIN observations o ON o.subdomain_id = s.id AND o.observed_at >= ?
+        WHERE s.domain_id = ?
+        ORDER BY o.observed_at, o.subdomain_id
+    """, (since, domain_id))
+
+    return [column[0] for column in cursor.description], _fetch_chunks(cursor, chunk_size)
 
 def update_last_scan(domain_id: int):
     """Update last_scan timestamp"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE domains 
-        SET last_scan = ? 
-        WHERE id = ?
-    """, (datetime.now().isoformat(), domain_id))
-    
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+            UPDATE domains
+            SET last_scan = ?
+            WHERE id = ?
+        """, (datetime.now().isoformat(), domain_id))
 
 def get_subdomain_id(domain_id: int, subdomain: str) -> int:
     """Get subdomain ID by domain_id and subdomain name"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    cursor = get_connection().cursor()
+
     cursor.execute("""
-        SELECT id FROM subdomains 
+        SELECT id FROM subdomains
         WHERE domain_id = ? AND subdomain = ?
     """, (domain_id, subdomain))
-    
+
     result = cursor.fetchone()
-    conn.close()
-    
     return result[0] if result else None
 
+def get_existing_subdomains(domain_id: int, subdomains: Iterable[str]) -> Set[str]:
+    """Get which of the given subdomain names are already stored"""
+    existing = set()
+    cursor = get_connection().cursor()
+
+    for chunk in _chunks(subdomains, 500):
+        cursor.execute(f"""
+            SELECT subdomain FROM subdomains
+            WHERE domain_id = ? AND subdomain IN ({','.join('?' * len(chunk))})
+        """, (domain_id, *chunk))
+        existing.update(row[0] for row in cursor.fetchall())
+
+    return existing
+
 def mark_subdomain_as_dns_checked(subdomain_id: int):
-    """Mark subdomain as DNS checked"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE subdomains 
-        SET dns_checked = 1 
-        WHERE id = ?
-    """, (subdomain_id,))
-    
-    conn.commit()
-    conn.close()
+    """Set dns_checked to 1"""
+    mark_subdomains_as_dns_checked([subdomain_id])
+
+def mark_subdomains_as_dns_checked(subdomain_ids: Iterable[int]):
+    """Bulk set dns_checked to 1, one commit per chunk"""
+    for chunk in _chunks(subdomain_ids):
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET dns_checked = 1
+                WHERE id = ?
+            """, [(subdomain_id,) for subdomain_id in chunk])
+
+def mark_subdomains_as_wildcard(subdomain_ids: Iterable[int], is_wildcard: bool = True):
+    """Bulk set the wildcard DNS classification, one commit per chunk"""
+    for chunk in _chunks(subdomain_ids):
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET is_wildcard = ?
+                WHERE id = ?
+            """, [(1 if is_wildcard else 0, subdomain_id) for subdomain_id in chunk])
+
+def save_cname_chains(chains: Iterable[Tuple[int, List[str], Optional[str]]]):
+    """Bulk store CNAME chains and their takeover classification given as (subdomain_id, chain, provider or None)"""
+    for chunk in _chunks(chains):
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET cname = ?, takeover = ?
+                WHERE id = ?
+            """, [(",".join(chain) or None, takeover, subdomain_id) for subdomain_id, chain, takeover in chunk])
+
+def mark_subdomains_as_takeover(takeovers: Iterable[Tuple[int, str]]):
+    """Bulk flag subdomains as takeover candidates given as (subdomain_id, provider), one commit per chunk"""
+    for chunk in _chunks(takeovers):
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET takeover = ?
+                WHERE id = ?
+            """, [(takeover, subdomain_id) for subdomain_id, takeover in chunk])
 
 def update_subdomain_http(subdomain_id: int, status_code: int, page_size: int):
     """Update HTTP check results"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        UPDATE subdomains 
-        SET status_code = ?, page_size = ?, last_checked = ?
-        WHERE id = ?
-    """, (status_code, page_size, datetime.now().isoformat(), subdomain_id))
-    
-    conn.commit()
-    conn.close()
+    update_subdomains_http([(subdomain_id, {'status_code': status_code, 'page_size': page_size})])
+
+def _save_technologies(conn: sqlite3.Connection, rows: Iterable[Tuple[int, str, Optional[str]]], seen_at: str):
+    """Store detected technologies given as (subdomain_id, name, version), known ones get a new last_seen"""
+    conn.executemany("""
+        INSERT INTO technologies (subdomain_id, name, version, first_seen, last_seen)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (subdomain_id, name) DO UPDATE
+        SET version = COALESCE(excluded.version, version), last_seen = excluded.last_seen
+    """, [(subdomain_id, name, version, seen_at, seen_at) for subdomain_id, name, version in rows])
+
+def update_subdomains_http(results: Iterable[Tuple[int, Dict]]):
+    """Bulk update HTTP check results given as (subdomain_id, probe result)
+
+    A probe result has status_code, page_size and optionally the response
+    fingerprint (body_hash, title, final_url and redirect_count) and the
+    detected technologies as {name: version}.
+    """
+    for chunk in _chunks(results):
+        checked_at = datetime.now().isoformat()
+
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET status_code = ?, page_size = ?, body_hash = ?, title = ?, final_url = ?, redirect_count = ?,
+                    last_checked = ?
+                WHERE id = ?
+            """, [(r['status_code'], r['page_size'], r.get('body_hash'), r.get('title'), r.get('final_url'),
+                   r.get('redirect_count'), checked_at, subdomain_id)
+                  for subdomain_id, r in chunk])
+
+            _save_technologies(conn, (
+                (subdomain_id, name, version)
+                for subdomain_id, r in chunk
+                for name, version in (r.get('technologies') or {}).items()
+            ), checked_at)
+
+def save_open_ports(ports: Iterable[Tuple[int, str, int]]):
+    """Bulk store open ports given as (subdomain_id, ip, port), known ones get a new last_seen"""
+    for chunk in _chunks(ports):
+        seen_at = datetime.now().isoformat()
+
+        with transaction() as conn:
+            conn.executemany("""
+                INSERT INTO ports (subdomain_id, port, ip, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (subdomain_id, port, ip) DO UPDATE SET last_seen = excluded.last_seen
+            """, [(subdomain_id, port, ip, seen_at, seen_at) for subdomain_id, ip, port in chunk])
+
+def get_open_ports(subdomain_ids: Iterable[int]) -> Dict[int, List[int]]:
+    """Get the open ports of subdomains as {subdomain_id: sorted ports}"""
+    ports = {}
+    cursor = get_connection().cursor()
+
+    for chunk in _chunks(subdomain_ids):
+        cursor.execute(f"""
+            SELECT DISTINCT subdomain_id, port FROM ports
+            WHERE subdomain_id IN ({','.join('?' * len(chunk))})
+            ORDER BY subdomain_id, port
+        """, chunk)
+        for subdomain_id, port in cursor.fetchall():
+            ports.setdefault(subdomain_id, []).append(port)
+
+    return ports
+
+def get_technologies(subdomain_ids: Iterable[int]) -> Dict[int, Dict[str, Optional[str]]]:
+    """Get the detected technologies of subdomains as {subdomain_id: {name: version}}"""
+    technologies = {}
+    cursor = get_connection().cursor()
+
+    for chunk in _chunks(subdomain_ids):
+        cursor.execute(f"""
+            SELECT subdomain_id, name, version FROM technologies
+            WHERE subdomain_id IN ({','.join('?' * len(chunk))})
+            ORDER BY subdomain_id, name
+        """, chunk)
+        for subdomain_id, name, version in cursor.fetchall():
+            technologies.setdefault(subdomain_id, {})[name] = version
+
+    return technologies
+
+def get_domain_technologies(domain_id: int) -> List[Tuple[str, int]]:
+    """Get the technologies seen on a domain's subdomains with their host counts, most common first"""
+    cursor = get_connection().cursor()
 
-def mark_subdomain_as_dns_checked(subdomain_id: int):
-    """Set dns_checked to 1"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
     cursor.execute("""
-        UPDATE subdomains 
-        SET dns_checked = 1
-        WHERE id = ?
-    """, (subdomain_id,))
-    
-    conn.commit()
-    conn.close()
+        SELECT t.name, COUNT(*) AS hosts FROM technologies t
+        JOIN subdomains s ON s.id = t.subdomain_id
+        WHERE s.domain_id = ?
+        GROUP BY t.name
+        ORDER BY hosts DESC, t.name
+    """, (domain_id,))
+
+    return cursor.fetchall()
 
 def get_new_subdomains(domain_id: int) -> List[Dict]:
-    """Get only new subdomains"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT * FROM subdomains 
-        WHERE domain_id = ? AND is_new = 1
+    """Get only new subdomains, flagged and above the review watermark"""
+    where, params = _subdomain_filters(domain_id, is_new=True)
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute(f"""
+        SELECT * FROM subdomains
+        WHERE {where}
         ORDER BY discovered_at DESC
-    """, (domain_id,))
-    
+    """, params)
+
     return [dict(row) for row in cursor.fetchall()]
 
 def mark_subdomain_as_seen(subdomain_id: int):
     """Mark subdomain as not new anymore"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    mark_subdomains_as_seen([subdomain_id])
+
+def mark_subdomains_as_seen(subdomain_ids: Iterable[int]) -> int:
+    """Mark subdomains as seen in one statement however many there are, returns how many were new"""
+    with transaction() as conn:
+        cursor = conn.execute(f"""
+            UPDATE subdomains
+            SET is_new = 0
+            WHERE id IN (SELECT value FROM json_each(?)) AND {UNREVIEWED}
+        """, (json.dumps(list(subdomain_ids)),))
+
+        return cursor.rowcount
+
+def get_max_subdomain_id() -> int:
+    """Get the highest subdomain id, subdomains added later have higher ones"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM subdomains")
+    return cursor.fetchone()[0]
+
+def mark_subdomains_as_seen_by_filter(domain_id: int, up_to: Optional[int] = None, **filters) -> int:
+    """Mark the new subdomains of a domain matching the filters as seen, returns how many
+
+    up_to limits it to ids up to that one, so hosts added after a page was shown stay new.
+    """
+    where, params = _subdomain_filters(domain_id, **filters)
+    if up_to is not None:
+        where += " AND id <= ?"
+        params.append(up_to)
+
+    with transaction() as conn:
+        cursor = conn.execute(f"UPDATE subdomains SET is_new = 0 WHERE {where} AND {UNREVIEWED}", params)
+        return cursor.rowcount
+
+def mark_all_subdomains_as_seen(domain_id: int, up_to: Optional[int] = None) -> int:
+    """Mark every current subdomain of a domain as seen by moving its review watermark, a single-row update
+
+    up_to caps the watermark, pass get_max_subdomain_id() from when the
+    subdomains were shown so hosts added since stay new. Returns the new
+    watermark, later subdomains have higher ids and stay new.
+    """
+    with transaction() as conn:
+        cursor = conn.execute("""
+            UPDATE domains
+            SET reviewed_up_to = MAX(reviewed_up_to, MIN(COALESCE(?, max_id), max_id))
+            FROM (SELECT COALESCE(MAX(id), 0) AS max_id FROM subdomains WHERE domain_id = ?)
+            WHERE id = ?
+            RETURNING reviewed_up_to
+        """, (up_to, domain_id, domain_id))
+
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+def get_due_subdomains(domain_id: int, limit: int = 1000) -> List[Dict]:
+    """Get known subdomains whose next re-verification is due, most overdue first"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("""
+        SELECT * FROM subdomains
+        WHERE domain_id = ? AND next_check_at <= ?
+        ORDER BY next_check_at
+        LIMIT ?
+    """, (domain_id, datetime.now().isoformat(), limit))
+
+    return [dict(row) for row in cursor.fetchall()]
+
+def claim_due_subdomains(domain_id: int, limit: int = 1000,
+                         lease: int = SUBDOMAIN_CLAIM_LEASE) -> List[Dict]:
+    """Atomically take due subdomains for re-verification, most overdue first
+
+    Their next_check_at moves lease seconds ahead, so concurrent workers get
+    disjoint batches and hosts of a crashed worker come due again later.
+    record_subdomain_checks() then sets the real next check.
+    """
+    now = datetime.now()
+
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+
+        cursor.execute("""
+            UPDATE subdomains
+            SET next_check_at = ?
+            WHERE id IN (
+                SELECT id FROM subdomains
+                WHERE domain_id = ? AND next_check_at <= ?
+                ORDER BY next_check_at
+                LIMIT ?
+            )
+            RETURNING *
+        """, ((now + timedelta(seconds=lease)).isoformat(), domain_id, now.isoformat(), limit))
+
+        return [dict(row) for row in cursor.fetchall()]
+
+def record_subdomain_checks(checks: Iterable[Dict]):
+    """Bulk store re-verification results and their transitions
+
+    Each check is a dict with id, dns_checked, is_wildcard, status_code,
+    page_size, the fingerprint (body_hash, title, final_url, redirect_count),
+    cname (comma-joined chain), takeover, check_interval (seconds until the
+    next check) and changes, a list of (field, old_value, new_value) tuples,
+    optionally technologies as {name: version}.
+    """
+    for chunk in _chunks(checks):
+        now = datetime.now()
+        checked_at = now.isoformat()
+
+        with transaction() as conn:
+            conn.executemany("""
+                UPDATE subdomains
+                SET dns_checked = ?, is_wildcard = ?, status_code = ?, page_size = ?,
+                    body_hash = ?, title = ?, final_url = ?, redirect_count = ?, cname = ?, takeover = ?,
+                    last_checked = ?, next_check_at = ?, check_interval = ?
+                WHERE id = ?
+            """, [(c['dns_checked'], c['is_wildcard'], c['status_code'], c['page_size'],
+                   c['body_hash'], c['title'], c['final_url'], c['redirect_count'], c['cname'], c['takeover'], checked_at,
+                   (now + timedelta(seconds=c['check_interval'])).isoformat(), c['check_interval'], c['id'])
+                  for c in chunk])
+
+            conn.executemany("""
+                INSERT INTO subdomain_changes (subdomain_id, changed_at, field, old_value, new_value)
+                VALUES (?, ?, ?, ?, ?)
+            """, [(c['id'], checked_at, field, old_value, new_value)
+                  for c in chunk for field, old_value, new_value in c['changes']])
+
+            _save_technologies(conn, (
+                (c['id'], name, version)
+                for c in chunk
+                for name, version in (c.get('technologies') or {}).items()
+            ), checked_at)
+
+def get_subdomain_changes(subdomain_id: int, limit: int = 100) -> List[Dict]:
+    """Get the latest recorded transitions of a subdomain"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("""
+        SELECT * FROM subdomain_changes
+        WHERE subdomain_id = ?
+        ORDER BY changed_at DESC
+        LIMIT ?
+    """, (subdomain_id, limit))
+
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_subdomain_timeline(subdomain_id: int, limit: int = 100) -> List[Dict]:
+    """Get the latest observed states of a subdomain, newest first
+
+    Rows are state changes, dns is 0 when the host is down, 1 when it
+    resolves and 2 for a wildcard match, changes counts the transitions a
+    compacted row stands for. observed_at is a unix timestamp.
+    """
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    cursor.execute("""
+        SELECT observed_at, dns, status_code, page_size, changes FROM observations
+        WHERE subdomain_id = ?
+        ORDER BY observed_at DESC
+        LIMIT ?
+    """, (subdomain_id, limit))
+
+    return [dict(row) for row in cursor.fetchall()]
+
+def compact_observations(now: Optional[float] = None) -> Dict[str, int]:
+    """Roll up old observation history and drop what is past retention
+
+    Rows older than OBSERVATION_COMPACT_AFTER are merged into one per host
+    and OBSERVATION_SUMMARY_PERIOD, the period's last state with the sum of
+    its changes. Rows older than OBSERVATION_RETENTION are dropped, except
+    each host's latest, which is still its current state. Works through
+    the table in ranges of subdomain ids so writers are never held up long.
+    Returns the number of rows merged and expired.
+    """
+    now = time.time() if now is None else now
+    # Only whole periods are rolled up, so each is compacted once
+    cutoff = int(now - OBSERVATION_COMPACT_AFTER) // OBSERVATION_SUMMARY_PERIOD * OBSERVATION_SUMMARY_PERIOD
+    expire_before = int(now - OBSERVATION_RETENTION)
+    merged = expired = 0
+
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT MAX(subdomain_id) FROM observations")
+    last_id = cursor.fetchone()[0] or 0
+
+    for low in range(0, last_id, OBSERVATION_COMPACT_BATCH):
+        high = low + OBSERVATION_COMPACT_BATCH
+
+        with transaction() as conn:
+            conn.execute("""
+                UPDATE observations
+                SET changes = period.total
+                FROM (
+                    SELECT subdomain_id, MAX(observed_at) AS last, SUM(changes) AS total
+                    FROM observations
+                    WHERE subdomain_id > ? AND subdomain_id <= ? AND observed_at < ?
+                    GROUP BY subdomain_id, observed_at / ?
+                    HAVING COUNT(*) > 1
+                ) AS period
+                WHERE observations.subdomain_id = period.subdomain_id AND observations.observed_at = period.last
+            """, (low, high, cutoff, OBSERVATION_SUMMARY_PERIOD))
+
+            # Every row but the last of its period, the cutoff is a period boundary
+            merged += conn.execute("""
+                DELETE FROM observations
+                WHERE subdomain_id > ? AND subdomain_id <= ? AND observed_at < ?
+                AND EXISTS (
+                    SELECT 1 FROM observations later
+                    WHERE later.subdomain_id = observations.subdomain_id
+                    AND later.observed_at > observations.observed_at
+                    AND later.observed_at < (observations.observed_at / ? + 1) * ?
+                )
+            """, (low, high, cutoff, OBSERVATION_SUMMARY_PERIOD, OBSERVATION_SUMMARY_PERIOD)).rowcount
+
+            expired += conn.execute("""
+                DELETE FROM observations
+                WHERE subdomain_id > ? AND subdomain_id <= ? AND observed_at < ?
+                AND observed_at < (
+                    SELECT MAX(observed_at) FROM observations latest
+                    WHERE latest.subdomain_id = observations.subdomain_id
+                )
+            """, (low, high, expire_before)).rowcount
+
+    return {'merged': merged, 'expired': expired}
+
+def load_dns_cache(limit: int = 100000) -> List[Tuple[str, str, str, float, str]]:
+    """Get unexpired DNS cache entries as (name, status, addresses, expires_at, cname), longest lived first"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("""
+        SELECT name, status, addresses, expires_at, cname FROM dns_cache
+        WHERE expires_at > ?
+        ORDER BY expires_at DESC
+        LIMIT ?
+    """, (time.time(), limit))
+
+    return cursor.fetchall()
+
+def save_dns_cache(entries: Iterable[Tuple[str, str, str, float, str]]):
+    """Bulk upsert DNS cache entries given as (name, status, addresses, expires_at, cname) and drop expired ones"""
+    for chunk in _chunks(entries):
+        with transaction() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO dns_cache (name, status, addresses, expires_at, cname)
+                VALUES (?, ?, ?, ?, ?)
+            """, chunk)
+
+    with transaction() as conn:
+        conn.execute("DELETE FROM dns_cache WHERE expires_at <= ?", (time.time(),))
+
+def save_metrics(period_start: float, period: float, rows: Iterable[Dict]):
+    """Store one flush period of telemetry rows and drop periods older than METRICS_RETENTION"""
+    with transaction() as conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO metrics (period_start, period, name, label, kind, value, count, p50, p95, p99, max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(period_start, period, row['name'], row['label'], row['kind'], row['value'],
+               row.get('count'), row.get('p50'), row.get('p95'), row.get('p99'), row.get('max'))
+              for row in rows])
+
+        conn.execute("DELETE FROM metrics WHERE period_start < ?", (time.time() - METRICS_RETENTION,))
+
+def get_metrics(since: float, names: Optional[List[str]] = None) -> List[Dict]:
+    """Get metric rows of periods starting after since (unix time), oldest first"""
+    cursor = get_connection().cursor()
+    cursor.row_factory = sqlite3.Row
+
+    query = "SELECT * FROM metrics WHERE period_start >= ?"
+    params = [since]
+    if names:
+        query += f" AND name IN ({','.join('?' * len(names))})"
+        params.extend(names)
+
+    cursor.execute(query + " ORDER BY period_start", params)
+    return [dict(row) for row in cursor.fetchall()]
+
+def get_latest_metrics_period() -> Optional[float]:
+    """Get the start of the latest flushed metrics period, None if there is none"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT MAX(period_start) FROM metrics")
+    return cursor.fetchone()[0]
+
+def enqueue_scan_jobs(jobs: Iterable[Tuple[int, float]], retry_delay: float = 0) -> int:
+    """Create a scan job per (domain_id, due_at) unless the domain already has one waiting or running
+
+    A waiting job is moved to the new due_at instead, so a changed scan
+    interval applies right away, but a job put back after an empty scan
+    stays at least retry_delay after that run.
+    """
+    jobs = list(jobs)
+    now = time.time()
+
+    with transaction(immediate=True) as conn:
+        conn.executemany("""
+            UPDATE scan_jobs
+            SET due_at = MAX(?1, COALESCE(finished_at + ?2, 0))
+            WHERE domain_id = ?3 AND kind = 'scan' AND status = 'pending'
+            AND due_at != MAX(?1, COALESCE(finished_at + ?2, 0))
+        """, [(due_at, retry_delay, domain_id) for domain_id, due_at in jobs])
+
+        before = conn.total_changes
+        conn.executemany("""
+            INSERT INTO scan_jobs (kind, domain_id, due_at, created_at)
+            SELECT 'scan', ?, ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM scan_jobs
+                WHERE domain_id = ? AND kind = 'scan' AND status IN ('pending', 'leased')
+            )
+        """, [(domain_id, due_at, now, domain_id) for domain_id, due_at in jobs])
+
+        return conn.total_changes - before
+
+def enqueue_reverify_jobs() -> int:
+    """Create a re-verification job for every domain with due subdomains and no job waiting
+
+    Running jobs don't count, so a domain with a big backlog is worked on by
+    several workers at once, each claiming its own batch.
+    """
+    now = time.time()
+
+    with transaction(immediate=True) as conn:
+        before = conn.total_changes
+        conn.execute("""
+            INSERT INTO scan_jobs (kind, domain_id, due_at, created_at)
+            SELECT 'reverify', d.id, ?, ? FROM domains d
+            WHERE EXISTS (
+                SELECT 1 FROM subdomains s
+                WHERE s.domain_id = d.id AND s.next_check_at <= ?
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM scan_jobs j
+                WHERE j.domain_id = d.id AND j.kind = 'reverify' AND j.status = 'pending'
+            )
+        """, (now, now, datetime.now().isoformat()))
+
+        return conn.total_changes - before
+
+def claim_scan_jobs(owner: str, limit: int = 1, lease: int = JOB_LEASE) -> List[Dict]:
+    """Atomically lease up to limit due jobs to owner, earliest due first
+
+    Jobs whose lease expired (their worker died) are claimed again, unless
+    they already used up MAX_JOB_ATTEMPTS, then they are marked failed.
+    """
+    now = time.time()
+
+    with transaction(immediate=True) as conn:
+        conn.execute("""
+            UPDATE scan_jobs
+            SET status = 'failed', finished_at = ?
+            WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= ?
+        """, (now, now, MAX_JOB_ATTEMPTS))
+
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute("""
+            UPDATE scan_jobs
+            SET status = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM scan_jobs
+                WHERE (status = 'pending' AND due_at <= ?)
+                   OR (status = 'leased' AND lease_expires_at < ?)
+                ORDER BY due_at
+                LIMIT ?
+            )
+            RETURNING *
+        """, (owner, now + lease, now, now, limit))
+
+        return [dict(row) for row in cursor.fetchall()]
+
+def renew_job_leases(owner: str, job_ids: List[int], lease: int = JOB_LEASE) -> List[int]:
+    """Extend the leases of owner's running jobs, returns the ids it still holds"""
+    if not job_ids:
+        return []
+
+    with transaction() as conn:
+        cursor = conn.execute(f"""
+            UPDATE scan_jobs
+            SET lease_expires_at = ?
+            WHERE lease_owner = ? AND status = 'leased' AND id IN ({','.join('?' * len(job_ids))})
+            RETURNING id
+        """, [time.time() + lease, owner] + list(job_ids))
+
+        return [row[0] for row in cursor.fetchall()]
+
+def finish_scan_job(job_id: int, owner: str):
+    """Remove a completed job, if owner still holds it"""
+    with transaction() as conn:
+        conn.execute("DELETE FROM scan_jobs WHERE id = ? AND lease_owner = ?", (job_id, owner))
+
+def fail_scan_job(job_id: int, owner: str):
+    """Mark a job owner still holds as failed, it is kept for inspection until JOB_RETENTION"""
+    with transaction() as conn:
+        conn.execute("""
+            UPDATE scan_jobs
+            SET status = 'failed', finished_at = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'
+        """, (time.time(), job_id, owner))
+
+def release_scan_job(job_id: int, owner: str, due_at: float):
+    """Put a job owner still holds back in the queue to run again at due_at, finished_at records the run"""
+    with transaction() as conn:
+        conn.execute("""
+            UPDATE scan_jobs
+            SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL, attempts = 0, due_at = ?, finished_at = ?
+            WHERE id = ? AND lease_owner = ? AND status = 'leased'
+        """, (due_at, time.time(), job_id, owner))
+
+def get_next_job_due() -> Optional[float]:
+    """Get the due time of the earliest waiting job, None if there is none"""
+    cursor = get_connection().cursor()
+
+    cursor.execute("SELECT MIN(due_at) FROM scan_jobs WHERE status = 'pending'")
+    return cursor.fetchone()[0]
+
+def get_overdue_scans(now: float) -> Dict[str, float]:
+    """Get the due time of each domain whose scan job is still waiting past it, by domain name"""
+    cursor = get_connection().cursor()
+
     cursor.execute("""
-        UPDATE subdomains 
-        SET is_new = 0 
-        WHERE id = ?
-    """, (subdomain_id,))
-    
-    conn.commit()
-    conn.close()
\ No newline at end of file
+        SELECT d.name, j.due_at FROM scan_jobs j
+        JOIN domains d ON d.id = j.domain_id
+        WHERE j.kind = 'scan' AND j.status = 'pending' AND j.due_at <= ?
+    """, (now,))
+    return dict(cursor.fetchall())
+
+def prune_scan_jobs():
+    """Drop failed jobs older than JOB_RETENTION"""
+    with transaction() as conn:
+        conn.execute("""
+            DELETE FROM scan_jobs
+            WHERE status = 'failed' AND finished_at < ?
+        """, (time.time() - JOB_RETENTION,))
@@ -0,0 +1,443 @@
+import logging
+import sqlite3
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Ordered schema migrations: (version, description, statements)
+# A statement is either SQL or a callable taking the connection.
+# Never edit an applied migration, append a new one instead.
+MIGRATIONS = [
+    (1, "Base schema", [
+        """
+        CREATE TABLE IF NOT EXISTS domains (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            scan_interval INTEGER DEFAULT 3600,
+            active_scanners TEXT,
+            enable_dns_check INTEGER DEFAULT 1,
+            enable_http_check INTEGER DEFAULT 1,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_scan TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS subdomains (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            domain_id INTEGER NOT NULL,
+            subdomain TEXT NOT NULL,
+            discovered_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            last_checked TEXT,
+            status_code INTEGER,
+            dns_checked INTEGER DEFAULT 0,
+            page_size INTEGER,
+            screenshot_path TEXT,
+            is_new INTEGER DEFAULT 1,
+            FOREIGN KEY (domain_id) REFERENCES domains (id),
+            UNIQUE(domain_id, subdomain)
+        )
+        """
+    ]),
+    (2, "Indexes for subdomain queries", [
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_new ON subdomains (domain_id, is_new, discovered_at)",
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_dns ON subdomains (domain_id, dns_checked)",
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_discovered ON subdomains (domain_id, discovered_at)",
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_status ON subdomains (domain_id, status_code)",
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_discovered ON subdomains (discovered_at)",
+        "ANALYZE"
+    ]),
+    (3, "Materialized per-domain statistics", [
+        """
+        CREATE TABLE IF NOT EXISTS domain_stats (
+            domain_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            new INTEGER NOT NULL DEFAULT 0,
+            dns_verified INTEGER NOT NULL DEFAULT 0,
+            http_checked INTEGER NOT NULL DEFAULT 0,
+            last_discovered TEXT,
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        )
+        """,
+        """
+        INSERT OR REPLACE INTO domain_stats (domain_id, total, new, dns_verified, http_checked, last_discovered)
+        SELECT d.id,
+               COUNT(s.id),
+               COALESCE(SUM(s.is_new = 1), 0),
+               COALESCE(SUM(s.dns_checked = 1), 0),
+               COALESCE(SUM(s.status_code IS NOT NULL), 0),
+               MAX(s.discovered_at)
+        FROM domains d
+        LEFT JOIN subdomains s ON s.domain_id = d.id
+        GROUP BY d.id
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_domains_insert_stats
+        AFTER INSERT ON domains
+        BEGIN
+            INSERT OR IGNORE INTO domain_stats (domain_id) VALUES (NEW.id);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_domains_delete_stats
+        AFTER DELETE ON domains
+        BEGIN
+            DELETE FROM domain_stats WHERE domain_id = OLD.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_insert_stats
+        AFTER INSERT ON subdomains
+        BEGIN
+            UPDATE domain_stats
+            SET total = total + 1,
+                new = new + (NEW.is_new = 1),
+                dns_verified = dns_verified + (NEW.dns_checked = 1),
+                http_checked = http_checked + (NEW.status_code IS NOT NULL),
+                last_discovered = MAX(COALESCE(last_discovered, ''), NEW.discovered_at)
+            WHERE domain_id = NEW.domain_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_update_stats
+        AFTER UPDATE OF is_new, dns_checked, status_code ON subdomains
+        WHEN OLD.is_new IS NOT NEW.is_new
+          OR OLD.dns_checked IS NOT NEW.dns_checked
+          OR (OLD.status_code IS NULL) != (NEW.status_code IS NULL)
+        BEGIN
+            UPDATE domain_stats
+            SET new = new - (OLD.is_new = 1) + (NEW.is_new = 1),
+                dns_verified = dns_verified - (OLD.dns_checked = 1) + (NEW.dns_checked = 1),
+                http_checked = http_checked - (OLD.status_code IS NOT NULL) + (NEW.status_code IS NOT NULL)
+            WHERE domain_id = NEW.domain_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_delete_stats
+        AFTER DELETE ON subdomains
+        BEGIN
+            UPDATE domain_stats
+            SET total = total - 1,
+                new = new - (OLD.is_new = 1),
+                dns_verified = dns_verified - (OLD.dns_checked = 1),
+                http_checked = http_checked - (OLD.status_code IS NOT NULL),
+                last_discovered = (SELECT MAX(discovered_at) FROM subdomains WHERE domain_id = OLD.domain_id)
+            WHERE domain_id = OLD.domain_id;
+        END
+        """
+    ]),
+    (4, "Re-verification schedule and change history", [
+        "ALTER TABLE subdomains ADD COLUMN next_check_at TEXT NOT NULL DEFAULT ''",
+        "ALTER TABLE subdomains ADD COLUMN check_interval INTEGER",
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_next_check ON subdomains (domain_id, next_check_at)",
+        """
+        CREATE TABLE IF NOT EXISTS subdomain_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subdomain_id INTEGER NOT NULL,
+            changed_at TEXT NOT NULL,
+            field TEXT NOT NULL,
+            old_value TEXT,
+            new_value TEXT,
+            FOREIGN KEY (subdomain_id) REFERENCES subdomains (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_subdomain_changes_subdomain ON subdomain_changes (subdomain_id, changed_at)"
+    ]),
+    (5, "Persistent DNS answer cache", [
+        """
+        CREATE TABLE IF NOT EXISTS dns_cache (
+            name TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            addresses TEXT NOT NULL DEFAULT '',
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_dns_cache_expires ON dns_cache (expires_at)"
+    ]),
+    (6, "Wildcard DNS classification", [
+        "ALTER TABLE subdomains ADD COLUMN is_wildcard INTEGER NOT NULL DEFAULT 0"
+    ]),
+    (7, "Rolling performance metrics", [
+        """
+        CREATE TABLE IF NOT EXISTS metrics (
+            period_start REAL NOT NULL,
+            period REAL NOT NULL,
+            name TEXT NOT NULL,
+            label TEXT NOT NULL DEFAULT '',
+            kind TEXT NOT NULL,
+            value REAL,
+            count INTEGER,
+            p50 REAL,
+            p95 REAL,
+            p99 REAL,
+            max REAL,
+            PRIMARY KEY (period_start, name, label)
+        ) WITHOUT ROWID
+        """
+    ]),
+    (8, "Per-domain HTTP concurrency ceiling", [
+        "ALTER TABLE domains ADD COLUMN max_http_concurrency INTEGER"
+    ]),
+    (9, "Leased scan jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS scan_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            domain_id INTEGER NOT NULL,
+            due_at REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires_at REAL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            FOREIGN KEY (domain_id) REFERENCES domains (id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scan_jobs_status_due ON scan_jobs (status, due_at)",
+        # At most one waiting job of each kind per domain
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_scan_jobs_pending ON scan_jobs (domain_id, kind) WHERE status = 'pending'"
+    ]),
+    (10, "HTTP probe modes and response fingerprints", [
+        "ALTER TABLE domains ADD COLUMN http_probe_mode TEXT",
+        "ALTER TABLE subdomains ADD COLUMN body_hash TEXT",
+        "ALTER TABLE subdomains ADD COLUMN title TEXT",
+        "ALTER TABLE subdomains ADD COLUMN final_url TEXT",
+        "ALTER TABLE subdomains ADD COLUMN redirect_count INTEGER"
+    ]),
+    (11, "Open TCP ports", [
+        "ALTER TABLE domains ADD COLUMN port_list TEXT",
+        """
+        CREATE TABLE IF NOT EXISTS ports (
+            subdomain_id INTEGER NOT NULL,
+            port INTEGER NOT NULL,
+            ip TEXT NOT NULL,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (subdomain_id, port, ip),
+            FOREIGN KEY (subdomain_id) REFERENCES subdomains (id)
+        ) WITHOUT ROWID
+        """
+    ]),
+    (12, "Detected technologies", [
+        """
+        CREATE TABLE IF NOT EXISTS technologies (
+            subdomain_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            version TEXT,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            PRIMARY KEY (subdomain_id, name),
+            FOREIGN KEY (subdomain_id) REFERENCES subdomains (id)
+        ) WITHOUT ROWID
+        """,
+        # Filtering subdomains by technology
+        "CREATE INDEX IF NOT EXISTS idx_technologies_name ON technologies (name, subdomain_id)"
+    ]),
+    (13, "CNAME chains and subdomain takeover flags", [
+        "ALTER TABLE dns_cache ADD COLUMN cname TEXT NOT NULL DEFAULT ''",
+        # Cached answers don't have their chain yet, resolve them again
+        "DELETE FROM dns_cache",
+        "ALTER TABLE subdomains ADD COLUMN cname TEXT",
+        "ALTER TABLE subdomains ADD COLUMN takeover TEXT",
+        # Flagged hosts are few, only they are indexed
+        "CREATE INDEX IF NOT EXISTS idx_subdomains_domain_takeover ON subdomains (domain_id, takeover) WHERE takeover IS NOT NULL"
+    ]),
+    (14, "Per-domain revision counters for cached page reads", [
+        "ALTER TABLE domain_stats ADD COLUMN revision INTEGER NOT NULL DEFAULT 0",
+        # Inserts and deletes already update the stats row, bump the revision in the same statement
+        "DROP TRIGGER IF EXISTS trg_subdomains_insert_stats",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_insert_stats
+        AFTER INSERT ON subdomains
+        BEGIN
+            UPDATE domain_stats
+            SET total = total + 1,
+                new = new + (NEW.is_new = 1),
+                dns_verified = dns_verified + (NEW.dns_checked = 1),
+                http_checked = http_checked + (NEW.status_code IS NOT NULL),
+                last_discovered = MAX(COALESCE(last_discovered, ''), NEW.discovered_at),
+                revision = revision + 1
+            WHERE domain_id = NEW.domain_id;
+        END
+        """,
+        "DROP TRIGGER IF EXISTS trg_subdomains_delete_stats",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_delete_stats
+        AFTER DELETE ON subdomains
+        BEGIN
+            UPDATE domain_stats
+            SET total = total - 1,
+                new = new - (OLD.is_new = 1),
+                dns_verified = dns_verified - (OLD.dns_checked = 1),
+                http_checked = http_checked - (OLD.status_code IS NOT NULL),
+                last_discovered = (SELECT MAX(discovered_at) FROM subdomains WHERE domain_id = OLD.domain_id),
+                revision = revision + 1
+            WHERE domain_id = OLD.domain_id;
+        END
+        """,
+        # Every column the pages show, not next_check_at alone, claiming due hosts changes nothing visible.
+        # Technologies and change history are written together with one of these.
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_update_revision
+        AFTER UPDATE OF is_new, dns_checked, status_code, page_size, last_checked, body_hash, title, final_url,
+                        redirect_count, is_wildcard, cname, takeover ON subdomains
+        BEGIN
+            UPDATE domain_stats SET revision = revision + 1 WHERE domain_id = NEW.domain_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_domains_update_revision
+        AFTER UPDATE ON domains
+        BEGIN
+            UPDATE domain_stats SET revision = revision + 1 WHERE domain_id = NEW.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_ports_insert_revision
+        AFTER INSERT ON ports
+        BEGIN
+            UPDATE domain_stats SET revision = revision + 1
+            WHERE domain_id = (SELECT domain_id FROM subdomains WHERE id = NEW.subdomain_id);
+        END
+        """
+    ]),
+    (15, "Per-domain review watermark", [
+        # Subdomains up to this id count as seen whatever their is_new flag says
+        "ALTER TABLE domains ADD COLUMN reviewed_up_to INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_domains_review_stats
+        AFTER UPDATE OF reviewed_up_to ON domains
+        WHEN OLD.reviewed_up_to IS NOT NEW.reviewed_up_to
+        BEGIN
+            UPDATE domain_stats
+            SET new = (SELECT COUNT(*) FROM subdomains WHERE domain_id = NEW.id AND is_new = 1 AND id > NEW.reviewed_up_to)
+            WHERE domain_id = NEW.id;
+        END
+        """
+    ]),
+    (16, "Compact observation history", [
+        # One row per state change of a host, integer coded: dns 0 = down, 1 = resolves, 2 = wildcard.
+        # Keyed by (subdomain_id, observed_at) so a host's timeline is one range of the table.
+        """
+        CREATE TABLE IF NOT EXISTS observations (
+            subdomain_id INTEGER NOT NULL,
+            observed_at INTEGER NOT NULL,
+            dns INTEGER NOT NULL,
+            status_code INTEGER,
+            page_size INTEGER,
+            changes INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (subdomain_id, observed_at)
+        ) WITHOUT ROWID
+        """,
+        # Page sizes within 5% count as unchanged, like PAGE_SIZE_TOLERANCE in the checks.
+        # Changes within the same second fold into one row.
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_observe
+        AFTER UPDATE OF dns_checked, is_wildcard, status_code, page_size ON subdomains
+        WHEN OLD.dns_checked IS NOT NEW.dns_checked
+          OR OLD.is_wildcard IS NOT NEW.is_wildcard
+          OR OLD.status_code IS NOT NEW.status_code
+          OR (OLD.page_size IS NULL) != (NEW.page_size IS NULL)
+          OR ABS(NEW.page_size - OLD.page_size) > 0.05 * MAX(OLD.page_size, 1)
+        BEGIN
+            INSERT INTO observations (subdomain_id, observed_at, dns, status_code, page_size)
+            VALUES (
+                NEW.id,
+                CAST(strftime('%s', 'now') AS INTEGER),
+                CASE WHEN NEW.dns_checked != 1 THEN 0 WHEN NEW.is_wildcard = 1 THEN 2 ELSE 1 END,
+                NEW.status_code,
+                NEW.page_size
+            )
+            ON CONFLICT (subdomain_id, observed_at) DO UPDATE
+            SET dns = excluded.dns, status_code = excluded.status_code, page_size = excluded.page_size,
+                changes = changes + 1;
+        END
+        """,
+        # Start every checked host's history from its current state, last_checked is local time
+        """
+        INSERT OR IGNORE INTO observations (subdomain_id, observed_at, dns, status_code, page_size)
+        SELECT id,
+               CAST(COALESCE(strftime('%s', last_checked, 'utc'), strftime('%s', discovered_at)) AS INTEGER),
+               CASE WHEN dns_checked != 1 THEN 0 WHEN is_wildcard = 1 THEN 2 ELSE 1 END,
+               status_code,
+               page_size
+        FROM subdomains
+        WHERE last_checked IS NOT NULL OR dns_checked = 1 OR status_code IS NOT NULL
+        """
+    ]),
+    (17, "Row change times for incremental snapshots", [
+        # Unix time of a subdomain's last visible change, NULL until its first one after the insert
+        "ALTER TABLE subdomains ADD COLUMN updated_at INTEGER",
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_subdomains_touch
+        AFTER UPDATE OF is_new, dns_checked, status_code, page_size, last_checked, body_hash, title, final_url,
+                        redirect_count, is_wildcard, cname, takeover ON subdomains
+        BEGIN
+            UPDATE subdomains SET updated_at = CAST(strftime('%s', 'now') AS INTEGER) WHERE id = NEW.id;
+        END
+        """
+    ]),
+    (18, "Spread the first re-verification of subdomains from before the schedule", [
+        # Version 4 left them due at once. Schedule them like new ones, a day (INITIAL_CHECK_INTERVAL)
+        # after discovery, old ones spread evenly by id over the next day instead. discovered_at is UTC,
+        # next_check_at local time.
+        """
+        UPDATE subdomains
+        SET next_check_at = MAX(
+                COALESCE(strftime('%Y-%m-%dT%H:%M:%S', discovered_at, '+86400 seconds', 'localtime'), ''),
+                strftime('%Y-%m-%dT%H:%M:%S', 'now', 'localtime',
+                         '+' || (id * 86400 / (SELECT MAX(id) FROM subdomains)) || ' seconds')
+            ),
+            check_interval = COALESCE(check_interval, 86400)
+        WHERE next_check_at = ''
+        """
+    ]),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Get the latest applied migration version, 0 for a fresh or legacy database"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+    result = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return result[0] or 0
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply all pending migrations in order, returns the resulting schema version"""
+    version = get_schema_version(conn)
+
+    for target, description, statements in MIGRATIONS:
+        if target <= version:
+            continue
+
+        with conn:
+            # Take the write lock and re-check, another process may have migrated meanwhile
+            conn.execute("BEGIN IMMEDIATE")
+            current = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+            if target <= current:
+                version = current
+                continue
+
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+
+            conn.execute("""
+                INSERT INTO schema_version (version, description)
+                VALUES (?, ?)
+            """, (target, description))
+
+        version = target
+        logging.info(f"Database migrated to version {target}: {description}")
+
+    return version
@@ -0,0 +1,275 @@
+"""Columnar Parquet snapshots of the database for offline analytics
+
+    python -m database.snapshot data/snapshot
+    python -m database.snapshot data/snapshot --full
+
+Writes the domains table and every domain's subdomains, change history and
+observation history as Parquet, partitioned by domain and date, so analysts
+load files with pandas or any Arrow reader instead of scanning the live
+database. Needs pyarrow (in requirements.txt), only this module imports it.
+
+The first export writes everything, later ones only the rows changed since,
+into new files. Every row carries the number of the snapshot that wrote it,
+keep the latest one per key when reading:
+
+    subdomains = pd.read_parquet("data/snapshot/subdomains")
+    subdomains = subdomains.sort_values("snapshot").drop_duplicates("id", keep="last")
+
+Keys are id for subdomains and subdomain_changes, (subdomain_id, observed_at)
+for observations. Compaction of old observations is only picked up by a
+--full export.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import time
+from itertools import groupby
+from typing import Dict, Iterator, List, Optional
+
+from .db_manager import (
+    get_all_domains,
+    get_revisions,
+    get_snapshot_marks,
+    get_table_columns,
+    init_db,
+    iter_change_snapshot,
+    iter_observation_snapshot,
+    iter_subdomain_snapshot,
+    read_snapshot
+)
+
+# Snapshot Settings
+SNAPSHOT_DIR = "data/snapshot"
+SNAPSHOT_BATCH_SIZE = 50000  # Rows per record batch, bounds memory whatever the table size
+SNAPSHOT_OVERLAP = 60        # Seconds of changes read again, covers writes committed while the last export ran
+MANIFEST_NAME = "_manifest.json"
+
+# Partitioned tables, as (partition name, column its date comes from)
+PARTITIONS = {
+    'subdomains': ('discovered', 'discovered_at'),
+    'subdomain_changes': ('changed', 'changed_at'),
+    'observations': ('observed', 'observed_at')
+}
+
+def snapshots_available() -> bool:
+    """Check whether pyarrow is installed, without importing it"""
+    return importlib.util.find_spec('pyarrow') is not None
+
+def _arrow():
+    """Import pyarrow, only snapshots need it"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet snapshots need pyarrow, install it with: pip install pyarrow") from e
+
+    return pyarrow, pyarrow.parquet
+
+def _schema(pa, table: str, columns: List[str]):
+    """Build the Arrow schema of a table's columns from their declared SQLite types, plus the snapshot number"""
+    declared = dict(get_table_columns(table))
+    declared['domain_id'] = 'INTEGER'
+    fields = []
+
+    for column in columns:
+        kind = declared.get(column, 'TEXT').upper()
+        if 'INT' in kind:
+            fields.append(pa.field(column, pa.int64()))
+        elif 'REAL' in kind or 'FLOA' in kind or 'DOUB' in kind:
+            fields.append(pa.field(column, pa.float64()))
+        else:
+            fields.append(pa.field(column, pa.string()))
+
+    return pa.schema(fields + [pa.field('snapshot', pa.int64())])
+
+def _record_batch(pa, schema, rows: List[tuple], snapshot: int):
+    """Turn row tuples into a record batch of schema, tagged with the snapshot number"""
+    arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+    arrays.append(pa.array([snapshot] * len(rows), type=pa.int64()))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _partition_date(value) -> str:
+    """Get the partition date of a row, unix times are taken as UTC"""
+    if value is None:
+        return 'unknown'
+    if isinstance(value, int):
+        return time.strftime('%Y-%m-%d', time.gmtime(value))
+    return str(value)[:10]
+
+def _staging_path(path: str) -> str:
+    """Get the hidden name a file is written under until the snapshot completes, readers skip dot files"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, "." + name)
+
+def _write_partitions(pa, pq, output_dir: str, table: str, domain_name: str, snapshot: int,
+                      columns: List[str], chunks: Iterator[List[tuple]], staged: List[str]) -> int:
+    """Write a domain's rows of a table into one file per date partition, returns the rows written
+
+    Rows arrive ordered by their date column, so only one file is open at a time.
+    """
+    partition, date_column = PARTITIONS[table]
+    date_index = columns.index(date_column)
+    schema = _schema(pa, table, columns)
+    writer = current = None
+    written = 0
+
+    try:
+        for rows in chunks:
+            for date, group in groupby(rows, key=lambda row: _partition_date(row[date_index])):
+                if date != current:
+                    if writer:
+                        writer.close()
+
+                    directory = os.path.join(output_dir, table, f"domain={domain_name}", f"{partition}={date}")
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f"part-{snapshot:06d}.parquet")
+                    writer = pq.ParquetWriter(_staging_path(path), schema)
+                    staged.append(path)
+                    current = date
+
+                group = list(group)
+                writer.write_batch(_record_batch(pa, schema, group, snapshot))
+                written += len(group)
+    finally:
+        if writer:
+            writer.close()
+
+    return written
+
+def _write_domains(pa, pq, output_dir: str, domains: List[Dict], snapshot: int, staged: List[str]):
+    """Write the whole domains table, it is small enough to replace on every snapshot"""
+    columns = [name for name, _ in get_table_columns('domains')]
+    schema = _schema(pa, 'domains', columns)
+    path = os.path.join(output_dir, 'domains', 'domains.parquet')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = [tuple(domain[column] for column in columns) for domain in domains]
+    table = pa.Table.from_batches([_record_batch(pa, schema, rows, snapshot)] if rows else [], schema=schema)
+    pq.write_table(table, _staging_path(path))
+    staged.append(path)
+
+def load_manifest(output_dir: str = SNAPSHOT_DIR) -> Optional[Dict]:
+    """Get the manifest of the last snapshot in output_dir, None if there is none"""
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def export_snapshot(output_dir: str = SNAPSHOT_DIR, full: bool = False) -> Dict:
+    """Write a Parquet snapshot of the database to output_dir, returns a summary
+
+    Incremental when output_dir holds an earlier snapshot, unless full:
+    domains whose revision didn't change are skipped, the others only get
+    their new, changed and newly reviewed subdomains, new transitions and
+    new observations. All reads share one read transaction, so the files
+    are consistent while the worker keeps writing. Files only get their
+    final names once everything is written, then the manifest is updated.
+    """
+    pa, pq = _arrow()
+    previous = load_manifest(output_dir)
+    snapshot = previous['snapshot'] + 1 if previous else 1
+
+    if full and previous:
+        # Only a directory with a manifest is ours to clear
+        for table in ['domains', *PARTITIONS]:
+            shutil.rmtree(os.path.join(output_dir, table), ignore_errors=True)
+        previous = None
+    os.makedirs(output_dir, exist_ok=True)
+
+    known = previous['domains'] if previous else {}
+    staged = []
+    rows = dict.fromkeys(PARTITIONS, 0)
+    exported = 0
+
+    try:
+        started = int(time.time())
+
+        with read_snapshot():
+            marks = get_snapshot_marks()
+            revisions = get_revisions()
+            domains = get_all_domains()
+
+            # Drop the partitions of deleted domains, a domain added again under the same name starts over
+            current = {str(domain['id']) for domain in domains}
+            for domain_id, entry in known.items():
+                if domain_id not in current:
+                    for table in PARTITIONS:
+                        shutil.rmtree(os.path.join(output_dir, table, f"domain={entry['name']}"), ignore_errors=True)
+
+            _write_domains(pa, pq, output_dir, domains, snapshot, staged)
+
+            for domain in domains:
+                entry = known.get(str(domain['id']))
+                if entry and entry['revision'] == revisions.get(domain['id']):
+                    continue
+
+                if entry:
+                    since = previous['exported_at'] - SNAPSHOT_OVERLAP
+                    subdomains = iter_subdomain_snapshot(
+                        domain['id'], previous['max_subdomain_id'], since,
+                        (entry['reviewed_up_to'], domain['reviewed_up_to']), SNAPSHOT_BATCH_SIZE
+                    )
+                    changes = iter_change_snapshot(domain['id'], previous['max_change_id'], SNAPSHOT_BATCH_SIZE)
+                    observations = iter_observation_snapshot(domain['id'], since, SNAPSHOT_BATCH_SIZE)
+                else:
+                    subdomains = iter_subdomain_snapshot(domain['id'], chunk_size=SNAPSHOT_BATCH_SIZE)
+                    changes = iter_change_snapshot(domain['id'], chunk_size=SNAPSHOT_BATCH_SIZE)
+                    observations = iter_observation_snapshot(domain['id'], chunk_size=SNAPSHOT_BATCH_SIZE)
+
+                for table, (columns, chunks) in zip(PARTITIONS, (subdomains, changes, observations)):
+                    rows[table] += _write_partitions(pa, pq, output_dir, table, domain['name'], snapshot,
+                                                     columns, chunks, staged)
+                exported += 1
+
+        for path in staged:
+            os.replace(_staging_path(path), path)
+
+    except BaseException:
+        for path in staged:
+            if os.path.exists(_staging_path(path)):
+                os.remove(_staging_path(path))
+        raise
+
+    manifest = {
+        'snapshot': snapshot,
+        'exported_at': started,
+        **marks,
+        'domains': {
+            str(domain['id']): {
+                'name': domain['name'],
+                'revision': revisions.get(domain['id']),
+                'reviewed_up_to': domain['reviewed_up_to']
+            } for domain in domains
+        }
+    }
+
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+    return {'snapshot': snapshot, 'domains': exported, 'rows': rows, 'files': len(staged)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a Parquet snapshot for offline analytics")
+    parser.add_argument('output', nargs='?', default=SNAPSHOT_DIR, help=f"Snapshot directory, {SNAPSHOT_DIR} by default")
+    parser.add_argument('--full', action='store_true', help="Rewrite everything instead of exporting the changes")
+    args = parser.parse_args()
+
+    init_db()
+
+    try:
+        summary = export_snapshot(args.output, args.full)
+    except ImportError as e:
+        sys.exit(str(e))
+
+    print(f"Snapshot {summary['snapshot']}: {summary['domains']} domains exported, "
+          + ", ".join(f"{count} {table}" for table, count in summary['rows'].items())
+          + f" rows in {summary['files']} files")
+
+if __name__ == '__main__':
+    main()
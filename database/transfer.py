@@ -0,0 +1,228 @@
+"""Bulk domain import from scope files and streaming subdomain exports
+
+    python -m database.transfer import scope.csv --interval 7200
+    python -m database.transfer export example.com --format ndjson --gzip -o example.ndjson.gz
+"""
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from .db_manager import add_domains, get_all_domains, init_db, iter_subdomain_names, iter_subdomain_rows
+
+# Import Settings
+DOMAIN_PATTERN = re.compile(r"^(?=.{1,253}$)((?!-)[a-z0-9-]{1,63}(?<!-)\.)+[a-z][a-z0-9-]{0,61}[a-z0-9]$")
+MIN_SCAN_INTERVAL = 60
+SCOPE_DEFAULTS = {
+    'scan_interval': 3600,
+    'enable_dns_check': True,
+    'enable_http_check': True,
+    'max_http_concurrency': None
+}
+BOOLEANS = {'1': True, 'true': True, 'yes': True, 'y': True, '0': False, 'false': False, 'no': False, 'n': False}
+
+# Export Formats, as (file extension, mime type)
+EXPORT_FORMATS = {
+    'txt': ('txt', 'text/plain'),        # Subdomain names only
+    'ndjson': ('ndjson', 'application/x-ndjson'),
+    'csv': ('csv', 'text/csv')
+}
+
+def normalize_domain(value: str) -> Optional[str]:
+    """Reduce a scope entry (domain, *.wildcard or URL) to a lowercase domain, None if invalid"""
+    value = value.strip().lower()
+
+    if '://' in value:
+        value = urlsplit(value).hostname or ''
+    value = value.split('/')[0].split(':')[0].rstrip('.')
+
+    if value.startswith('*.'):
+        value = value[2:]
+
+    try:
+        value = value.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+
+    return value if DOMAIN_PATTERN.match(value) else None
+
+def _scope_rows(text: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Yield (line number, row) of a scope file, CSV with a header or one entry per line"""
+    lines = [(number, line) for number, line in enumerate(text.splitlines(), 1)
+             if line.strip() and not line.lstrip().startswith('#')]
+    if not lines:
+        return
+
+    header = [column.strip().lower() for column in next(csv.reader([lines[0][1]]))]
+    if 'domain' not in header and 'name' not in header:
+        # Plain list, extra CSV columns are ignored
+        for number, line in lines:
+            yield number, {'domain': next(csv.reader([line]))[0]}
+        return
+
+    header = ['domain' if column == 'name' else column for column in header]
+    for number, line in lines[1:]:
+        values = next(csv.reader([line]))
+        yield number, dict(zip(header, (value.strip() for value in values)))
+
+def parse_scope(text: str, defaults: Optional[Dict] = None) -> Tuple[List[Dict], List[Tuple[int, str, str]]]:
+    """Validate a scope file into domain settings for add_domains()
+
+    Accepts one domain, *.wildcard or URL per line, or CSV with a domain (or
+    name) column and optional scan_interval, enable_dns_check,
+    enable_http_check and max_http_concurrency columns overriding defaults.
+    Returns (domains, errors), errors as (line number, entry, reason).
+    Duplicates keep their first occurrence.
+    """
+    defaults = {**SCOPE_DEFAULTS, **(defaults or {})}
+    domains = {}
+    errors = []
+
+    for number, row in _scope_rows(text):
+        entry = row.get('domain', '')
+        name = normalize_domain(entry)
+        if name is None:
+            errors.append((number, entry, "Invalid domain"))
+            continue
+
+        settings = {'name': name, **defaults}
+        try:
+            if row.get('scan_interval'):
+                settings['scan_interval'] = int(row['scan_interval'])
+                if settings['scan_interval'] < MIN_SCAN_INTERVAL:
+                    raise ValueError(f"scan_interval below {MIN_SCAN_INTERVAL}s")
+
+            for column in ('enable_dns_check', 'enable_http_check'):
+                if row.get(column):
+                    if row[column].lower() not in BOOLEANS:
+                        raise ValueError(f"{column} is not a boolean")
+                    settings[column] = BOOLEANS[row[column].lower()]
+
+            if row.get('max_http_concurrency'):
+                settings['max_http_concurrency'] = int(row['max_http_concurrency'])
+                if settings['max_http_concurrency'] < 1:
+                    raise ValueError("max_http_concurrency below 1")
+
+        except ValueError as e:
+            errors.append((number, entry, str(e)))
+            continue
+
+        domains.setdefault(name, settings)
+
+    return list(domains.values()), errors
+
+def iter_export(domain_id: int, fmt: str = 'ndjson', compress: bool = False, **filters) -> Iterator[bytes]:
+    """Serialize filtered subdomains chunk by chunk as txt, NDJSON or CSV, gzip'ed if compress
+
+    Rows come from a streaming cursor, so memory stays flat no matter how
+    many subdomains match. NDJSON and CSV carry every column.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31 = gzip container
+
+    def encode(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    if fmt == 'txt':
+        chunk = []
+        for name in iter_subdomain_names(domain_id, **filters):
+            chunk.append(name)
+            if len(chunk) >= 5000:
+                yield encode("\n".join(chunk) + "\n")
+                chunk = []
+        if chunk:
+            yield encode("\n".join(chunk) + "\n")
+
+    else:
+        columns, chunks = iter_subdomain_rows(domain_id, **filters)
+
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(columns)
+            yield encode(buffer.getvalue())
+
+        for rows in chunks:
+            buffer = io.StringIO()
+            if fmt == 'csv':
+                csv.writer(buffer).writerows(rows)
+            else:
+                for row in rows:
+                    buffer.write(json.dumps(dict(zip(columns, row))) + "\n")
+            yield encode(buffer.getvalue())
+
+    if compressor:
+        yield compressor.flush()
+
+def write_export(output, domain_id: int, fmt: str = 'ndjson', compress: bool = False, **filters) -> int:
+    """Write an export to a binary file object, returns the bytes written"""
+    written = 0
+
+    for chunk in iter_export(domain_id, fmt, compress, **filters):
+        if chunk:
+            output.write(chunk)
+            written += len(chunk)
+
+    return written
+
+def export_file_name(domain_name: str, fmt: str, compress: bool, suffix: str = "subdomains") -> str:
+    """Get the download file name of an export"""
+    name = f"{domain_name}_{suffix}.{EXPORT_FORMATS[fmt][0]}"
+    return name + ".gz" if compress else name
+
+def main():
+    parser = argparse.ArgumentParser(description="Import scope files and export subdomains")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    importer = commands.add_parser('import', help="Add the domains of a scope file (text or CSV)")
+    importer.add_argument('file', help="Scope file, - for stdin")
+    importer.add_argument('--interval', type=int, default=SCOPE_DEFAULTS['scan_interval'], help="Default scan interval (seconds)")
+    importer.add_argument('--no-dns', action='store_true', help="Disable DNS checks by default")
+    importer.add_argument('--no-http', action='store_true', help="Disable HTTP checks by default")
+    importer.add_argument('--skip-invalid', action='store_true', help="Import the valid entries even if some are invalid")
+
+    exporter = commands.add_parser('export', help="Stream the subdomains of a domain")
+    exporter.add_argument('domain', help="Domain name")
+    exporter.add_argument('--format', choices=list(EXPORT_FORMATS), default='ndjson')
+    exporter.add_argument('--gzip', action='store_true', help="Compress the output")
+    exporter.add_argument('-o', '--output', help="Output file, stdout by default")
+    args = parser.parse_args()
+
+    init_db()
+
+    if args.command == 'import':
+        text = sys.stdin.read() if args.file == '-' else open(args.file, encoding='utf-8').read()
+        domains, errors = parse_scope(text, {
+            'scan_interval': args.interval,
+            'enable_dns_check': not args.no_dns,
+            'enable_http_check': not args.no_http
+        })
+
+        for number, entry, reason in errors:
+            print(f"line {number}: {entry!r}: {reason}", file=sys.stderr)
+        if errors and not args.skip_invalid:
+            sys.exit(f"{len(errors)} invalid entries, nothing imported (use --skip-invalid)")
+
+        added = add_domains(domains)
+        print(f"Added {added} domains, {len(domains) - added} already existed")
+
+    else:
+        domain = next((d for d in get_all_domains() if d['name'] == args.domain.lower()), None)
+        if domain is None:
+            sys.exit(f"Unknown domain: {args.domain}")
+
+        if args.output:
+            with open(args.output, 'wb') as output:
+                write_export(output, domain['id'], args.format, args.gzip)
+        else:
+            write_export(sys.stdout.buffer, domain['id'], args.format, args.gzip)
+
+if __name__ == '__main__':
+    main()
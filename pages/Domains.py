@@ -1,19 +1,30 @@
 import streamlit as st
-from database import get_all_domains, delete_domain, add_domain
+from database import (delete_domain, add_domain, add_domains, set_max_http_concurrency, set_http_probe_mode,
+                      set_port_list)
+from database.cache import get_all_domains
+from database.transfer import parse_scope
+from scanners.http_prober import HTTP_WORKERS, HTTP_PROBE_MODE, PROBE_MODES
+from scanners.port_scanner import parse_ports
+
+PORT_LIST_HELP = "Ports scanned on every resolved IP, e.g. top1000, web or 22,80,8000-8100. Empty disables port scanning"
 
 st.set_page_config(page_title="Domains", layout="wide")
 
 # Load all domains
 domains = get_all_domains()
 
-# Header with title and new button
-col1, col2 = st.columns([7, 1])
+# Header with title, new and import buttons
+col1, col2, col3 = st.columns([6, 1, 1])
 with col1:
     st.title("Domains")
 with col2:
     st.write("")  # Spacer
     if st.button("✚", help="New Domain"):
         st.session_state.show_add = True
+with col3:
+    st.write("")  # Spacer
+    if st.button("⇪", help="Bulk Import"):
+        st.session_state.show_import = True
 
 # New Domain Dialog
 if "show_add" in st.session_state and st.session_state.show_add:
@@ -28,23 +39,97 @@ if "show_add" in st.session_state and st.session_state.show_add:
         with st.expander("Check Options"):
             enable_dns = st.checkbox("Enable DNS Check", value=True)
             enable_http = st.checkbox("Enable HTTP Check", value=True)
+            max_http = st.number_input("Max HTTP Concurrency", min_value=1, max_value=500, value=HTTP_WORKERS,
+                                       help="Ceiling for hosts probed at once, the prober adapts below it")
+            probe_mode = st.selectbox("HTTP Probe Mode", PROBE_MODES, index=PROBE_MODES.index(HTTP_PROBE_MODE),
+                                      help="head: HEAD only, content-length: trust the header, "
+                                           "capped: read up to 1 MB, full: read whole pages")
+            port_list = st.text_input("Port List", placeholder="top1000", help=PORT_LIST_HELP)
         
         col1, col2 = st.columns([1, 5])
         with col1:
             if st.form_submit_button("Add"):
-                # Collect Scanners
-                scanners = ["subfinder"]
+                try:
+                    parse_ports(port_list)
+                except ValueError as e:
+                    st.error(f"Port List: {e}")
+                else:
+                    # Collect Scanners
+                    scanners = ["subfinder"]
+                    
+                    # Add domain to database
+                    add_domain(name, scanners, interval, enable_dns, enable_http,
+                               None if max_http == HTTP_WORKERS else max_http,
+                               None if probe_mode == HTTP_PROBE_MODE else probe_mode,
+                               port_list.strip() or None)
+                    
+                    st.session_state.success_msg = f"Domain {name} added!"
+                    st.session_state.show_add = False
+                    st.rerun()
+        with col2:
+            if st.form_submit_button("Cancel"):
+                st.session_state.show_add = False
+                st.rerun()
+
+# Bulk Import Dialog
+if st.session_state.get("show_import"):
+    with st.form("import_domains_form"):
+        st.subheader("Bulk Import")
+        
+        scope = st.text_area("Scope", height=200, placeholder="example.com\n*.example.org\nhttps://app.example.net",
+                             help="One domain, *.wildcard or URL per line, or CSV with a domain column")
+        upload = st.file_uploader("Or upload a scope file", type=["txt", "csv"],
+                                  help="CSV columns scan_interval, enable_dns_check, enable_http_check and max_http_concurrency override the defaults below")
+        
+        # Defaults for entries without their own settings
+        interval = st.number_input("Scan Interval (seconds)", min_value=60, value=3600, step=60)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            enable_dns = st.checkbox("Enable DNS Check", value=True)
+        with col2:
+            enable_http = st.checkbox("Enable HTTP Check", value=True)
+        with col3:
+            max_http = st.number_input("Max HTTP Concurrency", min_value=1, max_value=500, value=HTTP_WORKERS)
+        skip_invalid = st.checkbox("Skip invalid entries", value=False)
+        
+        col1, col2 = st.columns([1, 5])
+        with col1:
+            if st.form_submit_button("Import"):
+                text = scope
+                if upload is not None:
+                    text += "\n" + upload.getvalue().decode("utf-8", errors="replace")
                 
-                # Add domain to database
-                add_domain(name, scanners, interval, enable_dns, enable_http)
+                entries, errors = parse_scope(text, {
+                    'scan_interval': interval,
+                    'enable_dns_check': enable_dns,
+                    'enable_http_check': enable_http,
+                    'max_http_concurrency': None if max_http == HTTP_WORKERS else max_http
+                })
+                st.session_state.import_errors = errors
                 
-                st.session_state.success_msg = f"Domain {name} added!"
-                st.session_state.show_add = False
+                if not entries and not errors:
+                    st.session_state.import_errors = [(0, "", "Nothing to import")]
+                elif entries and (skip_invalid or not errors):
+                    # One transaction for the whole file
+                    added = add_domains(entries)
+                    st.session_state.success_msg = (
+                        f"Imported {added} domains, {len(entries) - added} already existed"
+                        + (f", {len(errors)} invalid entries skipped" if errors else "")
+                    )
+                    st.session_state.show_import = False
+                    del st.session_state.import_errors
                 st.rerun()
         with col2:
             if st.form_submit_button("Cancel"):
-                st.session_state.show_add = False
+                st.session_state.show_import = False
+                st.session_state.pop("import_errors", None)
                 st.rerun()
+    
+    # Validation errors of the last attempt, nothing was imported
+    if st.session_state.get("import_errors"):
+        errors = st.session_state.import_errors
+        st.error(f"{len(errors)} invalid entries, nothing imported. Fix them or check **Skip invalid entries**.")
+        st.dataframe([{'Line': n, 'Entry': e, 'Problem': r} for n, e, r in errors[:1000]], hide_index=True)
 
 st.divider()
 
@@ -56,11 +141,39 @@ if "success_msg" in st.session_state:
 # Domain list
 if domains:
     for domain in domains:
-        col1, col2, col3, col4 = st.columns([4, 2, 1, 1])
+        col1, col2, col3, col4, col5 = st.columns([4, 2, 2, 2, 1])
         
         with col1:
             st.write(f"**{domain['name']}**")
+        with col2:
+            current = domain['max_http_concurrency'] or HTTP_WORKERS
+            max_http = st.number_input("Max HTTP Concurrency", min_value=1, max_value=500, value=current,
+                                       key=f"max_http_{domain['id']}", label_visibility="collapsed",
+                                       help="Max HTTP Concurrency")
+            if max_http != current:
+                set_max_http_concurrency(domain['id'], None if max_http == HTTP_WORKERS else max_http)
+                st.rerun()
+        with col3:
+            current = domain['http_probe_mode'] or HTTP_PROBE_MODE
+            probe_mode = st.selectbox("HTTP Probe Mode", PROBE_MODES, index=PROBE_MODES.index(current),
+                                      key=f"probe_mode_{domain['id']}", label_visibility="collapsed",
+                                      help="HTTP Probe Mode")
+            if probe_mode != current:
+                set_http_probe_mode(domain['id'], None if probe_mode == HTTP_PROBE_MODE else probe_mode)
+                st.rerun()
         with col4:
+            current = domain['port_list'] or ""
+            port_list = st.text_input("Port List", value=current, placeholder="No port scan",
+                                      key=f"port_list_{domain['id']}", label_visibility="collapsed",
+                                      help=PORT_LIST_HELP)
+            if port_list.strip() != current:
+                try:
+                    parse_ports(port_list)
+                    set_port_list(domain['id'], port_list.strip() or None)
+                    st.rerun()
+                except ValueError as e:
+                    st.error(str(e))
+        with col5:
             if st.button("✖", help="Delete Domain", key=f"delete_{domain['id']}"):
                 delete_domain(domain['id'])
                 st.rerun()
@@ -1,9 +1,47 @@
+import os
+import tempfile
+from datetime import datetime
+
 import streamlit as st
-from database import get_all_domains, get_subdomains, get_new_subdomains, mark_subdomain_as_seen
+from database import (
+    get_max_subdomain_id,
+    mark_subdomains_as_seen,
+    mark_subdomains_as_seen_by_filter,
+    mark_all_subdomains_as_seen,
+    get_subdomain_timeline
+)
+from database.cache import (
+    get_all_domains,
+    count_subdomains,
+    get_subdomains_page,
+    get_open_ports,
+    get_technologies,
+    get_domain_technologies
+)
+from database.transfer import write_export, export_file_name, EXPORT_FORMATS
 
 st.set_page_config(page_title="Overview", layout="wide")
 st.title("Subdomain Overview")
 
+# Observation states, see the observations table
+DNS_STATES = {0: "Down", 1: "Resolves", 2: "Wildcard"}
+
+# Filter Options
+VIEWS = {"New": True, "Seen": False, "All": None}
+DNS_FILTERS = {"Any": None, "Verified": True, "Unverified": False}
+WILDCARD_FILTERS = {"Any": None, "Hide": False, "Only": True}
+TAKEOVER_FILTERS = {"Any": None, "Hide": False, "Only": True}
+STATUS_FILTERS = {"Any": None, "2xx": "2xx", "3xx": "3xx", "4xx": "4xx", "5xx": "5xx", "No response": "none"}
+EXPORT_LABELS = {"Names (txt)": "txt", "NDJSON": "ndjson", "CSV": "csv"}
+SORT_OPTIONS = {
+    "Discovered": "discovered_at",
+    "Subdomain": "subdomain",
+    "Status Code": "status_code",
+    "Page Size": "page_size",
+    "Last Checked": "last_checked"
+}
+PAGE_SIZES = [50, 100, 250, 500]
+
 # Get all domains
 domains = get_all_domains()
 
@@ -11,128 +49,194 @@ if domains:
     # Dropdown for domain selection
     domain_names = [d['name'] for d in domains]
     selected_domain_name = st.selectbox("Select Domain:", domain_names)
-    
+
     # Find selected domain
     selected_domain = next(d for d in domains if d['name'] == selected_domain_name)
-    
-    # Get all subdomains and new subdomains
-    all_subdomains = get_subdomains(selected_domain['id'])
-    new_subdomains = get_new_subdomains(selected_domain['id'])
-    
-    # Filter out new subdomains from all subdomains (show only seen ones)
-    seen_subdomains = [s for s in all_subdomains if s['is_new'] == 0]
-    
+
     st.divider()
-    
-    # 3 Column Layout
-    col1, col2, col3 = st.columns(3)
-    
-    # Column 1: All Subdomains (is_new = 0)
+
+    # Filter and sort controls
+    col1, col2, col3, col4, col5, col6, col7, col8, col9 = st.columns([2, 2, 2, 2, 2, 2, 3, 2, 1])
+
     with col1:
-        # Header with copy button
-        header_col1, header_col2 = st.columns([10, 1])
-        with header_col1:
-            st.subheader("All Subdomains")
-        with header_col2:
-            if seen_subdomains:
-                copy_text = "\n".join([s['subdomain'] for s in seen_subdomains])
-                st.download_button(
-                    label="C",
-                    data=copy_text,
-                    file_name=f"{selected_domain_name}_all_subdomains.txt",
-                    mime="text/plain",
-                    key="download_all_1"
-                )
-        
-        st.write(f"**Count:** {len(seen_subdomains)}")
-        
-        if seen_subdomains:
-            for sub in seen_subdomains:
-                with st.expander(sub['subdomain']):
-                    st.write(f"**Discovered:** {sub['discovered_at'][:10]}")
-                    st.write(f"**Status Code:** {sub['status_code'] or 'N/A'}")
-                    st.write(f"**Page Size:** {sub['page_size'] or 'N/A'} bytes")
-                    st.write(f"**DNS Verified:** {'Yes' if sub['dns_checked'] else 'No'}")
-                    st.write(f"**Last Checked:** {sub['last_checked'][:10] if sub['last_checked'] else 'Never'}")
-        else:
-            st.info("No subdomains yet")
-    
-    # Column 2: DNS Verified Subdomains
+        view = st.radio("View", list(VIEWS), horizontal=True)
     with col2:
-        # Header with copy button
-        header_col1, header_col2 = st.columns([10, 1])
-        with header_col1:
-            st.subheader("DNS Verified")
-        with header_col2:
-            verified_subs = [s for s in seen_subdomains if s['dns_checked'] == 1]
-            if verified_subs:
-                copy_text = "\n".join([s['subdomain'] for s in verified_subs])
-                st.download_button(
-                    label="C",
-                    data=copy_text,
-                    file_name=f"{selected_domain_name}_dns_verified.txt",
-                    mime="text/plain",
-                    key="download_verified_2"
-                )
-        
-        st.write(f"**Count:** {len(verified_subs)}")
-        
-        if verified_subs:
-            for sub in verified_subs:
-                with st.expander(sub['subdomain']):
-                    st.write(f"**Discovered:** {sub['discovered_at'][:10]}")
-                    st.write(f"**Status Code:** {sub['status_code'] or 'N/A'}")
-                    st.write(f"**Page Size:** {sub['page_size'] or 'N/A'} bytes")
-                    st.write(f"**DNS Verified:** {'Yes' if sub['dns_checked'] else 'No'}")
-                    st.write(f"**Last Checked:** {sub['last_checked'][:10] if sub['last_checked'] else 'Never'}")
-        else:
-            st.info("No DNS verified subdomains yet")
-    
-    # Column 3: New Subdomains (is_new = 1) with checkbox
+        dns_filter = st.selectbox("DNS", list(DNS_FILTERS))
     with col3:
-        # Header with copy button and check all
-        header_col1, header_col2 = st.columns([10, 1])
-        with header_col1:
-            st.subheader("New Subdomains")
-        with header_col2:
-            if new_subdomains:
-                copy_text = "\n".join([s['subdomain'] for s in new_subdomains])
-                st.download_button(
-                    label="C",
-                    data=copy_text,
-                    file_name=f"{selected_domain_name}_new_subdomains.txt",
-                    mime="text/plain",
-                    key="download_new_3"
-                )
-        
-        st.write(f"**Count:** {len(new_subdomains)}")
-        
-        # Check All button
-        if new_subdomains:
-            if st.button("Check All", key="check_all_new"):
-                for sub in new_subdomains:
-                    mark_subdomain_as_seen(sub['id'])
+        wildcard_filter = st.selectbox("Wildcard DNS", list(WILDCARD_FILTERS), help="Hosts that only resolve through a *.zone wildcard")
+    with col4:
+        status_filter = st.selectbox("Status", list(STATUS_FILTERS))
+    with col5:
+        technologies = dict(get_domain_technologies(selected_domain['id']))
+        technology_filter = st.selectbox("Technology", ["Any"] + list(technologies),
+                                         format_func=lambda t: t if t == "Any" else f"{t} ({technologies[t]})")
+    with col6:
+        takeover_filter = st.selectbox("Takeover", list(TAKEOVER_FILTERS), help="Hosts whose CNAME points at an unclaimed service")
+    with col7:
+        search = st.text_input("Search", placeholder="Substring of subdomain")
+    with col8:
+        sort_label = st.selectbox("Sort by", list(SORT_OPTIONS))
+        descending = st.toggle("Descending", value=True)
+    with col9:
+        page_size = st.selectbox("Rows", PAGE_SIZES, index=1)
+
+    filters = {
+        'is_new': VIEWS[view],
+        'dns_checked': DNS_FILTERS[dns_filter],
+        'is_wildcard': WILDCARD_FILTERS[wildcard_filter],
+        'status_class': STATUS_FILTERS[status_filter],
+        'search': search.strip() or None,
+        'technology': None if technology_filter == "Any" else technology_filter,
+        'takeover': TAKEOVER_FILTERS[takeover_filter]
+    }
+
+    # Restart at the first page whenever the query changes
+    query_key = (selected_domain['id'], view, dns_filter, wildcard_filter, status_filter, technology_filter,
+                 takeover_filter, search, sort_label, descending, page_size)
+    if st.session_state.get("page_query") != query_key:
+        st.session_state.page_query = query_key
+        st.session_state.page_cursors = [None]
+
+    cursors = st.session_state.page_cursors
+
+    # Hosts the worker adds after this point have higher ids, bulk triage stops here
+    shown_up_to = get_max_subdomain_id()
+
+    # Only the current page is loaded, no matter how big the domain is
+    total = count_subdomains(selected_domain['id'], **filters)
+    rows, next_cursor = get_subdomains_page(
+        selected_domain['id'],
+        sort=SORT_OPTIONS[sort_label],
+        descending=descending,
+        after=cursors[-1],
+        limit=page_size,
+        **filters
+    )
+
+    # Header with export button
+    header_col1, header_col2 = st.columns([10, 1])
+    with header_col1:
+        st.subheader(f"{view} Subdomains")
+    with header_col2:
+        if total:
+            with st.popover("C", help="Export the current filter"):
+                export_format = EXPORT_LABELS[st.selectbox("Format", list(EXPORT_LABELS), key="export_format")]
+                compress = st.checkbox("gzip", key="export_gzip")
+                export_key = (query_key, export_format, compress)
+
+                if st.button("Prepare", key="prepare_export"):
+                    # Stream into a temp file instead of building the export in memory
+                    previous = st.session_state.get("export_path")
+                    if previous and os.path.exists(previous):
+                        os.remove(previous)
+
+                    fd, path = tempfile.mkstemp(prefix="whiterabbit-export-")
+                    with os.fdopen(fd, "wb") as output:
+                        write_export(output, selected_domain['id'], export_format, compress, **filters)
+                    st.session_state.export_path = path
+                    st.session_state.export_key = export_key
+
+                path = st.session_state.get("export_path")
+                if st.session_state.get("export_key") == export_key and path and os.path.exists(path):
+                    with open(path, "rb") as export_file:
+                        st.download_button(
+                            label=f"Download ({os.path.getsize(path) / 1024:,.0f} KB)",
+                            data=export_file,
+                            file_name=export_file_name(selected_domain_name, export_format, compress, f"{view.lower()}_subdomains"),
+                            mime="application/gzip" if compress else EXPORT_FORMATS[export_format][1],
+                            key="download_export"
+                        )
+
+    st.write(f"**Count:** {total}")
+
+    if rows:
+        ports = get_open_ports(selected_domain['id'], (sub['id'] for sub in rows))
+        detected = get_technologies(selected_domain['id'], (sub['id'] for sub in rows))
+        table = [{
+            'Subdomain': sub['subdomain'],
+            'Status Code': sub['status_code'],
+            'Page Size': sub['page_size'],
+            'Title': sub['title'],
+            'Ports': ", ".join(map(str, ports.get(sub['id'], []))) or None,
+            'Technologies': ", ".join(
+                f"{name} {version}" if version else name
+                for name, version in detected.get(sub['id'], {}).items()
+            ) or None,
+            'Takeover': sub['takeover'],
+            'CNAME': sub['cname'].replace(",", " → ") if sub['cname'] else None,
+            'DNS Verified': bool(sub['dns_checked']),
+            'Wildcard': bool(sub['is_wildcard']),
+            'New': bool(sub['is_new']),
+            'Discovered': sub['discovered_at'][:16],
+            'Last Checked': sub['last_checked'][:16] if sub['last_checked'] else None
+        } for sub in rows]
+
+        event = st.dataframe(
+            table,
+            hide_index=True,
+            use_container_width=True,
+            on_select="rerun",
+            selection_mode="multi-row",
+            key=f"subdomains_{hash(query_key)}_{len(cursors)}"
+        )
+        selected = [rows[i] for i in event.selection.rows]
+
+        # Actions on new subdomains
+        action_col1, action_col2, _ = st.columns([2, 2, 6])
+
+        with action_col1:
+            new_selected = [sub for sub in selected if sub['is_new']]
+            if st.button(f"Mark as seen ({len(new_selected)})", disabled=not new_selected, key="mark_selected_seen"):
+                mark_subdomains_as_seen(sub['id'] for sub in new_selected)
+                st.rerun()
+
+        with action_col2:
+            # Unfiltered, the domain's review watermark moves past everything, else only the matches are marked.
+            # The click runs with the id bound when the button was shown, not after the rerun it triggers.
+            filtered = any(value is not None for name, value in filters.items() if name != 'is_new')
+            if view == "New":
+                if filtered:
+                    st.button("Check Filtered", key="check_all_new", help=f"Mark all {total} new subdomains as seen",
+                              on_click=mark_subdomains_as_seen_by_filter,
+                              args=(selected_domain['id'], shown_up_to), kwargs=filters)
+                else:
+                    st.button("Check All", key="check_all_new", help=f"Mark all {total} new subdomains as seen",
+                              on_click=mark_all_subdomains_as_seen, args=(selected_domain['id'], shown_up_to))
+
+        # State history of a single selected subdomain
+        if len(selected) == 1:
+            timeline = get_subdomain_timeline(selected[0]['id'])
+            with st.expander(f"History of {selected[0]['subdomain']} ({len(timeline)} states)", expanded=True):
+                if timeline:
+                    st.dataframe([{
+                        'Observed': datetime.fromtimestamp(state['observed_at']).strftime('%Y-%m-%d %H:%M'),
+                        'DNS': DNS_STATES.get(state['dns']),
+                        'Status Code': state['status_code'],
+                        'Page Size': state['page_size'],
+                        'Changes': state['changes']
+                    } for state in timeline], hide_index=True, use_container_width=True)
+                else:
+                    st.info("Not checked yet")
+
+        # Pagination
+        pages = (total + page_size - 1) // page_size
+        nav_col1, nav_col2, nav_col3 = st.columns([1, 8, 1])
+
+        with nav_col1:
+            if st.button("◀", help="Previous page", disabled=len(cursors) == 1):
+                cursors.pop()
                 st.rerun()
-        
-        if new_subdomains:
-            for sub in new_subdomains:
-                col_check, col_name = st.columns([1, 20])
-                
-                with col_check:
-                    if st.checkbox("Mark as seen", key=f"check_{sub['id']}", label_visibility="collapsed"):
-                        # Mark as seen
-                        mark_subdomain_as_seen(sub['id'])
-                        st.rerun()
-                
-                with col_name:
-                    with st.expander(sub['subdomain']):
-                        st.write(f"**Discovered:** {sub['discovered_at'][:10]}")
-                        st.write(f"**Status Code:** {sub['status_code'] or 'N/A'}")
-                        st.write(f"**Page Size:** {sub['page_size'] or 'N/A'} bytes")
-                        st.write(f"**DNS Verified:** {'Yes' if sub['dns_checked'] else 'No'}")
-                        st.write(f"**Last Checked:** {sub['last_checked'][:10] if sub['last_checked'] else 'Never'}")
-        else:
-            st.success("No new subdomains!")
-    
+        with nav_col2:
+            st.write(f"Page {len(cursors)} of {max(pages, 1)}")
+        with nav_col3:
+            if st.button("▶", help="Next page", disabled=next_cursor is None):
+                cursors.append(next_cursor)
+                st.rerun()
+
+    elif view == "New":
+        st.success("No new subdomains!")
+    else:
+        st.info("No subdomains yet")
+
 else:
-    st.warning("No domains available. Add a domain first!")
\ No newline at end of file
+    st.warning("No domains available. Add a domain first!")
@@ -0,0 +1,147 @@
+import time
+from datetime import datetime
+
+import streamlit as st
+from database.cache import get_metrics
+
+st.set_page_config(page_title="Performance", layout="wide")
+st.title("Performance")
+
+# Time Ranges
+RANGES = {"Last hour": 3600, "Last 6 hours": 6 * 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400}
+RATE_BUCKET = 60  # Seconds per throughput point, the workers' flush interval
+
+range_label = st.selectbox("Range", list(RANGES), index=1)
+metrics = get_metrics(time.time() - RANGES[range_label])
+
+if metrics:
+    def rows_of(name):
+        return [m for m in metrics if m['name'] == name]
+
+    def total(name):
+        return sum(m['value'] for m in rows_of(name))
+
+    def rate(name):
+        """Sum of a counter over all labels and workers per second, one point per RATE_BUCKET
+
+        Every worker flushes its own periods, so they are summed by the bucket they start in.
+        """
+        buckets = {}
+        for m in rows_of(name):
+            bucket = m['period_start'] - m['period_start'] % RATE_BUCKET
+            buckets[bucket] = buckets.get(bucket, 0) + m['value']
+        return [{
+            'Time': datetime.fromtimestamp(start),
+            'Metric': name,
+            'Per second': value / RATE_BUCKET
+        } for start, value in sorted(buckets.items())]
+
+    # Wall-clock time the metrics cover, periods of several workers overlap
+    covered = max(m['period_start'] + m['period'] for m in metrics) - min(m['period_start'] for m in metrics)
+
+    # Top metrics row
+    col1, col2, col3, col4 = st.columns(4)
+
+    with col1:
+        st.metric("DNS Queries/s", f"{total('dns_queries') / max(covered, 1):.1f}")
+
+    with col2:
+        st.metric("HTTP Requests/s", f"{total('http_requests') / max(covered, 1):.1f}")
+
+    with col3:
+        scans = sum(m['count'] for m in rows_of('scan_seconds'))
+        st.metric("Scans", scans, delta=f"{int(total('scan_errors'))} errors" if total('scan_errors') else None,
+                  delta_color="inverse")
+
+    with col4:
+        transactions = rows_of('db_transaction_seconds')
+        worst = max((m['p99'] for m in transactions if m['p99'] is not None), default=None)
+        st.metric("DB Transaction p99", f"{worst * 1000:.0f} ms" if worst is not None else "-")
+
+    st.divider()
+
+    # Where a scan cycle's time goes
+    st.subheader("Time per Stage")
+
+    stages = {}
+    for m in rows_of('stage_seconds'):
+        stage = stages.setdefault(m['label'], {'Stage': m['label'], 'Seconds': 0.0, 'Calls': 0, 'Worst p99 (s)': 0.0})
+        stage['Seconds'] += m['value']
+        stage['Calls'] += m['count']
+        stage['Worst p99 (s)'] = max(stage['Worst p99 (s)'], m['p99'] or 0.0)
+
+    if stages:
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            st.bar_chart(list(stages.values()), x='Stage', y='Seconds')
+        with col2:
+            st.dataframe(sorted(stages.values(), key=lambda s: -s['Seconds']), hide_index=True, use_container_width=True)
+
+        st.line_chart([{
+            'Time': datetime.fromtimestamp(m['period_start']),
+            'Stage': m['label'],
+            'Seconds': m['value']
+        } for m in rows_of('stage_seconds')], x='Time', y='Seconds', color='Stage')
+    else:
+        st.info("No scan stages recorded in this range")
+
+    st.divider()
+
+    # Throughput
+    st.subheader("Throughput")
+    throughput = rate('dns_queries') + rate('http_requests') + rate('subfinder_hosts')
+    if throughput:
+        st.line_chart(throughput, x='Time', y='Per second', color='Metric')
+
+    # Resolver health
+    st.subheader("Resolvers")
+    resolvers = {}
+    for name, column in (('dns_queries', 'Queries'), ('dns_timeouts', 'Timeouts'), ('dns_errors', 'Errors')):
+        for m in rows_of(name):
+            resolver = resolvers.setdefault(m['label'], {'Resolver': m['label'], 'Queries': 0, 'Timeouts': 0, 'Errors': 0})
+            resolver[column] += int(m['value'])
+
+    for m in rows_of('dns_query_seconds'):
+        if m['label'] in resolvers and m['p99'] is not None:
+            resolver = resolvers[m['label']]
+            resolver['Worst p99 (ms)'] = max(resolver.get('Worst p99 (ms)', 0), round(m['p99'] * 1000))
+
+    if resolvers:
+        for resolver in resolvers.values():
+            failed = resolver['Timeouts'] + resolver['Errors']
+            resolver['Failure Rate'] = f"{failed / resolver['Queries'] * 100:.1f}%" if resolver['Queries'] else "-"
+        st.dataframe(list(resolvers.values()), hide_index=True, use_container_width=True)
+
+    http = {}
+    for name, column in (('http_requests', 'Requests'), ('http_timeouts', 'Timeouts'), ('http_errors', 'Errors')):
+        for m in rows_of(name):
+            protocol = http.setdefault(m['label'], {'Protocol': m['label'], 'Requests': 0, 'Timeouts': 0, 'Errors': 0})
+            protocol[column] += int(m['value'])
+
+    if http:
+        st.subheader("HTTP")
+        st.dataframe(list(http.values()), hide_index=True, use_container_width=True)
+
+    st.divider()
+
+    # Database
+    st.subheader("DB Transaction Latency")
+    if transactions:
+        st.line_chart([{
+            'Time': datetime.fromtimestamp(m['period_start']),
+            'Series': f"{m['label']} {quantile}",
+            'ms': (m[quantile] or 0) * 1000
+        } for m in transactions for quantile in ('p50', 'p99')], x='Time', y='ms', color='Series')
+
+    # Scan lag, latest value per domain
+    st.subheader("Scan Lag")
+    lag = {}
+    for m in rows_of('scan_lag_seconds'):
+        lag[m['label']] = m['value']
+
+    if lag:
+        st.bar_chart([{'Domain': domain, 'Seconds': seconds} for domain, seconds in lag.items()], x='Domain', y='Seconds')
+        st.caption("How late each domain's last scan started, or how overdue it is while still waiting, relative to its interval")
+
+else:
+    st.info("No metrics in this range yet. The scanner worker writes them every minute while it runs.")
@@ -1,58 +1,228 @@
 from database import *
-from datetime import datetime, timedelta
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import os
+import socket
+import threading
 import time
 from scanners import *
 import signal
 import sys
 import logging
+import telemetry
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-def should_scan(domain):
-    """Check if domain should be scanned"""
+# Scheduler Settings
+MAX_CONCURRENT_SCANS = int(os.environ.get("WHITERABBIT_MAX_SCANS", 4))  # Jobs run at once by this worker
+DOMAIN_REFRESH_INTERVAL = 60  # Seconds between queueing passes over the domain list
+RETRY_DELAY = 60              # Seconds before rescanning a domain whose scan found nothing
+JOB_POLL_INTERVAL = 5         # Max seconds between claims, other workers may queue jobs meanwhile
+HEARTBEAT_INTERVAL = 60       # Seconds between lease renewals, well below JOB_LEASE
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+METRICS_FLUSH_INTERVAL = 60   # Seconds between writing telemetry to the metrics table
+COMPACTION_INTERVAL = 6 * 3600  # Seconds between compaction passes over the observation history
+
+def next_due(domain, now):
+    """Get the timestamp when domain is due for its next scan"""
     if not domain['last_scan']:
+        return now
+
+    last = datetime.fromisoformat(domain['last_scan']).timestamp()
+    return last + domain['scan_interval']
+
+def scan_domain(domain, due):
+    """Scan one domain, returns True if the scan completed"""
+    lateness = max(0.0, time.time() - due)
+    logging.info(f"Scanning {domain['name']} (late by {lateness:.1f}s)...")
+    telemetry.set_gauge('scan_lag_seconds', lateness, domain['name'])
+
+    try:
+        with telemetry.timer('scan_seconds', domain['name']):
+            # Enumeration streams straight into verification
+            found = check_stream(domain, stream_subdomains_osint(domain))
+
+        if found:
+            update_last_scan(domain['id'])
+            return True
+
+        logging.info(f"No subdomains found")
+
+    except Exception as e:
+        logging.error(f"Error scanning {domain['name']}: {e}")
+        telemetry.incr('scan_errors', domain['name'])
+
+    return False
+
+def run_job(job):
+    """Run one leased job, returns False if it should be retried after RETRY_DELAY"""
+    domain = get_domain(job['domain_id'])
+    if domain is None:
+        return True  # Domain was deleted meanwhile
+
+    if job['kind'] == 'scan':
+        return scan_domain(domain, job['due_at'])
+
+    if job['kind'] == 'reverify':
+        try:
+            with telemetry.timer('reverify_seconds', domain['name']):
+                reverify(domain)
+        except Exception as e:
+            logging.error(f"Error re-verifying {domain['name']}: {e}")
         return True
-    
-    last = datetime.fromisoformat(domain['last_scan'])
-    interval = timedelta(seconds=domain['scan_interval'])
 
-    return datetime.now() > last + interval
+    logging.error(f"Unknown job kind {job['kind']}")
+    return True
+
+def flush_metrics():
+    """Write the telemetry recorded since the last flush to the metrics table"""
+    period_start, period, rows = telemetry.snapshot()
+
+    try:
+        save_metrics(period_start, period, rows)
+    except Exception as e:
+        logging.error(f"Error saving metrics: {e}")
+
+def compact_history():
+    """Roll up old observation history, every worker may run it, a pass is idempotent"""
+    try:
+        with telemetry.timer('compaction_seconds'):
+            result = compact_observations()
+        logging.info(f"Observation history compacted, {result['merged']} rows merged, {result['expired']} expired")
+    except Exception as e:
+        logging.error(f"Error compacting observation history: {e}")
+
+def run_worker(max_concurrent=MAX_CONCURRENT_SCANS):
+    """Claim and run due scan jobs, up to max_concurrent at once
+
+    Any number of workers, on one box or several sharing the database file,
+    can run this loop. Jobs are leased in the database: a worker keeps its
+    leases alive with heartbeats, and if it dies the jobs become claimable
+    again once their lease expires.
+    """
+    running = {}      # job_id -> (future, job)
+    wakeup = threading.Event()
+    next_enqueue = 0
+    next_heartbeat = time.time() + HEARTBEAT_INTERVAL
+    next_flush = time.time() + METRICS_FLUSH_INTERVAL
+    next_compaction = 0
+
+    logging.info(f"Worker {WORKER_ID} started, running up to {max_concurrent} jobs at once")
+
+    with ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="scan") as pool:
+        while True:
+            now = time.time()
+
+            # Hand finished jobs back, empty scans are retried later and crashed jobs marked failed
+            for job_id, (future, job) in list(running.items()):
+                if future.done():
+                    del running[job_id]
+                    try:
+                        if future.exception() is not None:
+                            logging.error(f"Job {job_id} ({job['kind']}) crashed: {future.exception()}")
+                            telemetry.incr('jobs_failed', job['kind'])
+                            fail_scan_job(job_id, WORKER_ID)
+                        elif future.result():
+                            finish_scan_job(job_id, WORKER_ID)
+                        else:
+                            release_scan_job(job_id, WORKER_ID, now + RETRY_DELAY)
+                    except Exception as e:
+                        # The lease expires and another worker picks the job up again
+                        logging.error(f"Error handing back job {job_id}: {e}")
+                        telemetry.incr('worker_errors', 'hand_back')
+
+            # Queue scans of due domains and re-verification of due subdomains, picks up added domains and new intervals
+            if now >= next_enqueue:
+                try:
+                    domains = get_all_domains()
+                    queued = enqueue_scan_jobs(((d['id'], next_due(d, now)) for d in domains), RETRY_DELAY)
+                    queued += enqueue_reverify_jobs()
+                    prune_scan_jobs()
+
+                    # Domains still waiting report their lag now, not only once their scan starts
+                    for name, due in get_overdue_scans(now).items():
+                        telemetry.set_gauge('scan_lag_seconds', now - due, name)
+
+                    logging.info(f"Checking {len(domains)} domains, {queued} jobs queued, {len(running)} jobs running...")
+                except Exception as e:
+                    logging.error(f"Critical error queueing jobs: {e}")
+                    telemetry.incr('worker_errors', 'enqueue')
+                next_enqueue = now + DOMAIN_REFRESH_INTERVAL
+
+            # Keep the leases of running jobs alive, a failed renewal is retried at the next poll
+            if now >= next_heartbeat:
+                try:
+                    held = renew_job_leases(WORKER_ID, list(running))
+                    for job_id in set(running) - set(held):
+                        logging.warning(f"Lost the lease of job {job_id}, another worker may run it too")
+                        telemetry.incr('job_leases_lost')
+                    next_heartbeat = now + HEARTBEAT_INTERVAL
+                except Exception as e:
+                    logging.error(f"Error renewing job leases: {e}")
+                    telemetry.incr('worker_errors', 'heartbeat')
+                    next_heartbeat = now + JOB_POLL_INTERVAL
+
+            # Claim due jobs while there is budget left
+            if len(running) < max_concurrent:
+                try:
+                    claimed = claim_scan_jobs(WORKER_ID, max_concurrent - len(running))
+                except Exception as e:
+                    logging.error(f"Error claiming jobs: {e}")
+                    telemetry.incr('worker_errors', 'claim')
+                    claimed = []
+
+                for job in claimed:
+                    if job['attempts'] > 1:
+                        logging.warning(f"Recovering job {job['id']} ({job['kind']}), attempt {job['attempts']}")
+                    future = pool.submit(run_job, job)
+                    future.add_done_callback(lambda _: wakeup.set())
+                    running[job['id']] = (future, job)
+                    telemetry.incr('jobs_claimed', job['kind'])
+
+            telemetry.set_gauge('jobs_running', len(running), WORKER_ID)
+
+            if now >= next_flush:
+                flush_metrics()
+                next_flush = now + METRICS_FLUSH_INTERVAL
+
+            if now >= next_compaction:
+                compact_history()
+                next_compaction = now + COMPACTION_INTERVAL
+
+            # Sleep until the next due job, queueing pass, heartbeat, metrics flush, compaction or finished job.
+            # Other workers may queue jobs meanwhile, so never longer than JOB_POLL_INTERVAL.
+            deadline = min(next_enqueue, next_heartbeat, next_flush, next_compaction, now + JOB_POLL_INTERVAL)
+            if len(running) < max_concurrent:
+                try:
+                    next_job = get_next_job_due()
+                except Exception as e:
+                    logging.error(f"Error reading the next due job: {e}")
+                    telemetry.incr('worker_errors', 'next_due')
+                    next_job = None
+
+                if next_job is not None:
+                    deadline = min(deadline, next_job)
+
+            wakeup.wait(max(0.0, deadline - time.time()))
+            wakeup.clear()
 
 def signal_handler(sig, frame):
     """Handle graceful shutdown"""
     logging.info('\nShutting down gracefully...')
     sys.exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal_handler)
 
-while True:
-    try:
-        domains = get_all_domains()
-        logging.info(f"Checking {len(domains)} domains...")
-        
-        for domain in domains:
-            if should_scan(domain):
-                try:
-                    logging.info(f"Scanning {domain['name']}...")
-                    subdomains = scan_subdomains_osint(domain)
-                    
-                    if subdomains:
-                        logging.info(f"Found {len(subdomains)} subdomains")
-                        check(domain, subdomains)
-                        update_last_scan(domain['id'])
-                    else:
-                        logging.info(f"No subdomains found")
-                        
-                except Exception as e:
-                    logging.error(f"Error scanning {domain['name']}: {e}")
-                    continue
-        
-        time.sleep(60)
-        
-    except Exception as e:
-        logging.error(f"Critical error in main loop: {e}")
-        time.sleep(60)
-        continue
\ No newline at end of file
+    # Create or upgrade the database schema before the first scan
+    init_db()
+
+    while True:
+        try:
+            run_worker()
+        except Exception as e:
+            logging.error(f"Critical error in main loop: {e}")
+            time.sleep(60)
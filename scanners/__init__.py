@@ -1,2 +1,10 @@
 from .subfinder_integration import *
-from .checks import *
\ No newline at end of file
+from .checks import *
+from .dns_cache import *
+from .dns_engine import *
+from .http_prober import *
+from .known_index import *
+from .port_scanner import *
+from .takeover import *
+from .technologies import *
+from .wildcard import *
\ No newline at end of file
@@ -1,20 +1,37 @@
 import dns.resolver
+import telemetry
 from database import *
-import requests
-import urllib3
+from .dns_cache import CACHEABLE_STATUSES
+from .dns_engine import CLOUDFLARE_DNS, GOOGLE_DNS, resolve_batch
+from .http_prober import FINGERPRINT_FIELDS, PROTOCOLS, probe_batch
+from .known_index import KnownIndex
+from .port_scanner import parse_ports, scan_batch
+from .takeover import get_takeover_index
+from .wildcard import classify_wildcards
 import logging
+import queue
+import threading
+import time
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Disable SSL warnings
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+# Pipeline Settings
+PIPELINE_QUEUE_SIZE = 10000   # Hosts buffered between enumeration and verification
+PIPELINE_BATCH_SIZE = 1000    # Hosts verified together
+PIPELINE_FLUSH_INTERVAL = 5   # Seconds before a partial batch is verified anyway
+PIPELINE_PUT_TIMEOUT = 0.5    # Seconds enumeration waits on a full queue before checking whether the scan stopped
+PIPELINE_JOIN_TIMEOUT = 5     # Seconds a failed scan waits for enumeration to wind down
 
-# DNS Servers
-CLOUDFLARE_DNS = ['1.1.1.1', '1.0.0.1']
-GOOGLE_DNS = ['8.8.8.8', '8.8.4.4']
+# Re-verification Settings
+REVERIFY_BATCH_LIMIT = 5000              # Max known subdomains re-checked per scan
+REVERIFY_MIN_INTERVAL = 6 * 3600         # Seconds, for hosts that keep changing
+REVERIFY_MAX_INTERVAL = 14 * 24 * 3600   # Seconds, for stable or dead hosts
+PAGE_SIZE_TOLERANCE = 0.05               # Relative size change that counts as a change
+
+_END = object()
 
 def dns_check(subdomain, use_cloudflare):
     """Check if subdomain resolves via Cloudflare or Google DNS"""
@@ -40,83 +57,384 @@ def dns_check(subdomain, use_cloudflare):
 
 def http_check(subdomain):
     """Perform HTTP request and collect basic info"""
-    results = {
-        'status_code': None,
-        'page_size': None
-    }
+    for _, results in probe_batch([subdomain], workers=len(PROTOCOLS)):
+        return results
+
+def check(domain, subdomains, known=None, scanned_ips=None):
+    """Check DNS, takeover candidates, ports and HTTP for all subdomains based on domain settings
     
-    for protocol in ['https', 'http']:
-        try:
-            url = f"{protocol}://{subdomain}"
-            
-            response = requests.get(
-                url, 
-                timeout=10,
-                allow_redirects=True,
-                verify=False
+    With a KnownIndex, known subdomains are dropped before touching the
+    database and left to their re-verification schedule. scanned_ips is
+    shared by the batches of one scan, see port_scan().
+    """
+    dns_enabled = domain.get('enable_dns_check', 1) == 1
+    http_enabled = domain.get('enable_http_check', 1) == 1
+    
+    if known is not None:
+        subdomains, known_subdomains = known.split(subdomains)
+        telemetry.incr('hosts_known', domain['name'], len(known_subdomains))
+        if not subdomains:
+            return
+    
+    # Add subdomains to database, only new ones get checked
+    with telemetry.timer('stage_seconds', 'insert'):
+        new_subdomains = add_subdomains(domain['id'], subdomains)
+    telemetry.incr('hosts_new', domain['name'], len(new_subdomains))
+    
+    if known is not None:
+        # Inserted now or by another worker meanwhile, known either way
+        known.add(subdomains)
+    
+    if not new_subdomains:
+        return
+    
+    # DNS Check (if enabled), HTTP only for hosts that resolve on their own
+    if dns_enabled:
+        logging.info(f"DNS: Resolving {len(new_subdomains)} subdomains...")
+        
+        resolved = {}
+        chains = {}
+        with telemetry.timer('stage_seconds', 'dns'):
+            for result in resolve_batch(new_subdomains):
+                if result['resolves']:
+                    resolved[result['subdomain']] = result['addresses']
+                if result['cname']:
+                    chains[result['subdomain']] = (result['cname'], result['status'])
+        
+        # Hosts only answered by a *.zone wildcard aren't worth an HTTP probe
+        with telemetry.timer('stage_seconds', 'wildcard'):
+            wildcards = classify_wildcards(domain['name'], resolved)
+        http_targets = [s for s in resolved if s not in wildcards]
+        
+        with telemetry.timer('stage_seconds', 'takeover'):
+            takeovers, pending = classify_takeovers(chains)
+        
+        with telemetry.timer('stage_seconds', 'db_write'):
+            mark_subdomains_as_dns_checked(new_subdomains[s] for s in resolved)
+            mark_subdomains_as_wildcard(new_subdomains[s] for s in wildcards)
+            save_cname_chains((new_subdomains[s], chain, takeovers.get(s)) for s, (chain, _) in chains.items())
+        logging.info(f"DNS: {len(resolved)}/{len(new_subdomains)} subdomains resolve, {len(wildcards)} via wildcard")
+        if takeovers:
+            telemetry.incr('hosts_takeover', domain['name'], len(takeovers))
+            logging.warning(f"Takeover: {len(takeovers)} subdomains of {domain['name']} have a dangling CNAME")
+        
+        # Port scan (if the domain has a port list), needs the resolved addresses
+        if domain.get('port_list') and http_targets:
+            with telemetry.timer('stage_seconds', 'ports'):
+                port_scan(domain, {s: resolved[s] for s in http_targets}, new_subdomains, scanned_ips)
+    
+    # HTTP Check without DNS (if DNS disabled but HTTP enabled)
+    else:
+        resolved = {}
+        pending = {}
+        http_targets = list(new_subdomains)
+    
+    if http_enabled and http_targets:
+        logging.info(f"HTTP: Probing {len(http_targets)} subdomains...")
+        
+        # Results are written while probing, so this includes their DB writes
+        confirmed = {}
+        with telemetry.timer('stage_seconds', 'http'):
+            update_subdomains_http(
+                (new_subdomains[subdomain], http_results)
+                for subdomain, http_results in _confirm_takeovers(probe_batch(
+                    http_targets,
+                    workers=domain.get('max_http_concurrency'),
+                    addresses=resolved,
+                    mode=domain.get('http_probe_mode'),
+                    markers={s: markers for s, (_, markers) in pending.items()}
+                ), pending, confirmed)
+                if http_results['status_code']
             )
+        
+        if confirmed:
+            telemetry.incr('hosts_takeover', domain['name'], len(confirmed))
+            mark_subdomains_as_takeover((new_subdomains[s], provider) for s, provider in confirmed.items())
+            logging.warning(f"Takeover: {len(confirmed)} subdomains of {domain['name']} serve an unclaimed provider page")
+
+def classify_takeovers(chains):
+    """Match CNAME chains against the takeover fingerprints
+    
+    chains is {subdomain: (chain, DNS status)}. Returns (takeovers,
+    pending): takeovers is {subdomain: provider} of hosts DNS alone flags,
+    pending {subdomain: (provider, body markers)} of hosts whose probe has
+    to show one of the markers.
+    """
+    index = get_takeover_index()
+    takeovers = {}
+    pending = {}
+    
+    for subdomain, (chain, status) in chains.items():
+        provider, markers = index.classify(chain, status)
+        if provider and markers:
+            pending[subdomain] = (provider, markers)
+        elif provider:
+            takeovers[subdomain] = provider
+    
+    return takeovers, pending
+
+def _confirm_takeovers(results, pending, confirmed):
+    """Pass probe results through, noting pending takeovers whose body marker showed up in confirmed"""
+    for subdomain, http_results in results:
+        if subdomain in pending and http_results.get('body_marker'):
+            confirmed[subdomain] = pending[subdomain][0]
+        yield subdomain, http_results
+
+def port_scan(domain, addresses, subdomain_ids, scanned_ips=None):
+    """Scan the domain's port list once per IP and store the open ports of every subdomain on it
+    
+    addresses is {subdomain: [ip, ...]}, subdomain_ids {subdomain: id}.
+    scanned_ips maps IPs scanned earlier in the same scan to their open
+    ports, they are not scanned again and it is updated in place.
+    """
+    try:
+        ports = parse_ports(domain['port_list'])
+    except ValueError as e:
+        logging.error(f"Invalid port list for {domain['name']}: {e}")
+        return
+    
+    scanned_ips = {} if scanned_ips is None else scanned_ips
+    ips = sorted({ip for ips in addresses.values() for ip in ips} - scanned_ips.keys())
+    
+    if ips:
+        logging.info(f"Ports: Scanning {len(ports)} ports on {len(ips)} IPs of {len(addresses)} subdomains...")
+        for ip in ips:
+            scanned_ips[ip] = []
+        for ip, port in scan_batch(ips, ports):
+            scanned_ips[ip].append(port)
+    
+    save_open_ports(
+        (subdomain_ids[subdomain], ip, port)
+        for subdomain, ips in addresses.items()
+        for ip in ips
+        for port in scanned_ips[ip]
+    )
+
+def check_stream(domain, subdomains):
+    """Verify subdomains in batches while they are still being enumerated
+    
+    Enumeration runs in a helper thread and feeds a bounded queue, so DNS and
+    HTTP checks overlap with it. If verification fails, enumeration is told
+    to stop and closes the subdomains generator, which ends subfinder.
+    Returns the number of subdomains received.
+    """
+    hosts = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    
+    def offer(item):
+        """Queue an item for verification, False once the scan stopped"""
+        while not stop.is_set():
+            try:
+                hosts.put(item, timeout=PIPELINE_PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def produce():
+        try:
+            for subdomain in subdomains:
+                if not offer(subdomain):
+                    break
+        except Exception as e:
+            logging.error(f"Enumeration error for {domain['name']}: {e}")
+        finally:
+            if hasattr(subdomains, 'close'):
+                subdomains.close()
+            offer(_END)
+    
+    producer = threading.Thread(target=produce, name="enumeration", daemon=True)
+    producer.start()
+    
+    try:
+        # One index load per scan instead of an insert attempt per known host
+        with telemetry.timer('stage_seconds', 'known_index'):
+            known = KnownIndex.load(domain['id'])
+        telemetry.set_gauge('known_index_bytes', known.memory_bytes(), domain['name'])
+        if len(known):
+            logging.info(f"Known index for {domain['name']}: {len(known)} names in {known.memory_bytes() / 1048576:.1f} MB "
+                         f"({known.bytes_per_million() / 1048576:.1f} MB per million names)")
+        
+        scanned_ips = {}  # ip -> open ports, each IP is port scanned once per scan
+        total = 0
+        finished = False
+        
+        while not finished:
+            batch = []
+            flush_at = time.monotonic() + PIPELINE_FLUSH_INTERVAL
             
-            results['status_code'] = response.status_code
-            results['page_size'] = len(response.content)
-            
-            logging.info(f"HTTP {subdomain} - Status: {results['status_code']}, Size: {results['page_size']} bytes")
+            while len(batch) < PIPELINE_BATCH_SIZE:
+                try:
+                    item = hosts.get(timeout=max(0.0, flush_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                
+                if item is _END:
+                    finished = True
+                    break
+                batch.append(item)
             
-            if protocol == 'https':
+            if batch:
+                total += len(batch)
+                telemetry.set_gauge('pipeline_queue_depth', hosts.qsize(), domain['name'])
+                check(domain, batch, known, scanned_ips)
+        
+        return total
+    finally:
+        # Unblock enumeration if verification failed, a waiting put gives up once stop is set
+        stop.set()
+        while True:
+            try:
+                hosts.get_nowait()
+            except queue.Empty:
                 break
-                
-        except (requests.exceptions.SSLError, 
-                requests.exceptions.ConnectionError,
-                requests.exceptions.Timeout):
-            continue
-        except Exception as e:
-            logging.error(f"HTTP error on {protocol}://{subdomain}: {e}")
-            continue
+        
+        # Enumeration notices stop when subfinder prints its next host or times out
+        producer.join(PIPELINE_JOIN_TIMEOUT)
+        if producer.is_alive():
+            logging.warning(f"Enumeration of {domain['name']} still winding down after the scan stopped")
+
+def _size_changed(old, new):
+    """Check if a page size differs by more than PAGE_SIZE_TOLERANCE"""
+    if old is None or new is None:
+        return old != new
     
-    return results
+    return abs(new - old) > PAGE_SIZE_TOLERANCE * max(old, 1)
 
-def check(domain, subdomains):
-    """Check DNS and HTTP for all subdomains based on domain settings"""
-    use_cloudflare = True
+def _fingerprint_changes(old, new):
+    """Get fingerprint transitions, only between two fingerprints of the same kind
+    
+    Rows probed before fingerprints existed, or in head mode without a
+    body, have no body_hash and nothing to compare the body fields with.
+    """
+    changes = []
+    
+    if old['final_url'] and new['final_url'] and old['final_url'] != new['final_url']:
+        changes.append(('final_url', old['final_url'], new['final_url']))
+    
+    if old['body_hash'] and new['body_hash']:
+        if old['title'] != new['title']:
+            changes.append(('title', old['title'], new['title']))
+        if old['body_hash'] != new['body_hash']:
+            changes.append(('body_hash', old['body_hash'], new['body_hash']))
+    
+    return changes
+
+def reverify(domain, limit=None):
+    """Re-check known subdomains whose next check is due and record transitions
+    
+    Hosts that changed are checked twice as often next time (down to
+    REVERIFY_MIN_INTERVAL), unchanged ones back off (up to REVERIFY_MAX_INTERVAL).
+    Returns the number of subdomains re-checked.
+    """
     dns_enabled = domain.get('enable_dns_check', 1) == 1
     http_enabled = domain.get('enable_http_check', 1) == 1
     
-    for subdomain in subdomains:
-        # Add subdomain to database
-        subdomain_id = add_subdomain(domain['id'], subdomain)
-        
-        if subdomain_id:
-            # DNS Check (if enabled)
-            if dns_enabled:
-                dns_provider = "Cloudflare" if use_cloudflare else "Google"
-                logging.info(f"DNS:{dns_provider} Checking {subdomain}...")
-                
-                if dns_check(subdomain, use_cloudflare):
-                    mark_subdomain_as_dns_checked(subdomain_id)
-                    logging.info(f"DNS resolves")
-                    
-                    # HTTP Check (if enabled and DNS resolves)
-                    if http_enabled:
-                        http_results = http_check(subdomain)
-                        
-                        if http_results['status_code']:
-                            update_subdomain_http(
-                                subdomain_id,
-                                http_results['status_code'],
-                                http_results['page_size']
-                            )
-                else:
-                    logging.info(f"DNS does not resolve")
-                
-                # Toggle DNS provider
-                use_cloudflare = not use_cloudflare
-            
-            # HTTP Check without DNS (if DNS disabled but HTTP enabled)
-            elif http_enabled:
-                http_results = http_check(subdomain)
+    # Claimed rows are hidden from other workers until their results are recorded
+    due = {row['subdomain']: row for row in claim_due_subdomains(domain['id'], limit or REVERIFY_BATCH_LIMIT)}
+    if not due:
+        return 0
+    
+    logging.info(f"Re-verifying {len(due)} known subdomains of {domain['name']}...")
+    
+    # Start from the stored state, checks below overwrite what they cover
+    state = {
+        subdomain: {
+            'dns_checked': row['dns_checked'],
+            'is_wildcard': row['is_wildcard'],
+            'status_code': row['status_code'],
+            'page_size': row['page_size'],
+            'cname': row['cname'],
+            'takeover': row['takeover'],
+            **{field: row[field] for field in FINGERPRINT_FIELDS}
+        }
+        for subdomain, row in due.items()
+    }
+    
+    # Hosts whose lookup failed (timeout, SERVFAIL, error) keep their stored state and interval
+    failed = set()
+    
+    if dns_enabled:
+        resolved = {}
+        chains = {}
+        with telemetry.timer('stage_seconds', 'reverify_dns'):
+            for result in resolve_batch(due):
+                if result['status'] not in CACHEABLE_STATUSES:
+                    failed.add(result['subdomain'])
+                    continue
                 
-                if http_results['status_code']:
-                    update_subdomain_http(
-                        subdomain_id,
-                        http_results['status_code'],
-                        http_results['page_size']
-                    )
\ No newline at end of file
+                state[result['subdomain']]['dns_checked'] = 1 if result['resolves'] else 0
+                if result['resolves']:
+                    resolved[result['subdomain']] = result['addresses']
+                chains[result['subdomain']] = (result['cname'], result['status'])
+                state[result['subdomain']]['cname'] = ",".join(result['cname']) or None
+        
+        with telemetry.timer('stage_seconds', 'wildcard'):
+            wildcards = classify_wildcards(domain['name'], resolved)
+        for subdomain in resolved:
+            state[subdomain]['is_wildcard'] = 1 if subdomain in wildcards else 0
+        
+        with telemetry.timer('stage_seconds', 'takeover'):
+            takeovers, pending = classify_takeovers(chains)
+        for subdomain in chains:
+            if subdomain not in pending:
+                state[subdomain]['takeover'] = takeovers.get(subdomain)
+        
+        http_targets = [s for s in resolved if s not in wildcards]
+    else:
+        resolved = {}
+        pending = {}
+        http_targets = list(due)
+    
+    if http_enabled and http_targets:
+        with telemetry.timer('stage_seconds', 'reverify_http'):
+            for subdomain, http_results in probe_batch(
+                http_targets,
+                workers=domain.get('max_http_concurrency'),
+                addresses=resolved,
+                mode=domain.get('http_probe_mode'),
+                markers={s: markers for s, (_, markers) in pending.items()}
+            ):
+                state[subdomain].update(http_results)
+                # Hosts a probe can't confirm keep their stored flag
+                if subdomain in pending:
+                    state[subdomain]['takeover'] = pending[subdomain][0] if http_results['body_marker'] else None
+    
+    checks = []
+    for subdomain, row in due.items():
+        new = state[subdomain]
+        changes = []
+        
+        if new['dns_checked'] != row['dns_checked']:
+            changes.append(('dns', 'up' if row['dns_checked'] else 'down', 'up' if new['dns_checked'] else 'down'))
+        if new['status_code'] != row['status_code']:
+            changes.append(('status_code', row['status_code'], new['status_code']))
+        if _size_changed(row['page_size'], new['page_size']):
+            changes.append(('page_size', row['page_size'], new['page_size']))
+        changes += _fingerprint_changes(row, new)
+        if new['cname'] != row['cname']:
+            changes.append(('cname', row['cname'], new['cname']))
+        if new['takeover'] != row['takeover']:
+            changes.append(('takeover', row['takeover'], new['takeover']))
+        
+        # A new body hash alone doesn't speed up checks, dynamic pages change it every time
+        interval = row['check_interval'] or REVERIFY_MIN_INTERVAL
+        if subdomain not in failed:
+            if any(field != 'body_hash' for field, _, _ in changes):
+                interval = max(REVERIFY_MIN_INTERVAL, interval // 2)
+            else:
+                interval = min(REVERIFY_MAX_INTERVAL, interval * 2)
+        
+        checks.append({'id': row['id'], 'check_interval': interval, 'changes': changes, **new})
+    
+    with telemetry.timer('stage_seconds', 'db_write'):
+        record_subdomain_checks(checks)
+    
+    changed = sum(1 for c in checks if c['changes'])
+    telemetry.incr('hosts_reverified', domain['name'], len(checks))
+    telemetry.incr('hosts_changed', domain['name'], changed)
+    # Only hosts flagged by this check, not the ones still flagged
+    flagged = sum(1 for c in checks for field, _, takeover in c['changes'] if field == 'takeover' and takeover)
+    telemetry.incr('hosts_takeover', domain['name'], flagged)
+    logging.info(f"Re-verification: {changed}/{len(checks)} subdomains changed")
+    return len(checks)
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+from database import load_dns_cache, save_dns_cache
+
+# Cache Settings
+DNS_CACHE_SIZE = 200000      # Max cached names, least recently used are evicted
+DNS_CACHE_MIN_TTL = 30       # Seconds, floor for very short record TTLs
+DNS_CACHE_MAX_TTL = 3600     # Seconds, cap so re-verification sees fresh answers
+DNS_CACHE_NEGATIVE_TTL = 300 # Seconds for NXDOMAIN/NODATA answers without SOA
+DNS_CACHE_PERSIST = True     # Keep the cache in the database across worker restarts
+
+# Only definitive answers are cached, timeouts and SERVFAIL are retried
+CACHEABLE_STATUSES = ('ok', 'nxdomain', 'noanswer')
+
+class DnsCache:
+    """Thread-safe LRU cache of DNS answers that honours record TTLs"""
+
+    def __init__(self, max_entries=None, min_ttl=None, max_ttl=None, persist=None):
+        self.max_entries = max_entries or DNS_CACHE_SIZE
+        self.min_ttl = DNS_CACHE_MIN_TTL if min_ttl is None else min_ttl
+        self.max_ttl = DNS_CACHE_MAX_TTL if max_ttl is None else max_ttl
+        self.persist = DNS_CACHE_PERSIST if persist is None else persist
+
+        self._entries = OrderedDict()  # name -> (expires_at, status, addresses, cname chain)
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._loaded = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, name):
+        """Get a cached result for name, None on a miss or an expired entry"""
+        self._load()
+
+        with self._lock:
+            entry = self._entries.get(name)
+
+            if entry is None or entry[0] <= time.time():
+                if entry is not None:
+                    del self._entries[name]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(name)
+            self.hits += 1
+
+        expires_at, status, addresses, cname = entry
+        return {
+            'subdomain': name,
+            'resolves': bool(addresses),
+            'addresses': list(addresses),
+            'cname': list(cname),
+            'status': status,
+            'resolver': 'cache',
+            'ttl': int(expires_at - time.time())
+        }
+
+    def put(self, result):
+        """Cache a resolver result for its clamped TTL"""
+        if result['status'] not in CACHEABLE_STATUSES:
+            return
+
+        ttl = result.get('ttl')
+        if ttl is None:
+            ttl = DNS_CACHE_NEGATIVE_TTL
+        ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+
+        self._store(result['subdomain'], time.time() + ttl, result['status'], tuple(result['addresses']),
+                    tuple(result.get('cname', ())))
+
+    def _store(self, name, expires_at, status, addresses, cname=(), dirty=True):
+        """Insert an entry and evict the least recently used ones above the limit"""
+        with self._lock:
+            self._entries[name] = (expires_at, status, addresses, cname)
+            self._entries.move_to_end(name)
+
+            if dirty:
+                self._dirty.add(name)
+
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                self._dirty.discard(evicted)
+
+    def _load(self):
+        """Fill the cache from the database once"""
+        if self._loaded or not self.persist:
+            return
+        self._loaded = True
+
+        for name, status, addresses, expires_at, cname in load_dns_cache(limit=self.max_entries):
+            self._store(name, expires_at, status, tuple(filter(None, addresses.split(','))),
+                        tuple(filter(None, cname.split(','))), dirty=False)
+
+    def save(self):
+        """Write new entries to the database"""
+        if not self.persist:
+            return
+
+        with self._lock:
+            rows = [
+                (name, entry[1], ','.join(entry[2]), entry[0], ','.join(entry[3]))
+                for name in self._dirty
+                if (entry := self._entries.get(name))
+            ]
+            self._dirty.clear()
+
+        if rows:
+            save_dns_cache(rows)
+
+    def stats(self):
+        """Get hit/miss counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_dns_cache():
+    """Get the process-wide DNS cache shared by all scans"""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = DnsCache()
+        return _cache
@@ -0,0 +1,249 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+
+import dns.asyncresolver
+import dns.exception
+import dns.name
+import dns.rdatatype
+import dns.resolver
+
+import telemetry
+from .dns_cache import get_dns_cache
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# DNS Servers
+CLOUDFLARE_DNS = ['1.1.1.1', '1.0.0.1']
+GOOGLE_DNS = ['8.8.8.8', '8.8.4.4']
+DNS_SERVERS = CLOUDFLARE_DNS + GOOGLE_DNS
+DNS_PORT = 53
+
+# Engine Settings
+DNS_CONCURRENCY = 500  # Max in-flight queries per batch
+DNS_TIMEOUT = 3        # Seconds per attempt
+DNS_RETRIES = 2        # Extra attempts on the next resolver after a timeout/SERVFAIL
+MAX_CNAME_CHAIN = 16   # CNAME hops followed in an answer
+
+_DONE = object()
+
+def _make_resolvers(nameservers, port, timeout):
+    """Build one async resolver per nameserver so load can be spread across them"""
+    resolvers = []
+
+    for server in nameservers:
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        resolver.nameservers = [server]
+        resolver.port = port
+        resolver.timeout = timeout
+        resolver.lifetime = timeout
+        resolvers.append((server, resolver))
+
+    return resolvers
+
+def _negative_ttl(response):
+    """Get the negative caching TTL from the SOA of an NXDOMAIN/NODATA response"""
+    if response is None:
+        return None
+
+    for rrset in response.authority:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+
+    return None
+
+def _cname_chain(response, subdomain):
+    """Follow the CNAME records in the answer section from subdomain, returns the targets in order
+
+    Resolvers send the whole chain with the A answer, and with NXDOMAIN
+    or NODATA when its last target doesn't resolve, so no extra query is needed.
+    """
+    if response is None:
+        return []
+
+    targets = {rrset.name: rrset[0].target for rrset in response.answer if rrset.rdtype == dns.rdatatype.CNAME}
+    name = dns.name.from_text(subdomain)
+    chain = []
+
+    while name in targets and len(chain) < MAX_CNAME_CHAIN:
+        name = targets[name]
+        chain.append(name.to_text(omit_final_dot=True).lower())
+
+    return chain
+
+async def _resolve_one(subdomain, resolvers, retries):
+    """Resolve A records and the CNAME chain for one subdomain, moving to the next resolver on failure"""
+    result = {
+        'subdomain': subdomain,
+        'resolves': False,
+        'addresses': [],
+        'cname': [],
+        'status': None,
+        'resolver': None,
+        'ttl': None
+    }
+
+    for attempt in range(retries + 1):
+        server, resolver = next(resolvers)
+        result['resolver'] = server
+        telemetry.incr('dns_queries', server)
+
+        try:
+            with telemetry.timer('dns_query_seconds', server):
+                answers = await resolver.resolve(subdomain, 'A', search=False)
+            result['addresses'] = sorted({rdata.address for rdata in answers})
+            result['resolves'] = bool(result['addresses'])
+            result['cname'] = _cname_chain(answers.response, subdomain)
+            result['status'] = 'ok'
+            result['ttl'] = answers.rrset.ttl
+            return result
+
+        except dns.resolver.NXDOMAIN as e:
+            response = e.responses().get(e.qnames()[0])
+            result['status'] = 'nxdomain'
+            result['ttl'] = _negative_ttl(response)
+            result['cname'] = _cname_chain(response, subdomain)
+            return result
+        except dns.resolver.NoAnswer as e:
+            response = e.kwargs.get('response')
+            result['status'] = 'noanswer'
+            result['ttl'] = _negative_ttl(response)
+            result['cname'] = _cname_chain(response, subdomain)
+            return result
+        except dns.exception.Timeout:
+            result['status'] = 'timeout'
+            telemetry.incr('dns_timeouts', server)
+        except dns.resolver.NoNameservers:
+            result['status'] = 'servfail'
+            telemetry.incr('dns_errors', server)
+        except Exception as e:
+            logging.error(f"DNS error for {subdomain}: {e}")
+            result['status'] = 'error'
+            telemetry.incr('dns_errors', server)
+            return result
+
+    if result['status'] == 'timeout':
+        logging.error(f"DNS timeout for {subdomain}")
+
+    return result
+
+async def resolve_stream(subdomains, nameservers=None, port=None, concurrency=None,
+                         timeout=None, retries=None, cache=True):
+    """Resolve many subdomains concurrently, yielding results as they complete
+
+    Answers come from the shared DNS cache when possible, cache=False forces
+    every name to go to the network.
+    """
+    dns_cache = get_dns_cache() if cache else None
+    nameservers = nameservers or DNS_SERVERS
+    concurrency = concurrency or DNS_CONCURRENCY
+    if hasattr(subdomains, '__len__'):
+        concurrency = max(1, min(concurrency, len(subdomains)))
+    retries = DNS_RETRIES if retries is None else retries
+
+    resolvers = itertools.cycle(_make_resolvers(
+        nameservers,
+        port or DNS_PORT,
+        timeout or DNS_TIMEOUT
+    ))
+
+    # Workers share one iterator, so at most `concurrency` queries are in flight
+    pending = iter(subdomains)
+    results = asyncio.Queue(maxsize=concurrency)
+
+    async def worker():
+        try:
+            for subdomain in pending:
+                result = dns_cache.get(subdomain) if dns_cache else None
+
+                if result is not None:
+                    telemetry.incr('dns_cache_hits')
+                else:
+                    result = await _resolve_one(subdomain, resolvers, retries)
+                    if dns_cache:
+                        dns_cache.put(result)
+
+                await results.put(result)
+        except Exception as e:
+            logging.error(f"DNS worker error: {e}")
+
+        await results.put(_DONE)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    running = len(workers)
+
+    try:
+        while running:
+            item = await results.get()
+
+            if item is _DONE:
+                running -= 1
+            else:
+                yield item
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+def resolve_batch(subdomains, **options):
+    """Resolve a batch of subdomains from sync code, yielding results as they complete
+
+    The event loop runs in a helper thread, so callers can keep using the
+    blocking database API while lookups continue in the background.
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+
+    async def pump():
+        stream = resolve_stream(subdomains, **options)
+        try:
+            async for result in stream:
+                results.put(result)
+                if stop.is_set():
+                    break
+        finally:
+            await stream.aclose()
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except Exception as e:
+            logging.error(f"DNS engine error: {e}")
+        finally:
+            results.put(_DONE)
+
+    thread = threading.Thread(target=run, name="dns-engine", daemon=True)
+    thread.start()
+
+    started = time.monotonic()
+    count = 0
+
+    try:
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+
+            count += 1
+            yield item
+    finally:
+        stop.set()
+        elapsed = time.monotonic() - started
+        if count:
+            logging.info(f"DNS: {count} lookups in {elapsed:.1f}s ({count / max(elapsed, 0.001):.0f}/s)")
+
+        if options.get('cache', True):
+            dns_cache = get_dns_cache()
+            stats = dns_cache.stats()
+            logging.info(f"DNS cache: {stats['entries']} entries, {stats['hits']} hits, {stats['misses']} misses")
+
+            try:
+                dns_cache.save()
+            except Exception as e:
+                logging.error(f"DNS cache save error: {e}")
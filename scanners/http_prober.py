@@ -0,0 +1,537 @@
+import html
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from hashlib import blake2b
+from urllib.parse import urljoin
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+import telemetry
+from .technologies import favicon_hash, get_matcher
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Disable SSL warnings
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# Prober Settings
+HTTP_WORKERS = 50          # Max hosts probed at once per batch, unless the domain sets its own ceiling
+HTTP_POOL_SIZE = 10        # Keep-alive connections per host and worker
+HTTP_CONNECT_TIMEOUT = 5   # Seconds to establish a connection
+HTTP_READ_TIMEOUT = 10     # Seconds between bytes
+HTTP_DEADLINE = 15         # Seconds for a whole probe, redirects and body included
+PROTOCOLS = ['https', 'http']  # In order of preference, probed in parallel
+HTTP_HEAD_START = 1.0          # Seconds a protocol waits for the preferred ones to answer or fail before it starts
+PROBE_PORTS = {}               # Optional non-default port per protocol, e.g. {'https': 8443}
+
+# Probe Modes, how much of a response is downloaded
+#   head:           HEAD, size from Content-Length, GET (as content-length) if the server won't say
+#   content-length: GET, trust Content-Length and only read HTTP_SNIPPET_BYTES for the fingerprint
+#   capped:         GET, read at most HTTP_BODY_CAP bytes, Content-Length for the size of bigger pages
+#   full:           GET, count the whole body (streamed, never buffered)
+PROBE_MODES = ('head', 'content-length', 'capped', 'full')
+HTTP_PROBE_MODE = 'capped'   # Unless the domain sets its own
+HTTP_BODY_CAP = 1048576      # Bytes read per response in capped mode, and hashed in full mode
+HTTP_SNIPPET_BYTES = 65536   # Bytes searched for the <title>, all that content-length mode reads
+HEAD_FALLBACK_STATUSES = {405, 501}  # HEAD not supported, retry with GET
+TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+TITLE_MAX_LENGTH = 200
+FINGERPRINT_FIELDS = ('body_hash', 'title', 'final_url', 'redirect_count')
+FAVICON_PROBE_MODES = ('full',)  # Modes that also fetch /favicon.ico, if any signature has a favicon hash
+FAVICON_MAX_BYTES = 102400       # Bigger favicons aren't hashed
+
+# Adaptive Concurrency Settings (AIMD), counted in hosts being probed
+HTTP_GLOBAL_INITIAL = 10   # Hosts in flight per batch to start with
+HTTP_IP_INITIAL = 2        # Hosts in flight per destination IP to start with
+HTTP_IP_MAX = 64           # Ceiling per destination IP
+HTTP_IP_LIMITS_MAX = 10000 # Remembered IPs before idle ones are forgotten
+HTTP_LOOKAHEAD = 4         # Hosts buffered per global slot, so a busy IP doesn't block the others
+AIMD_INCREASE = 1.0        # Added per limit's worth of answered hosts
+AIMD_DECREASE = 0.5        # Factor applied on congestion
+THROTTLE_STATUSES = {429, 503}
+RESET_MARKERS = ('Connection reset', 'Connection aborted', 'RemoteDisconnected')
+
+_local = threading.local()
+_ip_limits = {}  # destination -> AimdLimit, shared by all batches of the process
+_ip_limits_lock = threading.Lock()
+
+def _get_session():
+    """Return this thread's pooled keep-alive session"""
+    session = getattr(_local, 'session', None)
+
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=0
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.verify = False
+        _local.session = session
+
+    return session
+
+class AimdLimit:
+    """Concurrency limit that grows additively on success and halves on congestion
+
+    Starts in slow start (+1 per answered host) until the first congestion
+    signal, then grows by AIMD_INCREASE per limit's worth of answers. Only
+    hosts started after the last decrease can shrink it again, so one burst
+    of timeouts counts once.
+    """
+
+    def __init__(self, initial, ceiling):
+        self.ceiling = max(1, ceiling)
+        self.limit = float(min(initial, self.ceiling))
+        self.in_flight = 0
+        self.started = 0
+        self.slow_start = True
+        self._window = 0  # self.started at the last decrease
+
+    def has_room(self):
+        return self.in_flight < int(self.limit)
+
+    def start(self):
+        """Take a slot, returns its sequence number for finish()"""
+        self.in_flight += 1
+        self.started += 1
+        return self.started
+
+    def finish(self, sequence, answered, congested):
+        """Give a slot back and adapt the limit to how the host behaved"""
+        self.in_flight -= 1
+
+        if congested:
+            self.slow_start = False
+            if sequence > self._window:
+                self.limit = max(1.0, self.limit * AIMD_DECREASE)
+                self._window = self.started
+        elif answered:
+            step = 1.0 if self.slow_start else AIMD_INCREASE / self.limit
+            self.limit = min(float(self.ceiling), self.limit + step)
+
+def _ip_limit(destination):
+    """Get the shared limit of a destination, caller holds _ip_limits_lock"""
+    limit = _ip_limits.get(destination)
+
+    if limit is None:
+        if len(_ip_limits) >= HTTP_IP_LIMITS_MAX:
+            for key in [k for k, v in _ip_limits.items() if not v.in_flight]:
+                del _ip_limits[key]
+
+        limit = _ip_limits[destination] = AimdLimit(HTTP_IP_INITIAL, HTTP_IP_MAX)
+
+    return limit
+
+class _Cancelled(Exception):
+    """A probe stopped because the host's other protocol already answered, args[0] is the bytes read"""
+
+def _content_length(response):
+    """Get the declared body size of a response, None if missing or invalid"""
+    try:
+        length = int(response.headers.get('Content-Length', ''))
+    except ValueError:
+        return None
+    return length if length >= 0 else None
+
+def _read_body(response, limit, deadline, url, cancel=None):
+    """Stream a body without buffering it
+
+    Reads at most limit bytes (None for all). Returns (bytes read, hash of
+    the first limit or HTTP_BODY_CAP bytes, the first HTTP_SNIPPET_BYTES,
+    True if the body went on past limit). Raises _Cancelled once cancel is set.
+    """
+    size = 0
+    digest = blake2b(digest_size=8)
+    hashed = HTTP_BODY_CAP if limit is None else limit
+    snippet = b''
+    truncated = False
+
+    for chunk in response.iter_content(chunk_size=65536):
+        if limit is not None and size + len(chunk) > limit:
+            chunk = chunk[:limit - size]
+            truncated = True
+
+        if size < hashed:
+            digest.update(chunk[:hashed - size])
+        if len(snippet) < HTTP_SNIPPET_BYTES:
+            snippet += chunk[:HTTP_SNIPPET_BYTES - len(snippet)]
+        size += len(chunk)
+
+        if truncated:
+            break
+        if cancel is not None and cancel.is_set():
+            raise _Cancelled(size)
+        if time.monotonic() > deadline:
+            raise requests.exceptions.Timeout(f"Probe deadline exceeded for {url}")
+
+    return size, digest.hexdigest(), snippet, truncated
+
+def _title(snippet):
+    """Extract the page title from the start of a body"""
+    match = TITLE_PATTERN.search(snippet)
+    if not match:
+        return None
+
+    title = " ".join(html.unescape(match.group(1).decode('utf-8', errors='replace')).split())
+    return title[:TITLE_MAX_LENGTH] or None
+
+def _favicon(session, response, timeout, deadline):
+    """Fetch and hash /favicon.ico of the final URL's site, None if there is none"""
+    url = urljoin(response.url, '/favicon.ico')
+    protocol = url.split(':', 1)[0]
+    telemetry.incr('http_requests', protocol)
+
+    try:
+        with session.get(url, timeout=timeout, allow_redirects=True, stream=True) as icon:
+            if icon.status_code != 200:
+                return None
+
+            data = b''
+            for chunk in icon.iter_content(chunk_size=16384):
+                data += chunk
+                if len(data) > FAVICON_MAX_BYTES or time.monotonic() > deadline:
+                    return None
+
+            telemetry.incr('http_bytes', protocol, len(data))
+            return favicon_hash(data) if data else None
+    except requests.exceptions.RequestException:
+        return None
+
+def _technologies(response, snippet=None, favicon=None):
+    """Detect the technologies of a response from its headers, cookies, body start and favicon"""
+    cookies = [(cookie.name, cookie.value) for hop in (*response.history, response) for cookie in hop.cookies]
+    # urllib3 keeps repeated headers apart, requests joins them with commas
+    headers = response.raw.headers if response.raw is not None else response.headers
+
+    with telemetry.timer('tech_match_seconds'):
+        return get_matcher().match(headers, cookies, snippet, favicon)
+
+def _body_marker(snippet, markers):
+    """Get the first of markers found in the body start, None if there is none"""
+    if not snippet or not markers:
+        return None
+
+    marker = next((marker for marker in markers if marker in snippet), None)
+    return marker.decode('utf-8', errors='replace') if marker else None
+
+def _result(protocol, response, page_size, body_hash=None, snippet=None, favicon=None, markers=None):
+    """Build a probe result with the response fingerprint, technologies and body marker"""
+    return {
+        'status_code': response.status_code,
+        'page_size': page_size,
+        'protocol': protocol,
+        'body_hash': body_hash,
+        'title': _title(snippet) if snippet else None,
+        'final_url': response.url,
+        'redirect_count': len(response.history),
+        'technologies': _technologies(response, snippet, favicon),
+        'body_marker': _body_marker(snippet, markers)
+    }
+
+class _Race:
+    """The protocol probes of one host, in PROTOCOLS order of preference
+
+    A probe waits up to HTTP_HEAD_START for every preferred protocol to
+    fail before it starts, and is stopped as soon as one of them gets a
+    response, so a host that answers on HTTPS never downloads an HTTP body.
+    """
+
+    def __init__(self, protocols):
+        self.protocols = list(protocols)
+        self.stops = {protocol: threading.Event() for protocol in self.protocols}
+        self._failed = set()
+        self._condition = threading.Condition()
+
+    def wait_turn(self, protocol):
+        """Wait until the preferred protocols failed or HTTP_HEAD_START passed, False if stopped meanwhile"""
+        preferred = self.protocols[:self.protocols.index(protocol)]
+
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.stops[protocol].is_set() or self._failed.issuperset(preferred),
+                HTTP_HEAD_START if preferred else 0
+            )
+
+        return not self.stops[protocol].is_set()
+
+    def answered(self, protocol):
+        """Stop the protocols less preferred than one that got a response"""
+        with self._condition:
+            for other in self.protocols[self.protocols.index(protocol) + 1:]:
+                self.stops[other].set()
+            self._condition.notify_all()
+
+    def failed(self, protocol):
+        """Let the less preferred protocols start without waiting out their head start"""
+        with self._condition:
+            self._failed.add(protocol)
+            self._condition.notify_all()
+
+    def stop(self):
+        """Stop every probe of the host that hasn't finished"""
+        with self._condition:
+            for event in self.stops.values():
+                event.set()
+            self._condition.notify_all()
+
+def _probe(protocol, subdomain, mode=None, markers=None, cancel=None, on_response=None):
+    """Fetch one URL within HTTP_DEADLINE, downloading as little as mode allows
+
+    markers are byte strings looked for in the body start, a host with
+    markers is never probed in head mode. Once the cancel event is set the
+    probe stops at its next chunk or request and closes the response.
+    on_response is called as soon as a response arrives. Returns (result, congested): result is None if the host did not answer
+    or the probe was cancelled, congested is True for timeouts, connection
+    resets and 429/503 answers.
+    """
+    mode = mode or HTTP_PROBE_MODE
+    if mode == 'head' and markers:
+        mode = 'content-length'
+    url = f"{protocol}://{subdomain}"
+    if protocol in PROBE_PORTS:
+        url += f":{PROBE_PORTS[protocol]}"
+    deadline = time.monotonic() + HTTP_DEADLINE
+    timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+    session = _get_session()
+    telemetry.incr('http_requests', protocol)
+
+    try:
+        with telemetry.timer('http_probe_seconds', protocol):
+            if mode == 'head':
+                response = session.head(url, timeout=timeout, allow_redirects=True)
+                response.close()
+                if on_response:
+                    on_response()
+                length = _content_length(response)
+
+                if response.status_code not in HEAD_FALLBACK_STATUSES and length is not None:
+                    return _result(protocol, response, length), response.status_code in THROTTLE_STATUSES
+
+                # No usable answer to HEAD, fetch only what content-length mode needs
+                telemetry.incr('http_requests', protocol)
+                mode = 'content-length'
+
+            if cancel is not None and cancel.is_set():
+                raise _Cancelled(0)
+
+            with session.get(url, timeout=timeout, allow_redirects=True, stream=True) as response:
+                if on_response:
+                    on_response()
+                length = _content_length(response)
+
+                if mode == 'full':
+                    limit = None
+                elif mode == 'content-length' and length is not None:
+                    limit = HTTP_SNIPPET_BYTES
+                else:
+                    limit = HTTP_BODY_CAP
+
+                size, body_hash, snippet, truncated = _read_body(response, limit, deadline, url, cancel)
+                telemetry.incr('http_bytes', protocol, size)
+
+                # Content-Length counts encoded bytes, so it only stands in for bodies we didn't finish
+                page_size = length if truncated and length is not None else size
+
+            favicon = None
+            if mode in FAVICON_PROBE_MODES and get_matcher().favicons and not (cancel is not None and cancel.is_set()):
+                favicon = _favicon(session, response, timeout, deadline)
+
+            return (_result(protocol, response, page_size, body_hash, snippet, favicon, markers),
+                    response.status_code in THROTTLE_STATUSES)
+
+    except _Cancelled as e:
+        telemetry.incr('http_bytes', protocol, e.args[0])
+        telemetry.incr('http_cancelled', protocol)
+        return None, False
+    except requests.exceptions.Timeout:
+        telemetry.incr('http_timeouts', protocol)
+        return None, True
+    except (requests.exceptions.SSLError,
+            requests.exceptions.ConnectionError) as e:
+        telemetry.incr('http_errors', protocol)
+        # Refused connections are a closed port, resets mean the target is pushing back
+        return None, any(marker in str(e) for marker in RESET_MARKERS)
+    except Exception as e:
+        logging.error(f"HTTP error on {url}: {e}")
+        telemetry.incr('http_errors', protocol)
+        return None, False
+
+def _race_probe(race, protocol, subdomain, mode=None, markers=None):
+    """Probe a host on one protocol once its turn in the race comes"""
+    if not race.wait_turn(protocol):
+        return None, False
+
+    result, congested = _probe(protocol, subdomain, mode, markers, race.stops[protocol],
+                               lambda: race.answered(protocol))
+    if result is None:
+        race.failed(protocol)
+
+    return result, congested
+
+def probe_batch(subdomains, workers=None, addresses=None, mode=None, markers=None):
+    """Probe many hosts concurrently, yielding (subdomain, results) as they complete
+
+    A working HTTPS answer wins, HTTP is only used when HTTPS fails. HTTP
+    starts once HTTPS failed or after HTTP_HEAD_START, so a host never waits
+    for the HTTPS timeout before its fallback starts, and stops as soon as
+    HTTPS gets a response, so a host that answers on both only downloads
+    one body (see _Race).
+
+    How many hosts are probed at once adapts to the targets: a limit per
+    destination IP (from addresses, {subdomain: [ip, ...]}, else per host)
+    and one for the batch, capped at workers, both AIMD controlled.
+    
+    mode is one of PROBE_MODES, HTTP_PROBE_MODE by default. Results carry
+    status_code, page_size, the fingerprint (FINGERPRINT_FIELDS), the
+    detected technologies ({name: version or None}) and body_marker, the
+    first marker found of the host's markers ({subdomain: [bytes, ...]}).
+    """
+    ceiling = workers or HTTP_WORKERS
+    addresses = addresses or {}
+    markers = markers or {}
+    batch_limit = AimdLimit(HTTP_GLOBAL_INITIAL, ceiling)
+
+    pending = iter(subdomains)
+    exhausted = False
+    queued = OrderedDict()  # destination -> deque of subdomains waiting for room
+    buffered = 0
+    in_flight = {}   # future -> (subdomain, protocol)
+    probes = {}      # subdomain -> {protocol: future}
+    races = {}       # subdomain -> _Race of its probes
+    answers = {}     # subdomain -> {protocol: result}
+    active = {}      # subdomain -> (destination, ip slot, batch slot) of hosts being probed
+    congested = {}   # subdomain -> True once any of its probes saw congestion
+
+    def release(subdomain, answered):
+        """Free the slots of a finished host and adapt the limits"""
+        destination, ip_slot, batch_slot = active.pop(subdomain)
+        pushed_back = congested.pop(subdomain, False)
+
+        with _ip_limits_lock:
+            _ip_limit(destination).finish(ip_slot, answered, pushed_back)
+            batch_limit.finish(batch_slot, answered, pushed_back)
+
+        if pushed_back:
+            telemetry.incr('http_backoffs')
+
+    with ThreadPoolExecutor(max_workers=ceiling * len(PROTOCOLS), thread_name_prefix="http-probe") as pool:
+
+        def submit_ready():
+            """Start queued hosts while their destination and the batch have room"""
+            nonlocal exhausted, buffered
+
+            while not exhausted and buffered < ceiling * HTTP_LOOKAHEAD:
+                subdomain = next(pending, None)
+                if subdomain is None:
+                    exhausted = True
+                    break
+
+                ips = addresses.get(subdomain)
+                queued.setdefault(ips[0] if ips else subdomain, deque()).append(subdomain)
+                buffered += 1
+
+            with _ip_limits_lock:
+                for destination in list(queued):
+                    limit = _ip_limit(destination)
+                    hosts = queued[destination]
+
+                    while hosts and limit.has_room() and batch_limit.has_room():
+                        subdomain = hosts.popleft()
+                        buffered -= 1
+                        active[subdomain] = (destination, limit.start(), batch_limit.start())
+                        probes[subdomain] = {}
+                        answers[subdomain] = {}
+                        races[subdomain] = _Race(PROTOCOLS)
+
+                        for protocol in PROTOCOLS:
+                            future = pool.submit(_race_probe, races[subdomain], protocol, subdomain, mode,
+                                                 markers.get(subdomain))
+                            in_flight[future] = (subdomain, protocol)
+                            probes[subdomain][protocol] = future
+
+                    if not hosts:
+                        del queued[destination]
+                    if not batch_limit.has_room():
+                        break
+
+        submit_ready()
+
+        try:
+            while in_flight or queued or not exhausted:
+                if not in_flight:
+                    # Our destinations are saturated by other batches, wait for room
+                    time.sleep(0.05)
+                    submit_ready()
+                    continue
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    if future not in in_flight:
+                        continue
+
+                    subdomain, protocol = in_flight.pop(future)
+                    answers[subdomain][protocol], pushed_back = future.result()
+                    if pushed_back:
+                        congested[subdomain] = True
+
+                    # First protocol in preference order that answered, once everything before it failed
+                    final = None
+                    for candidate in PROTOCOLS:
+                        if candidate not in answers[subdomain]:
+                            break
+                        if answers[subdomain][candidate]:
+                            final = answers[subdomain][candidate]
+                            break
+                    else:
+                        final = {}
+
+                    if final is None:
+                        continue
+
+                    # Stop the other protocol(s) of this host: queued probes never start,
+                    # running ones quit reading at their next chunk and close the response
+                    races.pop(subdomain).stop()
+                    for other in probes.pop(subdomain).values():
+                        if other in in_flight:
+                            other.cancel()
+                            del in_flight[other]
+                    del answers[subdomain]
+                    release(subdomain, bool(final))
+
+                    results = {
+                        'status_code': final.get('status_code'),
+                        'page_size': final.get('page_size'),
+                        **{field: final.get(field) for field in FINGERPRINT_FIELDS},
+                        'technologies': final.get('technologies') or {},
+                        'body_marker': final.get('body_marker')
+                    }
+
+                    if results['status_code']:
+                        logging.info(f"HTTP {subdomain} - Status: {results['status_code']}, Size: {results['page_size']} bytes")
+
+                    yield subdomain, results
+
+                submit_ready()
+                telemetry.set_gauge('http_concurrency_limit', int(batch_limit.limit))
+        finally:
+            # Abandoned early, don't run what is still queued, stop what runs and give the slots back
+            for race in races.values():
+                race.stop()
+            for future in in_flight:
+                future.cancel()
+            for subdomain in list(active):
+                congested.pop(subdomain, None)
+                release(subdomain, False)
@@ -0,0 +1,146 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+
+from database import count_subdomains, get_existing_subdomains, iter_subdomain_names
+
+# Index Settings
+KNOWN_INDEX_CHUNK = 200000             # Names hashed and sorted at a time while loading
+KNOWN_INDEX_BLOOM_THRESHOLD = 5000000  # Known names above which only a Bloom filter is kept
+BLOOM_ERROR_RATE = 0.01                # Share of new names the Bloom filter sends to the database
+
+def name_hash(name):
+    """Get the stable 64-bit hash of a subdomain name"""
+    return int.from_bytes(blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class BloomFilter:
+    """Bit array Bloom filter over 64-bit name hashes, k probes by double hashing"""
+
+    def __init__(self, capacity, error_rate=None):
+        error_rate = error_rate or BLOOM_ERROR_RATE
+        capacity = max(capacity, 1)
+
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.probes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        """Get the bit positions of a hash"""
+        low, high = value & 0xFFFFFFFF, value >> 32 | 1
+        return ((low + i * high) % self.size for i in range(self.probes))
+
+    def add(self, value):
+        """Set the bits of a hash"""
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+    def memory_bytes(self):
+        """Get the size of the bit array"""
+        return len(self._bits)
+
+class KnownIndex:
+    """Compact set of a domain's known subdomains, loaded once per scan
+
+    Names are kept as a sorted array of 64-bit hashes (8 bytes per name)
+    instead of Python strings (~100 bytes each), so a million known names
+    fit in about 8 MB. A 64-bit collision between a new and a known name
+    is possible in theory (about 1 in 10^13 per lookup at a million names)
+    and would make that new host look known.
+
+    Above KNOWN_INDEX_BLOOM_THRESHOLD names only a Bloom filter is kept
+    (about 1.2 MB per million names). Names it rules out are new for sure,
+    the ones it matches are confirmed with one batched database read.
+    """
+
+    def __init__(self, domain_id, hashes=None, bloom=None):
+        self.domain_id = domain_id
+        self._hashes = hashes if hashes is not None else array('Q')
+        self._bloom = bloom
+        self._added = set()  # Hashes of names inserted since loading
+        self._count = len(self._hashes)
+
+    @classmethod
+    def load(cls, domain_id, bloom=None):
+        """Build the index from the database
+
+        Hashes are sorted in chunks and merged, so loading never holds more
+        than one chunk of Python ints. bloom=None keeps only a Bloom filter
+        once the domain has more than KNOWN_INDEX_BLOOM_THRESHOLD names.
+        """
+        count = count_subdomains(domain_id)
+        if bloom is None:
+            bloom = count > KNOWN_INDEX_BLOOM_THRESHOLD
+
+        if bloom:
+            index = cls(domain_id, bloom=BloomFilter(count))
+            for name in iter_subdomain_names(domain_id):
+                index._bloom.add(name_hash(name))
+                index._count += 1
+            return index
+
+        chunks = []
+        chunk = []
+        for name in iter_subdomain_names(domain_id):
+            chunk.append(name_hash(name))
+            if len(chunk) >= KNOWN_INDEX_CHUNK:
+                chunks.append(array('Q', sorted(chunk)))
+                chunk = []
+        if chunk:
+            chunks.append(array('Q', sorted(chunk)))
+
+        hashes = chunks[0] if len(chunks) == 1 else array('Q', heapq.merge(*chunks))
+        return cls(domain_id, hashes)
+
+    def _maybe_known(self, value):
+        """Check a hash against recent additions and the Bloom filter or the sorted array"""
+        if value in self._added:
+            return True
+        if self._bloom is not None:
+            return value in self._bloom
+
+        i = bisect_left(self._hashes, value)
+        return i < len(self._hashes) and self._hashes[i] == value
+
+    def __contains__(self, name):
+        return not self.split([name])[0]
+
+    def __len__(self):
+        return self._count + len(self._added)
+
+    def split(self, names):
+        """Split names into (new, known) lists, reading the database only for Bloom matches"""
+        new, known = [], []
+
+        for name in names:
+            (known if self._maybe_known(name_hash(name)) else new).append(name)
+
+        if self._bloom is not None and known:
+            # Bloom false positives are new after all
+            existing = get_existing_subdomains(self.domain_id, known)
+            new += [name for name in known if name not in existing]
+            known = [name for name in known if name in existing]
+
+        return new, known
+
+    def add(self, names):
+        """Remember names that were just inserted"""
+        self._added.update(name_hash(name) for name in names)
+
+    def memory_bytes(self):
+        """Get the approximate memory held by the index"""
+        size = self._hashes.buffer_info()[1] * self._hashes.itemsize
+        size += len(self._added) * 64  # Set slot plus int object
+        if self._bloom is not None:
+            size += self._bloom.memory_bytes()
+        return size
+
+    def bytes_per_million(self):
+        """Get the memory used per million indexed names, None while empty"""
+        if not len(self):
+            return None
+        return self.memory_bytes() / len(self) * 1000000
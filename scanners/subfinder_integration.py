@@ -2,57 +2,96 @@ import subprocess
 import json
 import logging
 import shutil
+import tempfile
+import threading
+import time
+
+import telemetry
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# subfinder Settings
+SUBFINDER_TIMEOUT = 120  # 2 minutes timeout, hosts found until then are kept
+
 def check_subfinder_installed():
     """Check if subfinder is installed"""
     return shutil.which('subfinder') is not None
 
-def scan_subdomains_osint(domain):
-    """Execute passive subdomain enumeration via subfinder"""
-    subdomains = set()
+def stream_subdomains_osint(domain, timeout=None):
+    """Yield subdomains from subfinder as they are found, keeping partial results on timeout"""
+    timeout = timeout or SUBFINDER_TIMEOUT
     
     # Check if subfinder is installed
     if not check_subfinder_installed():
         logging.error("subfinder is not installed. Please install it first:")
         logging.error("go install -v github.com/projectdiscovery/subfinder/v2/cmd/subfinder@latest")
-        return subdomains
+        return
     
     logging.info(f"Running subfinder for {domain['name']}")
     
+    seen = set()
+    timed_out = threading.Event()
+    started = time.monotonic()
+    
     try:
-        # Run subfinder with JSON output
-        result = subprocess.run(
-            ['subfinder', '-d', domain['name'], '-json', '-silent'],
-            capture_output=True,
-            text=True,
-            timeout=120  # 2 minutes timeout
-        )
-        
-        if result.returncode != 0:
-            logging.error(f"subfinder error: {result.stderr}")
-            return subdomains
-        
-        # Parse JSON output (one JSON object per line)
-        for line in result.stdout.strip().split('\n'):
-            if line:
-                try:
-                    data = json.loads(line)
+        with tempfile.TemporaryFile(mode='w+') as stderr:
+            # Run subfinder with JSON output, read line by line while it runs
+            process = subprocess.Popen(
+                ['subfinder', '-d', domain['name'], '-json', '-silent'],
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                text=True,
+                bufsize=1
+            )
+            
+            def kill():
+                timed_out.set()
+                process.kill()
+            
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+            
+            try:
+                # Parse JSON output (one JSON object per line)
+                for line in process.stdout:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    
+                    try:
+                        data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    
                     subdomain = data.get('host', '').strip().lower()
-                    if subdomain:
-                        subdomains.add(subdomain)
-                except json.JSONDecodeError:
-                    continue
+                    if subdomain and subdomain not in seen:
+                        seen.add(subdomain)
+                        telemetry.incr('subfinder_hosts', domain['name'])
+                        yield subdomain
+            finally:
+                timer.cancel()
+                if process.poll() is None:
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+            
+            telemetry.observe('subfinder_seconds', time.monotonic() - started, domain['name'])
+            
+            if timed_out.is_set():
+                telemetry.incr('subfinder_timeouts', domain['name'])
+                logging.error(f"subfinder timeout for {domain['name']}, keeping {len(seen)} subdomains found so far")
+            elif process.returncode != 0:
+                stderr.seek(0)
+                logging.error(f"subfinder error: {stderr.read()}")
         
-        logging.info(f"Found {len(subdomains)} subdomains for {domain['name']}")
+        logging.info(f"Found {len(seen)} subdomains for {domain['name']}")
         
-    except subprocess.TimeoutExpired:
-        logging.error(f"subfinder timeout for {domain['name']}")
     except Exception as e:
         logging.error(f"subfinder error: {e}")
-    
-    return subdomains
\ No newline at end of file
+
+def scan_subdomains_osint(domain):
+    """Execute passive subdomain enumeration via subfinder"""
+    return set(stream_subdomains_osint(domain))
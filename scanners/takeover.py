@@ -0,0 +1,101 @@
+import json
+import logging
+import os
+import threading
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Takeover Settings
+DANGLING_CNAME = 'Dangling CNAME'  # Flag of NXDOMAIN chains that end outside every known provider
+TAKEOVER_FINGERPRINTS_PATH = os.environ.get(
+    "WHITERABBIT_TAKEOVER_FINGERPRINTS",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "takeover.json")
+)
+
+_index = None
+_index_lock = threading.Lock()
+
+class TakeoverIndex:
+    """Takeover fingerprints indexed by CNAME suffix
+
+    Fingerprints map a provider to the CNAME suffixes of its services,
+    whether a target that doesn't resolve (NXDOMAIN) can be claimed, and
+    the body markers of its "nothing here" page. Every suffix is a key of
+    one dict, so finding the provider of a name costs one lookup per label
+    however many fingerprints there are.
+    """
+
+    def __init__(self, fingerprints):
+        self._suffixes = {}  # suffix -> (provider, nxdomain, body markers)
+
+        for provider, fingerprint in fingerprints.items():
+            entry = (
+                provider,
+                bool(fingerprint.get('nxdomain')),
+                [marker.encode('utf-8') for marker in fingerprint.get('body', [])]
+            )
+            for suffix in fingerprint.get('cname', []):
+                self._suffixes[suffix.lower().strip('.')] = entry
+
+        self.count = len(fingerprints)
+
+    @classmethod
+    def load(cls, path=None):
+        """Index the fingerprints of a JSON file, TAKEOVER_FINGERPRINTS_PATH by default"""
+        with open(path or TAKEOVER_FINGERPRINTS_PATH, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def lookup(self, name):
+        """Get (provider, nxdomain, body markers) of the longest known suffix of a name, None if unknown"""
+        position = 0
+
+        while position >= 0:
+            entry = self._suffixes.get(name[position:])
+            if entry:
+                return entry
+            position = name.find('.', position) + 1 or -1
+
+        return None
+
+    def classify(self, chain, status):
+        """Classify a host by its CNAME chain and DNS status
+
+        Returns (provider, markers): provider is None when the host isn't
+        a candidate, markers None when DNS alone flags it, else the body
+        markers a probe of the host has to find to confirm it.
+        """
+        if not chain:
+            return None, None
+
+        # The first hop on a provider is the name someone could claim
+        entry = next(filter(None, map(self.lookup, chain)), None)
+
+        if status == 'nxdomain':
+            if entry is None:
+                return DANGLING_CNAME, None
+            return (entry[0], None) if entry[1] else (None, None)
+
+        if status == 'ok' and entry and entry[2]:
+            return entry[0], entry[2]
+
+        return None, None
+
+def get_takeover_index():
+    """Get the process-wide takeover index, built on first use"""
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = TakeoverIndex.load()
+                except (OSError, ValueError) as e:
+                    logging.error(f"Takeover fingerprints not loaded from {TAKEOVER_FINGERPRINTS_PATH}: {e}")
+                    _index = TakeoverIndex({})
+                else:
+                    logging.info(f"Loaded {_index.count} takeover fingerprints")
+
+    return _index
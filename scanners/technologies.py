@@ -0,0 +1,292 @@
+import json
+import logging
+import os
+import re
+import threading
+from hashlib import md5
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants, sre_parse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Fingerprinting Settings
+TECH_MIN_LITERAL = 3  # Shortest literal a body pattern is prefiltered on, others always run
+TECH_SIGNATURES_PATH = os.environ.get(
+    "WHITERABBIT_TECH_SIGNATURES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "technologies.json")
+)
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def favicon_hash(data):
+    """Get the favicon hash signatures are written with, MD5 hex of the raw file"""
+    return md5(data).hexdigest()
+
+def _required_literals(parsed):
+    """Get literals one of which appears in every match of a parsed pattern, None if there are none
+
+    Prefers the set whose shortest literal is longest, a longer literal
+    means fewer false candidates.
+    """
+    best = None
+    run = []
+
+    def consider(options):
+        nonlocal best
+        if options and (best is None or min(map(len, options)) > min(map(len, best))):
+            best = options
+
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            run.append(chr(av))
+            continue
+
+        consider(["".join(run)] if run else None)
+        run = []
+
+        if op is sre_constants.SUBPATTERN:
+            consider(_required_literals(av[-1]))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT) and av[0] >= 1:
+            consider(_required_literals(av[2]))
+        elif op is sre_constants.BRANCH:
+            options = [_required_literals(branch) for branch in av[1]]
+            if all(options):
+                consider(sorted({literal for option in options for literal in option}))
+
+    consider(["".join(run)] if run else None)
+    return best
+
+def _trie_pattern(literals):
+    """Build a regex matching any of the literals, shared prefixes merged so each position tries few branches"""
+    trie = {}
+    for literal in literals:
+        node = trie
+        for byte in literal:
+            node = node.setdefault(byte, {})
+        node[None] = True
+
+    def emit(node):
+        branches = [re.escape(bytes([byte])) + emit(child) for byte, child in sorted(
+            (byte, child) for byte, child in node.items() if byte is not None
+        )]
+        if not branches:
+            return b''
+
+        pattern = branches[0] if len(branches) == 1 else b'(?:' + b'|'.join(branches) + b')'
+        # Greedy, a hit is the longest literal starting there
+        return b'(?:' + pattern + b')?' if None in node else pattern
+
+    return emit(trie)
+
+def _combine(alternatives, flags):
+    """Compile (technology, pattern) pairs into one alternation
+
+    Every pattern becomes a named group, so a match tells which technology
+    it belongs to and where that pattern's own first group (the version)
+    sits. Returns (compiled, {group name: (technology, version group)}).
+    """
+    parts = []
+    groups = {}
+    group = 1
+
+    for technology, pattern in alternatives:
+        try:
+            own_groups = re.compile(pattern, flags).groups
+        except re.error as e:
+            logging.warning(f"Skipping invalid signature pattern of {technology}: {pattern} ({e})")
+            continue
+
+        name = f"t{len(parts)}"
+        parts.append(f"(?P<{name}>{pattern})")
+        groups[name] = (technology, group + 1 if own_groups else None)
+        group += 1 + own_groups
+
+    if not parts:
+        return None, {}
+
+    return re.compile("|".join(parts), flags), groups
+
+def _record(found, technology, version):
+    """Note a matched technology, keeping the first version seen"""
+    if isinstance(version, bytes):
+        version = version.decode('ascii', errors='replace')
+
+    found[technology] = found.get(technology) or version or None
+
+class TechMatcher:
+    """Signature set compiled into a few combined matchers
+
+    Signatures map a technology to header patterns (by header name),
+    cookie patterns (by cookie name, itself a pattern), body patterns,
+    favicon hashes and the technologies it implies. Patterns are
+    case-insensitive and their first group, if any, is the version.
+
+    Header and cookie patterns are joined into one alternation per header
+    and one for the cookies. Body patterns are prefiltered instead: one
+    regex of every pattern's required literal scans the lowercased body
+    once, and only the patterns whose literal showed up run on their own.
+    """
+
+    def __init__(self, signatures):
+        headers = {}   # header -> [(technology, pattern)]
+        present = {}   # header -> [technology], patterns that only need the header
+        cookies = []
+        self.favicons = {}
+        self.implies = {}
+        self._html = []       # [(technology, compiled)]
+        self._literals = {}   # literal -> indexes into _html of the patterns it stands for
+        self._unfiltered = [] # indexes into _html of patterns without a usable literal
+
+        for technology, signature in signatures.items():
+            for header, pattern in signature.get('headers', {}).items():
+                if pattern:
+                    headers.setdefault(header.lower(), []).append((technology, pattern))
+                else:
+                    present.setdefault(header.lower(), []).append(technology)
+
+            for cookie, pattern in signature.get('cookies', {}).items():
+                cookies.append((technology, f"^(?:{cookie})=" + (f"(?:{pattern})" if pattern else "")))
+
+            for pattern in signature.get('html', []):
+                self._add_html(technology, pattern)
+
+            for value in signature.get('favicon', []):
+                self.favicons[value.lower()] = technology
+
+            if signature.get('implies'):
+                self.implies[technology] = list(signature['implies'])
+
+        self._headers = {header: _combine(patterns, re.IGNORECASE) for header, patterns in headers.items()}
+        self._present = present
+        self._cookies = _combine(cookies, re.IGNORECASE | re.MULTILINE)
+
+        # A hit on a literal also stands for the shorter literals inside it
+        self._candidates = {
+            literal: set().union(*(indexes for other, indexes in self._literals.items() if other in literal))
+            for literal in self._literals
+        }
+        # Literals that can start inside a hit on another one and run past its end
+        self._overlaps = {
+            literal: [other for other in self._literals if other not in literal and any(
+                literal.endswith(other[:size]) for size in range(1, len(other))
+            )]
+            for literal in self._literals
+        }
+        self._prefilter = re.compile(_trie_pattern(self._literals)) if self._literals else None
+        self.count = len(signatures)
+
+    def _add_html(self, technology, pattern):
+        """Compile a body pattern and register its required literals"""
+        try:
+            compiled = re.compile(pattern.encode('utf-8'), re.IGNORECASE)
+            literals = _required_literals(sre_parse.parse(pattern))
+        except re.error as e:
+            logging.warning(f"Skipping invalid signature pattern of {technology}: {pattern} ({e})")
+            return
+
+        index = len(self._html)
+        self._html.append((technology, compiled))
+
+        if not literals or min(map(len, literals)) < TECH_MIN_LITERAL:
+            self._unfiltered.append(index)
+            return
+
+        for literal in literals:
+            self._literals.setdefault(literal.lower().encode('utf-8'), set()).add(index)
+
+    @classmethod
+    def load(cls, path=None):
+        """Compile the signatures of a JSON file, TECH_SIGNATURES_PATH by default"""
+        with open(path or TECH_SIGNATURES_PATH, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _body_candidates(self, body):
+        """Get the body patterns worth running, one pass of the literal prefilter"""
+        candidates = set(self._unfiltered)
+        if self._prefilter is None:
+            return candidates
+
+        lowered = body.lower()
+
+        for literal in set(self._prefilter.findall(lowered)):
+            candidates |= self._candidates[literal]
+
+            # Hits don't overlap, look for what the hit may have hidden
+            for other in self._overlaps[literal]:
+                if not self._candidates[other] <= candidates and other in lowered:
+                    candidates |= self._candidates[other]
+
+        return candidates
+
+    def match(self, headers=None, cookies=None, body=None, favicon=None):
+        """Get the technologies of a response as {name: version or None}
+
+        headers is a mapping or (name, value) pairs, repeated headers best
+        given one pair each, cookies (name, value) pairs, body the bytes to
+        search and favicon the favicon hash (favicon_hash()) if one was fetched.
+        """
+        found = {}
+        headers = headers or {}
+
+        for header, value in headers.items() if hasattr(headers, 'items') else headers:
+            header = header.lower()
+
+            for technology in self._present.get(header, ()):
+                found.setdefault(technology, None)
+
+            regex, groups = self._headers.get(header, (None, None))
+            if regex is not None:
+                for match in regex.finditer(value):
+                    technology, version_group = groups[match.lastgroup]
+                    _record(found, technology, match.group(version_group) if version_group else None)
+
+        regex, groups = self._cookies
+        if cookies and regex is not None:
+            for match in regex.finditer("\n".join(f"{name}={value}" for name, value in cookies)):
+                technology, version_group = groups[match.lastgroup]
+                _record(found, technology, match.group(version_group) if version_group else None)
+
+        if body:
+            for index in self._body_candidates(body):
+                technology, compiled = self._html[index]
+                match = compiled.search(body)
+                if match:
+                    _record(found, technology, match.group(1) if compiled.groups else None)
+
+        if favicon and favicon.lower() in self.favicons:
+            found.setdefault(self.favicons[favicon.lower()], None)
+
+        # Implied technologies, e.g. WordPress runs on PHP
+        pending = [technology for technology in found if technology in self.implies]
+        while pending:
+            for implied in self.implies[pending.pop()]:
+                if implied not in found:
+                    found[implied] = None
+                    if implied in self.implies:
+                        pending.append(implied)
+
+        return found
+
+def get_matcher():
+    """Get the process-wide matcher, compiled on first use"""
+    global _matcher
+
+    if _matcher is None:
+        with _matcher_lock:
+            if _matcher is None:
+                try:
+                    _matcher = TechMatcher.load()
+                except (OSError, ValueError) as e:
+                    logging.error(f"Technology signatures not loaded from {TECH_SIGNATURES_PATH}: {e}")
+                    _matcher = TechMatcher({})
+                else:
+                    logging.info(f"Loaded {_matcher.count} technology signatures")
+
+    return _matcher
@@ -0,0 +1,95 @@
+import logging
+import secrets
+import threading
+import time
+
+from .dns_cache import CACHEABLE_STATUSES
+from .dns_engine import resolve_batch
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Wildcard Detection Settings
+WILDCARD_PROBES = 2   # Random labels resolved per zone
+WILDCARD_TTL = 3600   # Seconds a zone fingerprint is reused
+
+_zones = {}  # zone -> (expires_at, frozenset of wildcard addresses, empty if none)
+_zones_lock = threading.Lock()
+
+def parent_zones(subdomain, apex):
+    """Get the parent zones of subdomain up to and including apex, closest first"""
+    labels = subdomain.split('.')
+    zones = []
+
+    for i in range(1, len(labels)):
+        zone = '.'.join(labels[i:])
+        if zone != apex and not zone.endswith('.' + apex):
+            break
+
+        zones.append(zone)
+        if zone == apex:
+            break
+
+    return zones
+
+def fingerprint_zones(zones):
+    """Get the wildcard answer set of each zone, resolving random labels for unknown ones"""
+    now = time.time()
+    fingerprints = {}
+    missing = set()
+
+    with _zones_lock:
+        for zone in zones:
+            entry = _zones.get(zone)
+            if entry and entry[0] > now:
+                fingerprints[zone] = entry[1]
+            else:
+                missing.add(zone)
+
+    if missing:
+        # A name nobody registered only resolves through a wildcard
+        probes = {
+            f"wr-{secrets.token_hex(8)}.{zone}": zone
+            for zone in missing
+            for _ in range(WILDCARD_PROBES)
+        }
+        answers = {zone: set() for zone in missing}
+        inconclusive = set()
+
+        for result in resolve_batch(probes, cache=False):
+            zone = probes[result['subdomain']]
+            answers[zone].update(result['addresses'])
+            if result['status'] not in CACHEABLE_STATUSES:
+                inconclusive.add(zone)
+
+        with _zones_lock:
+            for zone, addresses in answers.items():
+                # A timed out or failed probe proves nothing, the next batch fingerprints the zone again
+                if zone not in inconclusive:
+                    _zones[zone] = (now + WILDCARD_TTL, frozenset(addresses))
+                fingerprints[zone] = frozenset(addresses)
+
+                if addresses:
+                    logging.info(f"Wildcard DNS detected for *.{zone}: {', '.join(sorted(addresses))}")
+
+    return fingerprints
+
+def classify_wildcards(apex, resolved):
+    """Get the hosts whose answers are fully explained by a wildcard of a parent zone
+
+    resolved maps each subdomain to the addresses it resolved to.
+    """
+    zones_of = {subdomain: parent_zones(subdomain, apex) for subdomain in resolved}
+    fingerprints = fingerprint_zones({zone for zones in zones_of.values() for zone in zones})
+
+    wildcards = set()
+    for subdomain, addresses in resolved.items():
+        for zone in zones_of[subdomain]:
+            wildcard = fingerprints.get(zone)
+            if wildcard and addresses and set(addresses) <= wildcard:
+                wildcards.add(subdomain)
+                break
+
+    return wildcards
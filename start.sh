@@ -10,17 +10,22 @@ streamlit run Dashboard.py --server.address 0.0.0.0 --server.enableCORS false --
 STREAMLIT_PID=$!
 echo "Streamlit started (PID: $STREAMLIT_PID)"
 
-# Start Scanner Worker in background
-python scanner_worker.py > scanner.log 2>&1 &
-SCANNER_PID=$!
-echo "Scanner worker started (PID: $SCANNER_PID)"
+# Start Scanner Workers in background, they split the work through leased jobs in the database
+WORKERS=${WHITERABBIT_WORKERS:-1}
+rm -f .scanner.pid
+for i in $(seq 1 $WORKERS); do
+    if [ "$i" -eq 1 ]; then LOG=scanner.log; else LOG=scanner-$i.log; fi
+    python scanner_worker.py > $LOG 2>&1 &
+    SCANNER_PID=$!
+    echo $SCANNER_PID >> .scanner.pid
+    echo "Scanner worker $i started (PID: $SCANNER_PID, log: $LOG)"
+done
 
 # Save PIDs
 echo $STREAMLIT_PID > .streamlit.pid
-echo $SCANNER_PID > .scanner.pid
 
 echo ""
 echo "WhiteRabbit is running!"
 echo "Dashboard: http://localhost:8501"
-echo "Logs: tail -f streamlit.log scanner.log"
+echo "Logs: tail -f streamlit.log scanner*.log"
 echo "Stop: ./stop.sh"
\ No newline at end of file
@@ -11,10 +11,11 @@ else
     pkill -f "streamlit run Dashboard.py" && echo "Streamlit stopped" || echo "Streamlit not running"
 fi
 
-# Kill Scanner Worker
+# Kill Scanner Workers
 if [ -f .scanner.pid ]; then
-    SCANNER_PID=$(cat .scanner.pid)
-    kill $SCANNER_PID 2>/dev/null && echo "Scanner worker stopped (PID: $SCANNER_PID)" || echo "Scanner worker not running"
+    for SCANNER_PID in $(cat .scanner.pid); do
+        kill $SCANNER_PID 2>/dev/null && echo "Scanner worker stopped (PID: $SCANNER_PID)" || echo "Scanner worker not running (PID: $SCANNER_PID)"
+    done
     rm .scanner.pid
 else
     pkill -f "scanner_worker.py" && echo "Scanner worker stopped" || echo "Scanner worker not running"
@@ -0,0 +1,108 @@
+"""In-process counters, gauges and latency histograms for the scan pipeline
+
+Recording is a dict update under a lock, cheap enough for per-query calls.
+The worker periodically takes a snapshot() and writes it to the metrics
+table, which the Performance page charts.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds, the last bucket catches the rest
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+_lock = threading.Lock()
+_counters = {}    # (name, label) -> count since the last snapshot
+_gauges = {}      # (name, label) -> last value
+_histograms = {}  # (name, label) -> [bucket counts, count, sum, max]
+_period_start = time.time()
+
+def incr(name, label='', value=1):
+    """Add value to a counter"""
+    key = (name, label)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, label=''):
+    """Set a gauge to its current value"""
+    with _lock:
+        _gauges[(name, label)] = value
+
+def observe(name, seconds, label=''):
+    """Record one duration in a histogram"""
+    index = len(BUCKETS)
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            index = i
+            break
+
+    key = (name, label)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * (len(BUCKETS) + 1), 0, 0.0, 0.0]
+
+        histogram[0][index] += 1
+        histogram[1] += 1
+        histogram[2] += seconds
+        histogram[3] = max(histogram[3], seconds)
+
+@contextmanager
+def timer(name, label=''):
+    """Time a block into a histogram, failures included"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, label)
+
+def quantile(buckets, count, peak, q):
+    """Estimate a quantile from bucket counts, as the upper bound of its bucket capped at the max"""
+    if not count:
+        return None
+
+    rank = q * count
+    seen = 0
+    for bound, bucket in zip(BUCKETS, buckets):
+        seen += bucket
+        if seen >= rank:
+            return min(bound, peak)
+
+    return peak
+
+def snapshot(reset=True):
+    """Get all metrics recorded since the last snapshot
+
+    Counters and histograms are deltas over the period, gauges are current
+    values. Returns (period_start, period_seconds, rows).
+    """
+    global _counters, _histograms, _period_start
+
+    with _lock:
+        counters, gauges, histograms = _counters, dict(_gauges), _histograms
+        started = _period_start
+        if reset:
+            _counters, _histograms = {}, {}
+            _period_start = time.time()
+        else:
+            counters, histograms = dict(counters), {k: [list(v[0])] + v[1:] for k, v in histograms.items()}
+
+    rows = []
+    for (name, label), value in counters.items():
+        rows.append({'name': name, 'label': label, 'kind': 'counter', 'value': value})
+    for (name, label), value in gauges.items():
+        rows.append({'name': name, 'label': label, 'kind': 'gauge', 'value': value})
+    for (name, label), (buckets, count, total, peak) in histograms.items():
+        rows.append({
+            'name': name,
+            'label': label,
+            'kind': 'histogram',
+            'value': total,
+            'count': count,
+            'p50': quantile(buckets, count, peak, 0.5),
+            'p95': quantile(buckets, count, peak, 0.95),
+            'p99': quantile(buckets, count, peak, 0.99),
+            'max': peak
+        })
+
+    return started, time.time() - started, rows
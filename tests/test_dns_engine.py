@@ -0,0 +1,117 @@
+"""DNS engine against local stub servers: retries, resolver rotation, CNAME chains and negative TTLs"""
+import pytest
+
+from benchmarks.stub_dns import CNAME_ZONE, StubDnsServer
+from scanners.dns_engine import resolve_batch
+
+ZONE = 'example.test'
+
+@pytest.fixture
+def servers():
+    """Start stub servers on one port and different loopback addresses, so the engine sees separate resolvers"""
+    started = []
+
+    def start(count=1, **options):
+        for i in range(count):
+            host = f"127.0.0.{len(started) + 1}"
+            port = started[0].port if started else None
+            try:
+                started.append(StubDnsServer(host=host, port=port, **options.get(host, {})).start())
+            except OSError:
+                pytest.skip(f"Can't listen on {host}")
+
+        return started
+
+    yield start
+
+    for server in started:
+        server.stop()
+
+def resolve(servers, names, **options):
+    """Resolve names through the stub servers, bypassing the shared cache, by subdomain"""
+    results = resolve_batch(names, nameservers=[server.host for server in servers],
+                            port=servers[0].port, timeout=0.2, cache=False, **options)
+    return {result['subdomain']: result for result in results}
+
+def test_answers_and_nxdomain(servers):
+    stub = servers()
+    results = resolve(stub, [f"h1.{ZONE}", f"missing.{ZONE}"], retries=0)
+
+    assert results[f"h1.{ZONE}"]['status'] == 'ok'
+    assert results[f"h1.{ZONE}"]['addresses'] == ['127.0.0.1']
+    assert results[f"h1.{ZONE}"]['ttl'] == 300
+    assert results[f"missing.{ZONE}"]['status'] == 'nxdomain'
+    assert not results[f"missing.{ZONE}"]['resolves']
+
+def test_retries_timeout_on_next_resolver(servers):
+    stub = servers(2, **{'127.0.0.1': {'timeout_ratio': 1.0}})
+    names = [f"h{i}.{ZONE}" for i in range(4)]
+
+    # One query at a time, so every name tries the dead resolver first
+    results = resolve(stub, names, retries=1, concurrency=1)
+
+    assert all(result['status'] == 'ok' for result in results.values())
+    assert all(result['resolver'] == '127.0.0.2' for result in results.values())
+    assert stub[0].queries == len(names)
+    assert stub[1].queries == len(names)
+
+def test_retries_servfail_on_next_resolver(servers):
+    stub = servers(2, **{'127.0.0.1': {'servfail_ratio': 1.0}})
+    names = [f"h{i}.{ZONE}" for i in range(4)]
+
+    results = resolve(stub, names, retries=1, concurrency=1)
+
+    assert all(result['status'] == 'ok' for result in results.values())
+    assert stub[0].queries == len(names)
+
+def test_gives_up_after_retries(servers):
+    stub = servers(**{'127.0.0.1': {'timeout_ratio': 1.0}})
+
+    result = resolve(stub, [f"h1.{ZONE}"], retries=2)[f"h1.{ZONE}"]
+
+    assert result['status'] == 'timeout'
+    assert not result['resolves']
+    assert stub[0].queries == 3
+
+def test_round_robin_over_resolvers(servers):
+    stub = servers(2)
+    names = [f"h{i}.{ZONE}" for i in range(10)]
+
+    results = resolve(stub, names, retries=0)
+
+    assert all(result['status'] == 'ok' for result in results.values())
+    assert [server.queries for server in stub] == [5, 5]
+    assert sorted(result['resolver'] for result in results.values()) == ['127.0.0.1'] * 5 + ['127.0.0.2'] * 5
+
+def test_cname_chain(servers):
+    stub = servers(**{'127.0.0.1': {'cname_ratio': 1.0}})
+
+    result = resolve(stub, [f"h1.{ZONE}"], retries=0)[f"h1.{ZONE}"]
+
+    assert result['status'] == 'ok'
+    assert result['addresses'] == ['127.0.0.1']
+    assert result['cname'] == ['h1.' + CNAME_ZONE.rstrip('.')]
+
+def test_dangling_cname_chain(servers):
+    stub = servers(**{'127.0.0.1': {'cname_ratio': 1.0, 'nxdomain_ratio': 1.0}})
+
+    result = resolve(stub, [f"h1.{ZONE}"], retries=0)[f"h1.{ZONE}"]
+
+    assert result['status'] == 'nxdomain'
+    assert result['cname'] == ['h1.' + CNAME_ZONE.rstrip('.')]
+
+def test_negative_ttl_from_soa(servers):
+    stub = servers(**{'127.0.0.1': {'negative_ttl': 60}})
+
+    result = resolve(stub, [f"missing.{ZONE}"], retries=0)[f"missing.{ZONE}"]
+
+    assert result['status'] == 'nxdomain'
+    assert result['ttl'] == 60
+
+def test_negative_ttl_without_soa(servers):
+    stub = servers()
+
+    result = resolve(stub, [f"missing.{ZONE}"], retries=0)[f"missing.{ZONE}"]
+
+    assert result['status'] == 'nxdomain'
+    assert result['ttl'] is None
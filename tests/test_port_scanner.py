@@ -0,0 +1,81 @@
+"""Port scanner against local listeners: open port detection and one scan per IP"""
+import socket
+
+import pytest
+
+from benchmarks.port_sweep import loopback_hosts, open_listeners
+from database import db_manager
+from scanners import checks
+from scanners.port_scanner import parse_ports, scan_batch
+
+@pytest.fixture
+def listeners():
+    """Get (scanned ports, listening ports), a few free ports of which the first two accept connections"""
+    ports = []
+    for _ in range(6):
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(('127.0.0.1', 0))
+            ports.append(sock.getsockname()[1])
+
+    listening, sockets = open_listeners(ports, 2)
+    yield sorted(ports), sorted(listening)
+
+    for server in sockets:
+        server.close()
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the database at a fresh file for the test"""
+    monkeypatch.setattr(db_manager, 'DB_PATH', str(tmp_path / 'subdomains.db'))
+    db_manager.init_db()
+    yield db_manager
+    db_manager.close_connection()
+
+def test_parse_ports():
+    assert parse_ports("443, 80,8000-8002,80") == [80, 443, 8000, 8001, 8002]
+    assert len(parse_ports("top1000")) == 1000
+
+    with pytest.raises(ValueError):
+        parse_ports("0-10")
+    with pytest.raises(ValueError):
+        parse_ports("http")
+
+def test_finds_exactly_the_open_ports(listeners):
+    ports, listening = listeners
+    hosts = loopback_hosts(3)
+
+    found = list(scan_batch(hosts, ports, timeout=1))
+
+    assert len(found) == len(set(found))
+    assert set(found) == {(host, port) for host in hosts for port in listening}
+
+def test_port_scan_once_per_ip(db, listeners, monkeypatch):
+    ports, listening = listeners
+    scanned = []
+
+    def recording_scan(ips, ports, **options):
+        scanned.append(list(ips))
+        return scan_batch(ips, ports, **options)
+
+    monkeypatch.setattr(checks, 'scan_batch', recording_scan)
+
+    domain_id = db.add_domain('example.test', [])
+    db.set_port_list(domain_id, ','.join(map(str, ports)))
+    domain = db.get_domain(domain_id)
+    ids = db.add_subdomains(domain_id, ['a.example.test', 'b.example.test', 'c.example.test', 'd.example.test'])
+    scanned_ips = {}
+
+    # a and b share an IP, c is on it and one more
+    checks.port_scan(domain, {
+        'a.example.test': ['127.0.0.1'],
+        'b.example.test': ['127.0.0.1'],
+        'c.example.test': ['127.0.0.1', '127.0.0.2']
+    }, ids, scanned_ips)
+    # A later batch of the same scan only sweeps IPs it hasn't seen
+    checks.port_scan(domain, {'d.example.test': ['127.0.0.2', '127.0.0.3']}, ids, scanned_ips)
+
+    assert scanned == [['127.0.0.1', '127.0.0.2'], ['127.0.0.3']]
+    assert db.get_open_ports(ids.values()) == {subdomain_id: listening for subdomain_id in ids.values()}
+
+    stored = db.get_connection().execute("SELECT subdomain_id, ip, port FROM ports").fetchall()
+    assert len(stored) == len(set(stored)) == 6 * len(listening)